@@ -0,0 +1,61 @@
+# encoding: utf-8
+'''
+Per call time of primary key and unique field lookups through Model.get
+(baked, compiled once per key set) versus building and compiling a new
+filter_by query each time.
+
+    python benchmarks/baked_lookup.py [lookups]
+'''
+import sys
+import time
+
+from flask import Flask
+
+from flaskbald.db_ext import db, Model
+
+
+class Account(Model):
+    __tablename__ = 'accounts'
+
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    name = db.Column(db.String(80))
+
+
+def measure(lookup, lookups, rows):
+    start = time.time()
+    for i in range(lookups):
+        lookup(i % rows + 1)
+        # an empty identity map, as at the start of each request
+        db.session.expunge_all()
+    return (time.time() - start) * 1e6 / lookups
+
+
+def run(lookups=20000, rows=1000):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(Account.__table__.insert(), [
+            {'id': i, 'email': 'user{0}@example.com'.format(i),
+             'name': 'user {0}'.format(i)} for i in range(1, rows + 1)])
+        db.session.commit()
+
+        cases = [
+            ('id, uncached query', lambda i: Account.load(id=i).one()),
+            ('id, Model.get', lambda i: Account.get(id=i)),
+            ('email, uncached query', lambda i: Account.load(
+                email='user{0}@example.com'.format(i)).one()),
+            ('email, Model.get', lambda i: Account.get(
+                email='user{0}@example.com'.format(i))),
+        ]
+        print('{0:<24}{1:>12}'.format('', 'us/lookup'))
+        for name, lookup in cases:
+            print('{0:<24}{1:>12.1f}'.format(name,
+                                             measure(lookup, lookups, rows)))
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,131 @@
+# encoding: utf-8
+'''
+Representative flaskbald application used by the benchmark harness: an app
+built with factory.create_app against a sqlite database, with JSON
+api_action list/detail endpoints, a templated action page, a
+user_required endpoint and a validate heavy POST.
+'''
+import os
+import tempfile
+
+from flask import Blueprint
+
+from flaskbald import factory
+from flaskbald.auth import create_jwt, user_required
+from flaskbald.db_ext import db, Model
+from flaskbald.response import action, api_action, request_data
+from flaskbald.validate import (
+    array_length,
+    parameter_required,
+    string_length,
+    type_array,
+    type_boolean,
+    type_number,
+    validate
+)
+
+JWT_SECRET = 'benchmark-secret'
+TEMPLATE_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                             'templates')
+CONFIG = '''
+DEBUG = False
+ADMINS = []
+SQLALCHEMY_DATABASE_URI = 'sqlite:///{db_path}'
+SQLALCHEMY_TRACK_MODIFICATIONS = False
+ALLOWED_HOSTS = '*'
+JWT_CLIENT_SECRET = '{secret}'
+'''
+
+
+class BenchItem(Model):
+    __tablename__ = 'bench_item'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), nullable=False)
+    description = db.Column(db.Text)
+    price = db.Column(db.Float)
+    active = db.Column(db.Boolean, default=True)
+
+    def to_dict(self):
+        return {'id': self.id, 'name': self.name,
+                'description': self.description, 'price': self.price,
+                'active': self.active}
+
+
+bench = Blueprint('bench', __name__)
+
+
+@bench.route('/api/items')
+@api_action
+def item_list():
+    return [item.to_dict() for item in BenchItem.load().limit(100)]
+
+
+@bench.route('/api/items/<int:item_id>')
+@api_action
+def item_detail(item_id):
+    return BenchItem.get(id=item_id).to_dict()
+
+
+@bench.route('/items')
+@action
+def item_page():
+    return 'bench_items.html', {'title': 'Items',
+                                'items': BenchItem.load().limit(50).all()}
+
+
+@bench.route('/api/me')
+@api_action
+@user_required
+def me():
+    return {'ok': True}
+
+
+@bench.route('/api/items', methods=['POST'])
+@api_action
+def item_create():
+    data = request_data()
+    validate(data, {
+        'name': [(parameter_required, 'name', data),
+                 (string_length, 'name', data.get('name'), 80)],
+        'description': [(string_length, 'description',
+                         data.get('description'), 2000)],
+        'price': [(parameter_required, 'price', data),
+                  (type_number, 'price', data.get('price'))],
+        'active': [(type_boolean, 'active', data.get('active'))],
+        'tags': [(type_array, 'tags', data.get('tags')),
+                 (array_length, 'tags', data.get('tags'), 20)],
+    })
+    return {'name': data['name'], 'price': data['price']}
+
+
+def build_app(rows=1000, directory=None):
+    '''
+    Create the benchmark app with a fresh sqlite database of *rows* items.
+    Returns (app, directory holding the config and database).
+    '''
+    directory = directory or tempfile.mkdtemp(prefix='flaskbald-bench-')
+    config_file = os.path.join(directory, 'bench_config.py')
+    with open(config_file, 'w') as config:
+        config.write(CONFIG.format(
+            db_path=os.path.join(directory, 'bench.sqlite'),
+            secret=JWT_SECRET))
+
+    app = factory.create_app(config_file, blueprints=[bench], ssl_only=False,
+                             custom_template_paths=[TEMPLATE_PATH])
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add_all([
+            BenchItem(name='item {0}'.format(i), price=i * 1.25,
+                      description='description of item {0} '.format(i) * 4)
+            for i in range(rows)])
+        db.session.commit()
+    return app, directory
+
+
+def auth_header():
+    token = create_jwt(JWT_SECRET, payload={'sub': 'bench-user'})
+    if isinstance(token, bytes):
+        token = token.decode('utf-8')
+    return {'Authorization': token}
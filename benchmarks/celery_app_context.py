@@ -0,0 +1,51 @@
+# encoding: utf-8
+'''
+Tasks per second for trivial tasks under each FlaskCelery app context mode.
+
+    python benchmarks/celery_app_context.py [iterations]
+'''
+import sys
+import time
+
+from flask import Flask
+
+from flaskbald.celery_ext import (
+    APP_CONTEXT_NONE,
+    APP_CONTEXT_PUSH,
+    APP_CONTEXT_WORKER,
+    FlaskCelery
+)
+
+
+def build_celery():
+    app = Flask(__name__)
+    app.config.update(BROKER_URL='memory://', CELERY_ALWAYS_EAGER=True)
+    celery = FlaskCelery(__name__)
+    celery.init_app(app)
+
+    tasks = {}
+    for mode in (APP_CONTEXT_PUSH, APP_CONTEXT_WORKER, APP_CONTEXT_NONE):
+        @celery.task(name='trivial_{0}'.format(mode), app_context=mode)
+        def trivial(x):
+            return x + 1
+        tasks[mode] = trivial
+    return celery, tasks
+
+
+def run(iterations=20000):
+    celery, tasks = build_celery()
+    results = {}
+    for mode, task in tasks.items():
+        start = time.time()
+        for i in range(iterations):
+            # call the task body directly, bypassing the broker, so only the
+            # context handling is measured
+            task(i)
+        elapsed = time.time() - start
+        results[mode] = iterations / elapsed
+        print('{0:10s} {1:12.0f} tasks/s'.format(mode, results[mode]))
+    return results
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:2]])
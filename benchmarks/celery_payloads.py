@@ -0,0 +1,111 @@
+# encoding: utf-8
+'''
+Broker bytes and encode/decode time for large task payloads with different
+serializer, compression and claim check settings, over the in-memory
+transport.
+
+    python benchmarks/celery_payloads.py [messages]
+'''
+import shutil
+import sys
+import tempfile
+import time
+
+from flask import Flask
+
+from kombu import compression as kombu_compression
+
+from flaskbald.celery_ext import FlaskCelery, LocalBlobStore, lz4
+
+SETTINGS = [
+    ('json', None, False),
+    ('json', 'zlib', False),
+    ('msgpack', None, False),
+    ('msgpack', 'zlib', False),
+    ('json', 'lz4', False),
+    ('msgpack', 'lz4', False),
+    ('json', None, True),
+]
+
+
+def payload(rows=2000):
+    '''A model dump shaped payload: a list of row dicts.'''
+    return [{'id': i, 'name': 'name {0}'.format(i), 'email': 'user{0}@example.com'.format(i),
+             'active': i % 2 == 0, 'score': i * 1.5, 'tags': ['a', 'b', 'c']}
+            for i in range(rows)]
+
+
+def build_celery(blob_path):
+    app = Flask(__name__)
+    app.config.update(BROKER_URL='memory://',
+                      CELERY_ACCEPT_CONTENT=['json', 'msgpack'])
+    celery = FlaskCelery(__name__)
+    celery.init_app(app)
+    celery.claim_check_store = LocalBlobStore(blob_path)
+    celery.claim_check_threshold = 64 * 1024
+
+    @celery.task(name='import_chunk')
+    def import_chunk(rows):
+        return len(rows)
+
+    return celery, import_chunk
+
+
+def drain(celery):
+    with celery.connection_for_read() as conn:
+        queue = conn.SimpleQueue('celery', no_ack=True,
+                                  accept=celery.conf.accept_content)
+        messages = []
+        while queue.qsize():
+            messages.append(queue.get(block=False))
+        queue.close()
+    return messages
+
+
+def wire_size(message, compression):
+    '''Size of the message body as published (kombu hands it back
+    decompressed).'''
+    body = message.body
+    if compression:
+        body = kombu_compression.compress(body, compression)[0]
+    return len(body)
+
+
+def run(messages=20):
+    blob_path = tempfile.mkdtemp()
+    celery, task = build_celery(blob_path)
+    rows = payload()
+    print('{0:10s} {1:6s} {2:6s} {3:>12s} {4:>10s} {5:>10s}'.format(
+        'serializer', 'compr', 'claim', 'bytes/msg', 'send ms', 'recv ms'))
+    try:
+        for serializer, compression, claim_check in SETTINGS:
+            if compression == 'lz4' and lz4 is None:
+                continue
+            task.claim_check = claim_check
+            options = {'serializer': serializer}
+            if compression:
+                options['compression'] = compression
+
+            start = time.time()
+            for i in range(messages):
+                task.apply_async((rows,), **options)
+            send = (time.time() - start) * 1000 / messages
+
+            received = drain(celery)
+            start = time.time()
+            for message in received:
+                args, kwargs, embed = message.decode()
+                task(*args, **kwargs)
+            recv = (time.time() - start) * 1000 / messages
+
+            size = sum(wire_size(message, compression)
+                       for message in received) / messages
+            print('{0:10s} {1:6s} {2:6s} {3:12.0f} {4:10.2f} {5:10.2f}'.format(
+                serializer, compression or '-', str(claim_check), size, send,
+                recv))
+    finally:
+        shutil.rmtree(blob_path)
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:2]])
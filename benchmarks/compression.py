@@ -0,0 +1,76 @@
+# encoding: utf-8
+'''
+Compression throughput versus bandwidth for JSON list payloads, per codec
+and level, plus end-to-end requests per second through the Compress
+middleware.
+
+    python benchmarks/compression.py [rows]
+'''
+import json
+import sys
+import time
+
+from flask import Flask
+
+from flaskbald.compress import Compress, brotli
+from flaskbald.response import api_action
+
+CODECS = [('gzip', 1), ('gzip', 6), ('gzip', 9)]
+if brotli is not None:
+    CODECS += [('br', 1), ('br', 4), ('br', 11)]
+
+
+def payload(rows):
+    return [{'id': i, 'name': 'name {0}'.format(i), 'active': i % 2 == 0,
+             'email': 'user{0}@example.com'.format(i), 'score': i * 0.5}
+            for i in range(rows)]
+
+
+def codec_table(body, repeat=20):
+    print('{0:6s} {1:>5s} {2:>10s} {3:>8s} {4:>10s}'.format(
+        'codec', 'level', 'bytes', 'ratio', 'MB/s'))
+    for encoding, level in CODECS:
+        compress = Compress(None, level=level, brotli_quality=level)
+        start = time.time()
+        for i in range(repeat):
+            compressed = compress.compress(body, encoding)
+        elapsed = (time.time() - start) / repeat
+        print('{0:6s} {1:5d} {2:10d} {3:8.2f} {4:10.1f}'.format(
+            encoding, level, len(compressed), len(body) / float(len(compressed)),
+            len(body) / elapsed / 1e6))
+
+
+def requests_per_second(rows, requests=300):
+    app = Flask(__name__)
+
+    @app.route('/rows')
+    @api_action
+    def list_rows():
+        return payload(rows)
+
+    plain_app = app.wsgi_app
+    for name, encoding, wsgi_app in [
+            ('none', 'identity', plain_app),
+            ('gzip', 'gzip', Compress(plain_app, cache_size=0)),
+            ('gzip+cache', 'gzip', Compress(plain_app, cache_size=16))]:
+        app.wsgi_app = wsgi_app
+        client = app.test_client()
+        start = time.time()
+        for i in range(requests):
+            response = client.get('/rows', headers={'Accept-Encoding': encoding})
+        elapsed = time.time() - start
+        print('{0:12s} {1:8.0f} req/s {2:10d} bytes/response'.format(
+            name, requests / elapsed, len(response.data)))
+
+
+def run(rows=2000):
+    body = json.dumps({'status': 'success', 'data': payload(rows)}).encode(
+        'utf-8')
+    print('payload: {0} rows, {1} bytes'.format(rows, len(body)))
+    codec_table(body)
+    print('')
+    requests_per_second(rows)
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:2]])
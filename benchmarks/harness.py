@@ -0,0 +1,204 @@
+# encoding: utf-8
+'''
+Benchmark harness for a create_app application (see bench_app.py).
+
+    python benchmarks/harness.py                     # WSGI test client
+    python benchmarks/harness.py --http --processes 4
+    python benchmarks/harness.py --save-baseline     # store results
+    python benchmarks/harness.py --compare           # fail on regressions
+
+Reports requests per second, latency percentiles and memory allocated per
+request for each scenario. Baselines are stored in baselines.json next to
+this script (per machine, they are not meant to be committed) and
+--compare exits non-zero when a scenario got slower than --tolerance.
+'''
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from bench_app import auth_header, build_app
+
+BASELINE_FILE = os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                             'baselines.json')
+
+POST_BODY = json.dumps({'name': 'new item', 'description': 'x' * 200,
+                        'price': 12.5, 'active': True,
+                        'tags': ['a', 'b', 'c']})
+
+# name, method, path, body, needs auth
+SCENARIOS = [
+    ('api_list', 'GET', '/api/items', None, False),
+    ('api_detail', 'GET', '/api/items/42', None, False),
+    ('action_page', 'GET', '/items', None, False),
+    ('user_required', 'GET', '/api/me', None, True),
+    ('validate_post', 'POST', '/api/items', POST_BODY, False),
+]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(latencies, elapsed):
+    return {'requests': len(latencies),
+            'rps': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p90_ms': percentile(latencies, 90) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000}
+
+
+def request_options(body, auth):
+    headers = dict(auth_header()) if auth else {}
+    if body is not None:
+        headers['Content-Type'] = 'application/json'
+    return headers
+
+
+def run_wsgi(app, scenario, requests):
+    name, method, path, body, auth = scenario
+    client = app.test_client()
+    headers = request_options(body, auth)
+
+    def call():
+        response = client.open(path, method=method, data=body,
+                               headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError('{0} returned {1}'.format(
+                name, response.status_code))
+        response.close()
+
+    for i in range(min(50, requests)):
+        call()
+
+    latencies = []
+    start = time.time()
+    for i in range(requests):
+        request_start = time.time()
+        call()
+        latencies.append(time.time() - request_start)
+    result = summarize(latencies, time.time() - start)
+
+    # memory allocated (peak) while handling a single request
+    tracemalloc.start()
+    peaks = []
+    for i in range(20):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        call()
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    result['kb_per_request'] = sum(peaks) / len(peaks) / 1024.0
+    return result
+
+
+def _http_worker(args):
+    port, method, path, body, headers, requests = args
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    latencies = []
+    for i in range(requests):
+        start = time.time()
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.time() - start)
+    connection.close()
+    return latencies
+
+
+def run_http(app, scenario, requests, processes):
+    '''Drive a local threaded HTTP server from several client processes.'''
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kargs):
+            pass
+
+    name, method, path, body, auth = scenario
+    server = make_server('127.0.0.1', 0, app, threaded=True,
+                         request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        per_process = max(1, requests // processes)
+        job = (server.server_port, method, path, body,
+               request_options(body, auth), per_process)
+        pool = multiprocessing.Pool(processes)
+        start = time.time()
+        latencies = sum(pool.map(_http_worker, [job] * processes), [])
+        elapsed = time.time() - start
+        pool.close()
+        pool.join()
+    finally:
+        server.shutdown()
+    return summarize(latencies, elapsed)
+
+
+def compare(results, baselines, tolerance):
+    '''Names of scenarios whose throughput regressed beyond tolerance.'''
+    regressions = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline and result['rps'] < baseline['rps'] * (1 - tolerance):
+            regressions.append(name)
+            print('REGRESSION {0}: {1:.0f} req/s vs baseline {2:.0f}'.format(
+                name, result['rps'], baseline['rps']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--http', action='store_true')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--scenario', action='append')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    options = parser.parse_args(argv)
+
+    app, directory = build_app(rows=options.rows)
+    mode = 'http' if options.http else 'wsgi'
+    print('{0:15s} {1:>10s} {2:>9s} {3:>9s} {4:>9s} {5:>10s}'.format(
+        'scenario', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'KB/req'))
+    results = {}
+    for scenario in SCENARIOS:
+        if options.scenario and scenario[0] not in options.scenario:
+            continue
+        if options.http:
+            result = run_http(app, scenario, options.requests,
+                              options.processes)
+        else:
+            result = run_wsgi(app, scenario, options.requests)
+        results['{0}:{1}'.format(mode, scenario[0])] = result
+        print('{0:15s} {1:10.0f} {2:9.2f} {3:9.2f} {4:9.2f} {5:>10s}'.format(
+            scenario[0], result['rps'], result['p50_ms'], result['p90_ms'],
+            result['p99_ms'], '{0:.1f}'.format(result['kb_per_request'])
+            if 'kb_per_request' in result else '-'))
+
+    baselines = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as baseline_file:
+            baselines = json.load(baseline_file)
+
+    status = 0
+    if options.compare and compare(results, baselines, options.tolerance):
+        status = 1
+    if options.save_baseline:
+        baselines.update(results)
+        with open(BASELINE_FILE, 'w') as baseline_file:
+            json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
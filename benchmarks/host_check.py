@@ -0,0 +1,44 @@
+# encoding: utf-8
+'''
+Per request overhead of the ALLOWED_HOSTS check: the previous
+request.from_values() + list lookup versus the compiled allow-list read
+from the WSGI environ.
+
+    python benchmarks/host_check.py [iterations]
+'''
+import sys
+import time
+
+from flask import Flask, request
+
+from flaskbald.factory import compile_allowed_hosts, environ_host, host_allowed
+
+HOSTS = ['host{0}.example.org'.format(i) for i in range(20)] + [
+    'api.example.com', '*.example.net']
+
+
+def previous_check(allowed_hosts):
+    return request.from_values().host in allowed_hosts
+
+
+def compiled_check(allowed_hosts):
+    return host_allowed(environ_host(request.environ), allowed_hosts)
+
+
+def run(iterations=20000):
+    app = Flask(__name__)
+    compiled = compile_allowed_hosts(HOSTS)
+    checks = [('from_values', previous_check, HOSTS),
+              ('compiled', compiled_check, compiled)]
+    with app.test_request_context('/', base_url='http://api.example.com'):
+        for name, check, allowed_hosts in checks:
+            start = time.time()
+            for i in range(iterations):
+                check(allowed_hosts)
+            elapsed = time.time() - start
+            print('{0:12s} {1:8.2f} us/request'.format(
+                name, elapsed * 1e6 / iterations))
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,77 @@
+# encoding: utf-8
+'''
+Import cost of flaskbald and its submodules measured with `-X importtime`.
+
+    python benchmarks/import_time.py [--max-ms N] [module ...]
+
+Each module is imported in a fresh interpreter. With --max-ms the script
+exits non-zero when any cumulative import time exceeds the budget.
+'''
+import argparse
+import subprocess
+import sys
+
+DEFAULT_MODULES = [
+    'flaskbald',
+    'flaskbald.response',
+    'flaskbald.db_ext',
+    'flaskbald.factory',
+    'flaskbald.auth',
+    'flaskbald.celery_ext',
+]
+
+
+def import_time(module, runs=3):
+    '''
+    Return (cumulative microseconds, slowest entries) for importing *module*,
+    keeping the best of *runs* fresh interpreters.
+    '''
+    best = None
+    for i in range(runs):
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+            stderr=subprocess.PIPE, stdout=subprocess.DEVNULL,
+            universal_newlines=True, check=True)
+        lines = []
+        for line in proc.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            lines.append((int(cumulative_us), int(self_us), name.rstrip()))
+
+        # children are printed before their parent and indented deeper
+        index = [name.strip() for cumulative_us, self_us, name in lines
+                 ].index(module)
+        total, self_us, name = lines[index]
+        depth = len(name) - len(name.lstrip())
+        children = []
+        for entry in reversed(lines[:index]):
+            if len(entry[2]) - len(entry[2].lstrip()) <= depth:
+                break
+            children.append(entry)
+        if best is None or total < best[0]:
+            best = (total, sorted(children, reverse=True))
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    parser.add_argument('--max-ms', type=float, default=None)
+    parser.add_argument('--top', type=int, default=5)
+    options = parser.parse_args(argv)
+
+    over_budget = False
+    for module in options.modules:
+        total, entries = import_time(module)
+        print('{0:30s} {1:10.1f} ms'.format(module, total / 1000.0))
+        for cumulative_us, self_us, name in entries[:options.top]:
+            print('    {0:40s} {1:10.1f} ms'.format(name.strip(),
+                                                    cumulative_us / 1000.0))
+        if options.max_ms is not None and total / 1000.0 > options.max_ms:
+            over_budget = True
+    return 1 if over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
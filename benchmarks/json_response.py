@@ -0,0 +1,75 @@
+# encoding: utf-8
+'''
+Per request time and allocations of building an api_action JSON response:
+the former WebOb response adapted by Flask versus the native JSONResponse.
+
+    python benchmarks/json_response.py [iterations]
+
+The WebOb variant is only measured when webob is installed.
+'''
+import json
+import sys
+import time
+import tracemalloc
+
+from flask import Flask
+
+from flaskbald.response import JSONResponse
+
+BODY = {'id': 1, 'name': 'name', 'tags': ['a', 'b'], 'active': True}
+
+
+def webob_response(app):
+    from webob import Response
+    resp = Response(json.dumps({'status': 'success', 'data': BODY}),
+                    status='200 OK', content_type='application/json',
+                    charset='utf-8')
+    resp.headers.update({
+        'Access-Control-Expose-Headers': 'Access-Control-Allow-Origin',
+        'Access-Control-Allow-Headers':
+            'Origin, X-Requested-With, Content-Type, Accept',
+    })
+    # what Flask does with a foreign WSGI response returned by a view
+    return app.make_response(resp)
+
+
+def native_response(app):
+    return app.make_response(JSONResponse(
+        json.dumps({'status': 'success', 'data': BODY}), status='200 OK'))
+
+
+def measure(build, app, iterations):
+    start = time.time()
+    for i in range(iterations):
+        build(app)
+    elapsed = time.time() - start
+
+    # memory held by a built response (object, headers and body)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    responses = [build(app) for i in range(100)]
+    allocated = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del responses
+    return elapsed * 1e6 / iterations, allocated / 100.0
+
+
+def run(iterations=20000):
+    app = Flask(__name__)
+    builders = [('native', native_response)]
+    try:
+        import webob
+    except ImportError:
+        print('webob not installed, skipping the WebOb variant')
+    else:
+        builders.insert(0, ('webob', webob_response))
+
+    with app.test_request_context('/'):
+        for name, build in builders:
+            per_call, allocated = measure(build, app, iterations)
+            print('{0:8s} {1:8.2f} us/response {2:10.0f} bytes/response'
+                  .format(name, per_call, allocated))
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:2]])
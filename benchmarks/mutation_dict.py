@@ -0,0 +1,145 @@
+# encoding: utf-8
+'''
+MutationDict with large JSON documents stored in a model column: change
+events fired by a bulk update() (one per key before, one now), and loading
+rows then editing a deeply nested value with NestedMutationDict, which
+wraps nested containers on access, versus wrapping every level on load.
+
+    python benchmarks/mutation_dict.py [rows] [keys]
+'''
+import json
+import sys
+import time
+
+from flask import Flask
+
+from flaskbald.db_ext import (MutationDict, NestedMutationDict, TrackedDict,
+                              TrackedList, db, Model)
+
+
+class JSONText(db.TypeDecorator):
+    impl = db.Text
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else json.dumps(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else json.loads(value)
+
+
+class CountingDict(MutationDict):
+    events = 0
+
+    def changed(self):
+        CountingDict.events += 1
+        MutationDict.changed(self)
+
+
+class PerKeyDict(CountingDict):
+    '''The former update(): one __setitem__, so one event, per key.'''
+    def update(self, *args, **kwargs):
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+
+class DeepDict(NestedMutationDict):
+    '''Wraps every nested level in a tracked container on load.'''
+    @classmethod
+    def coerce(cls, key, value):
+        if isinstance(value, cls):
+            return value
+        root = cls()
+
+        def convert(value):
+            if isinstance(value, dict):
+                return TrackedDict(((k, convert(v)) for k, v in value.items()),
+                                   root)
+            if isinstance(value, list):
+                return TrackedList([convert(v) for v in value], root)
+            return value
+        dict.update(root, ((k, convert(v)) for k, v in value.items()))
+        return root
+
+
+class Flat(Model):
+    __tablename__ = 'flat_documents'
+    id = db.Column(db.Integer, primary_key=True)
+    document = db.Column(CountingDict.as_mutable(JSONText))
+
+
+class PerKey(Model):
+    __tablename__ = 'per_key_documents'
+    id = db.Column(db.Integer, primary_key=True)
+    document = db.Column(PerKeyDict.as_mutable(JSONText))
+
+
+class Deep(Model):
+    __tablename__ = 'deep_documents'
+    id = db.Column(db.Integer, primary_key=True)
+    document = db.Column(DeepDict.as_mutable(JSONText))
+
+
+class Nested(Model):
+    __tablename__ = 'nested_documents'
+    id = db.Column(db.Integer, primary_key=True)
+    document = db.Column(NestedMutationDict.as_mutable(JSONText))
+
+
+def document(keys):
+    return dict(('key{0}'.format(i), {'values': list(range(10)),
+                                      'settings': {'enabled': True}})
+                for i in range(keys))
+
+
+def bulk_update(model, rows, keys):
+    CountingDict.events = 0
+    start = time.time()
+    for instance in model.all():
+        instance.document.update(('key{0}'.format(i), i) for i in range(keys))
+    db.session.flush()
+    elapsed = time.time() - start
+    db.session.rollback()
+    return elapsed * 1e3, CountingDict.events
+
+
+def nested_edit(model):
+    start = time.time()
+    instances = model.all()
+    for instance in instances:
+        instance.document['key1']['settings']['enabled'] = False
+    dirty = sum(1 for instance in instances if instance.is_modified())
+    elapsed = time.time() - start
+    db.session.rollback()
+    return elapsed * 1e3, dirty
+
+
+def run(rows=200, keys=500):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        for model in (Flat, PerKey, Deep, Nested):
+            db.session.execute(model.__table__.insert(), [
+                {'document': document(keys)} for i in range(rows)])
+        db.session.commit()
+
+        print('update() of {0} keys on {1} rows'.format(keys, rows))
+        for name, model in (('per key events', PerKey),
+                            ('single event', Flat)):
+            elapsed, events = bulk_update(model, rows, keys)
+            print('  {0:<20}{1:>10.1f} ms{2:>10} events'.format(
+                name, elapsed, events))
+
+        print('load and edit a nested value')
+        for name, model in (('deep wrap on load', Deep),
+                            ('NestedMutationDict', Nested),
+                            ('MutationDict', Flat)):
+            elapsed, dirty = nested_edit(model)
+            print('  {0:<20}{1:>10.1f} ms{2:>10} dirty'.format(
+                name, elapsed, dirty))
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
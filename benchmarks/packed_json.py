@@ -0,0 +1,99 @@
+# encoding: utf-8
+'''
+MutationDict documents stored as text JSON versus PackedJSON: stored size,
+time to load a listing without reading the document (PackedJSON decodes
+lazily), to load and read every document, and to flush a change.
+
+    python benchmarks/packed_json.py [rows] [keys]
+'''
+import json
+import sys
+import time
+
+from flask import Flask
+
+from flaskbald.db_ext import MutationDict, PackedJSON, db, Model
+
+
+class JSONText(db.TypeDecorator):
+    impl = db.Text
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else json.dumps(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else json.loads(value)
+
+
+class TextDocument(Model):
+    __tablename__ = 'text_documents'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80))
+    document = db.Column(MutationDict.as_mutable(JSONText))
+
+
+class PackedDocument(Model):
+    __tablename__ = 'packed_documents'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80))
+    document = db.Column(MutationDict.as_mutable(PackedJSON))
+
+
+def document(i, keys):
+    return dict(('field{0}'.format(k), {'id': i * keys + k, 'score': k * 0.5,
+                                        'label': 'label {0}'.format(k),
+                                        'flags': [True, False, None]})
+                for k in range(keys))
+
+
+def timed(func):
+    db.session.remove()
+    start = time.time()
+    func()
+    elapsed = (time.time() - start) * 1e3
+    db.session.rollback()
+    db.session.remove()
+    return elapsed
+
+
+def run(rows=2000, keys=50):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        for model in (TextDocument, PackedDocument):
+            db.session.execute(model.__table__.insert(), [
+                {'name': 'row {0}'.format(i), 'document': document(i, keys)}
+                for i in range(rows)])
+        db.session.commit()
+
+        def listing(model):
+            return lambda: [row.name for row in model.all()]
+
+        def read(model):
+            return lambda: [len(row.document) for row in model.all()]
+
+        def change(model):
+            def func():
+                for row in model.all():
+                    row.document['field0'] = None
+                db.session.flush()
+            return func
+
+        print('{0} rows, {1} keys per document'.format(rows, keys))
+        print('{0:<16}{1:>12}{2:>12}{3:>12}{4:>12}'.format(
+            '', 'KB stored', 'list ms', 'read ms', 'flush ms'))
+        for name, model in (('text JSON', TextDocument),
+                            ('PackedJSON', PackedDocument)):
+            stored = db.session.execute(
+                'SELECT sum(length(document)) FROM {0}'.format(
+                    model.__tablename__)).scalar()
+            print('{0:<16}{1:>12.0f}{2:>12.1f}{3:>12.1f}{4:>12.1f}'.format(
+                name, stored / 1024.0, timed(listing(model)),
+                timed(read(model)), timed(change(model))))
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
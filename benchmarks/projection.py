@@ -0,0 +1,99 @@
+# encoding: utf-8
+'''
+Time and memory per row of a read-only listing loaded as full ORM
+instances (Model.all), with heavy columns deferred, and as projection rows
+(Model.select / Model.values).
+
+    python benchmarks/projection.py [rows]
+'''
+import json
+import sys
+import time
+import tracemalloc
+
+from flask import Flask
+
+from flaskbald.db_ext import MutationDict, db, Model
+
+DOCUMENT = {'tags': ['tag{0}'.format(i) for i in range(20)],
+            'attributes': dict(('key{0}'.format(i), 'value ' * 10)
+                               for i in range(20))}
+
+
+class JSONText(db.TypeDecorator):
+    impl = db.Text
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else json.dumps(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else json.loads(value)
+
+
+class Listing(Model):
+    __tablename__ = 'listings'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), nullable=False)
+    price = db.Column(db.Float)
+    body = db.Column(db.Text)
+    document = db.Column(MutationDict.as_mutable(JSONText))
+
+
+class DeferredListing(Model):
+    __tablename__ = 'deferred_listings'
+    __deferred__ = ('body', 'document')
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), nullable=False)
+    price = db.Column(db.Float)
+    body = db.Column(db.Text)
+    document = db.Column(MutationDict.as_mutable(JSONText))
+
+
+def measure(load, rows):
+    db.session.remove()
+    start = time.time()
+    load()
+    elapsed = time.time() - start
+    db.session.remove()
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    result = load()
+    allocated = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del result
+    db.session.remove()
+    return elapsed * 1e6 / rows, allocated / float(rows)
+
+
+def run(rows=20000):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        for model in (Listing, DeferredListing):
+            db.session.execute(model.__table__.insert(), [
+                {'name': 'item {0}'.format(i), 'price': i * 1.5,
+                 'body': 'lorem ipsum ' * 100, 'document': DOCUMENT}
+                for i in range(rows)])
+        db.session.commit()
+
+        cases = [
+            ('Model.all()', lambda: Listing.all()),
+            ('all() with __deferred__', lambda: DeferredListing.all()),
+            ('select()', lambda: Listing.select('id', 'name', 'price')),
+            ('values()', lambda: Listing.values('id', 'name', 'price')),
+        ]
+        print('{0:<26}{1:>12}{2:>14}'.format('', 'us/row', 'bytes/row'))
+        for name, load in cases:
+            per_row, allocated = measure(load, rows)
+            print('{0:<26}{1:>12.2f}{2:>14.0f}'.format(name, per_row,
+                                                      allocated))
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
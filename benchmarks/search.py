@@ -0,0 +1,114 @@
+# encoding: utf-8
+'''
+Searchable.search() (FTS5 index) versus LIKE '%term%' filters on a
+generated table of accented names and addresses: time per query, and
+whether both find the same rows.
+
+    python benchmarks/search.py [rows] [queries]
+'''
+import random
+import sys
+import time
+
+from flask import Flask
+
+from flaskbald.db_ext import db, Model
+from flaskbald.search import Searchable, search_terms
+
+FIRST = ['José', 'Zoë', 'Anaïs', 'Björn', 'Chloé', 'Renée', 'Jürgen', 'Ana',
+         'Hélène', 'François', 'Łukasz', 'Mårten', 'Núria', 'Søren', 'Paul']
+LAST = ['García', 'Müller', 'Dvořák', 'Öztürk', 'Lefèvre', 'Ibáñez', 'Smith',
+        'Nuñez', 'Kovačević', 'Ångström', 'Brontë', 'Señor', 'Wałęsa']
+STREETS = ['Rue de la Paix', 'Calle Mayor', 'Königstraße', 'Via Śląska',
+           'Avenida São João', 'Main Street', 'Place Vendôme', 'Strøget']
+CITIES = ['Montréal', 'Zürich', 'São Paulo', 'Kraków', 'Málaga', 'Århus',
+          'Reykjavík', 'Lyon', 'Boston', 'Genève', 'Île-de-France']
+QUERIES = ['garcia', 'muller zurich', 'francois', 'sao paulo', 'rue paix',
+           'kovacevic', 'angstrom arhus', 'helene geneve', 'nunez malaga']
+
+
+class Person(Searchable, Model):
+    __tablename__ = 'people'
+    __searchable__ = ('name', 'address')
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120))
+    address = db.Column(db.String(255))
+
+
+def like(q, limit):
+    # the unindexed alternative: LIKE cannot match across accents, so scan
+    # every row that could match and compare normalized text in Python
+    terms = search_terms(q)
+    found = []
+    for person in Person.all():
+        text = ' '.join(search_terms(person.name + ' ' + person.address))
+        if all(term in text for term in terms):
+            found.append(person)
+            if len(found) == limit:
+                break
+    return found
+
+
+def like_sql(q, limit):
+    # LIKE '%term%' on the raw columns: no index, misses accented spellings
+    query = Person.query()
+    for term in search_terms(q):
+        pattern = '%{0}%'.format(term)
+        query = query.filter(db.or_(Person.name.like(pattern),
+                                    Person.address.like(pattern)))
+    return query.limit(limit).all()
+
+
+def timed(func, queries):
+    db.session.remove()
+    start = time.time()
+    found = [len(func(q, 20)) for q in queries]
+    elapsed = (time.time() - start) * 1e3 / len(queries)
+    db.session.remove()
+    return elapsed, sum(found)
+
+
+def run(rows=50000, queries=len(QUERIES)):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    random.seed(0)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(Person.__table__.insert(), [
+            {'name': '{0} {1}'.format(random.choice(FIRST),
+                                      random.choice(LAST)),
+             'address': '{0} {1}, {2}'.format(random.randint(1, 300),
+                                              random.choice(STREETS),
+                                              random.choice(CITIES))}
+            for i in range(rows)])
+        start = time.time()
+        Person.rebuild_search_index()
+        db.session.commit()
+        indexed = (time.time() - start) * 1e3
+
+        # the mapper events keep the index in sync with ORM changes
+        person = Person(name='Zoë Øberg', address='1 Strøget, København')
+        person.save(flush=True)
+        assert Person.search('oberg kobenhavn') == [person]
+        person.address = '2 Place Vendôme, Paris'
+        person.save(flush=True)
+        assert Person.search('kobenhavn') == []
+        assert Person.search('vendome oberg') == [person]
+        person.delete(flush=True)
+        assert Person.search('oberg') == []
+        db.session.commit()
+
+        selected = (QUERIES * queries)[:queries]
+        print('{0} rows, index built in {1:.0f} ms'.format(rows, indexed))
+        print('{0:<24}{1:>12}{2:>12}'.format('', 'ms/query', 'rows found'))
+        for name, func in (("LIKE '%term%'", like_sql),
+                           ('scan + strip_accents', like),
+                           ('FTS5 search()', Person.search)):
+            elapsed, found = timed(func, selected)
+            print('{0:<24}{1:>12.2f}{2:>12}'.format(name, elapsed, found))
+
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
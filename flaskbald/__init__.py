@@ -1,30 +1,43 @@
 __version__ = '1.0.0'
 
-# import model
-from . import (
-    auth,
-    celery_ext,
-    console,
-    db_ext,
-    factory,
-    log,
-    model,
-    password,
-    response,
-    template,
-    text,
-    validate
-)
-# from .model import (create_model)
-# import auth
-# import celery_ext
-# import console
-# import db_ext
-# import factory
-# import log
-# import model
-# import password
-# import response
-# import template
-# import text
-# import validate
+import importlib
+
+# Submodules are imported on first attribute access (PEP 562) so that
+# `import flaskbald` does not pay for Celery, PyJWT/cryptography,
+# phonenumbers, readline, flask_mail, ... until they are actually used.
+_submodules = frozenset([
+    'async_ext',
+    'auth',
+    'background',
+    'cache',
+    'celery_ext',
+    'compress',
+    'console',
+    'cors',
+    'db_ext',
+    'factory',
+    'loader',
+    'log',
+    'model',
+    'password',
+    'ratelimit',
+    'response',
+    'routes',
+    'search',
+    'serialize',
+    'shard',
+    'template',
+    'text',
+    'validate'
+])
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError(
+        "module '{0}' has no attribute '{1}'".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | _submodules)
@@ -0,0 +1,232 @@
+# encoding: utf-8
+
+import asyncio
+import inspect
+import io
+import sys
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+# one event loop per WSGI worker thread, reused across requests
+_thread_loop = threading.local()
+
+
+def is_async(func):
+    '''Check whether *func* is an `async def` handler.'''
+    return inspect.iscoroutinefunction(func)
+
+
+def event_loop():
+    '''The event loop of the current thread, created on first use.'''
+    loop = getattr(_thread_loop, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = _thread_loop.loop = asyncio.new_event_loop()
+    return loop
+
+
+def run_coroutine(coroutine):
+    '''
+    Run *coroutine* to completion on the current thread's event loop.
+
+    The loop runs in the request's own thread, so Flask's request and app
+    context stay available inside the coroutine; the thread is blocked
+    until the coroutine completes.
+    '''
+    return event_loop().run_until_complete(coroutine)
+
+
+def gather(*awaitables, **kargs):
+    '''
+    Await several backend calls concurrently, i.e. fan out to a few slow
+    services from an async handler:
+
+        user, orders = await gather(users_api(id), orders_api(id))
+    '''
+    return asyncio.gather(*awaitables, **kargs)
+
+
+def run_sync(func, *pargs, **kargs):
+    '''Await a blocking call (i.e. a sync client) in the loop's executor.'''
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(None, lambda: func(*pargs, **kargs))
+
+
+class ASGIApp(object):
+    '''
+    ASGI entry point for a flaskbald WSGI app, so it can be served by an
+    async server (uvicorn, hypercorn, ...).
+
+    This is an adapter, not a concurrency gain: every request runs the WSGI
+    app on a thread of the pool (*max_workers*) and holds it until the
+    response has been produced, `async def` handlers included, since they
+    run to completion on that thread's event loop (their awaits only
+    overlap with each other). Size the pool as you would WSGI threads.
+
+    The response is streamed back to the server's loop as the app produces
+    it, with at most QUEUE_SIZE chunks in flight, so streamed responses
+    work and large bodies are not buffered.
+    '''
+    # response chunks handed to the event loop ahead of the client
+    QUEUE_SIZE = 8
+
+    def __init__(self, wsgi_app, max_workers=None):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError("Unsupported ASGI scope '{0}'".format(
+                scope['type']))
+
+        body = io.BytesIO()
+        more_body = True
+        while more_body:
+            message = await receive()
+            body.write(message.get('body', b''))
+            more_body = message.get('more_body', False)
+        body.seek(0)
+
+        loop = asyncio.get_event_loop()
+        queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        cancelled = threading.Event()
+
+        def put(message):
+            # called from the pool thread, blocks while the queue is full
+            if cancelled.is_set():
+                raise IOError("ASGI client went away")
+            asyncio.run_coroutine_threadsafe(queue.put(message),
+                                             loop).result()
+
+        worker = loop.run_in_executor(self.executor, self.run_wsgi,
+                                      self.environ(scope, body), put)
+        close = None
+        try:
+            while True:
+                message = await queue.get()
+                if message[0] == 'start':
+                    await send({'type': 'http.response.start',
+                                'status': message[1], 'headers': message[2]})
+                elif message[0] == 'body':
+                    await send({'type': 'http.response.body',
+                                'body': message[1], 'more_body': True})
+                elif message[0] == 'error':
+                    raise message[1]
+                else:
+                    close = message[1]
+                    await send({'type': 'http.response.body', 'body': b''})
+                    break
+        finally:
+            if close is None:
+                # stop the app and unblock a put waiting on the full queue
+                cancelled.set()
+                while not queue.empty():
+                    queue.get_nowait()
+            await worker
+            # closing the app_iter runs the response's call_on_close
+            # callbacks (after_response jobs): only once it has been sent
+            if close is not None:
+                await loop.run_in_executor(self.executor, close)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def environ(self, scope, body):
+        '''Build the WSGI environ of an ASGI http scope.'''
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            # ASGI paths are decoded str, WSGI wants their (UTF-8) bytes
+            # as a latin-1 str
+            'SCRIPT_NAME': scope.get('root_path', '').encode(
+                'utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/{0}'.format(
+                scope.get('http_version', '1.1')),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        if scope.get('client'):
+            environ['REMOTE_ADDR'] = scope['client'][0]
+        for name, value in scope.get('headers', ()):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+                environ[name] = value
+                continue
+            key = 'HTTP_' + name
+            environ[key] = (environ[key] + ',' + value if key in environ
+                            else value)
+        # the body has been read in full: its length is known even when the
+        # client didn't send one (chunked requests), and WSGI apps only read
+        # CONTENT_LENGTH bytes of wsgi.input
+        environ.setdefault('CONTENT_LENGTH', str(len(body.getvalue())))
+        return environ
+
+    def run_wsgi(self, environ, put):
+        '''
+        Run the WSGI app (in a pool thread), handing the response to the
+        event loop through *put* as it is produced: ('start', status,
+        headers) before the first chunk, ('body', chunk) for each chunk,
+        then ('end', close) where close (None when not needed) is called
+        once the response has been sent, or ('error', exception).
+        '''
+        response = []
+        started = []
+
+        def start():
+            if not started:
+                started.append(True)
+                put(('start', response[0], response[1]))
+
+        def write(data):
+            if data:
+                start()
+                put(('body', data))
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response[:] = [int(status.split(' ', 1)[0]),
+                           [(name.lower().encode('latin-1'),
+                             value.encode('latin-1'))
+                            for name, value in headers]]
+            return write
+
+        close = None
+        try:
+            app_iter = self.wsgi_app(environ, start_response)
+            close = getattr(app_iter, 'close', None)
+            for chunk in app_iter:
+                write(chunk)
+            start()
+        except Exception as e:
+            if close is not None:
+                close()
+            try:
+                put(('error', e))
+            except IOError:
+                pass
+            return
+        try:
+            put(('end', close))
+        except IOError:
+            if close is not None:
+                close()
@@ -9,6 +9,8 @@ from datetime import datetime as date, timedelta as timedelta
 from flask import request, current_app, redirect
 from functools import wraps
 
+from .async_ext import is_async
+from .cache import run_guard
 from .response import APIError, APIUnauthorized
 
 
@@ -54,20 +56,47 @@ def get_jwt_claims(jwt_key='Authorization'):
 
 def user_required(orig_func=None, jwt_key='Authorization', redirect_url=None, code=302):
 
+    def unauthorized():
+        if redirect_url:
+            if type(redirect_url) != str:
+                return redirect(redirect_url(request), code=code)
+            return redirect(redirect_url, code=code)
+        else:
+            return APIUnauthorized("User authentication is required to access this resource.")
+
+    def guard():
+        if not get_jwt_claims(jwt_key=jwt_key):
+            return unauthorized()
+
+    def check():
+        rv = run_guard(guard)
+        if isinstance(rv, APIError):
+            raise rv
+        return rv
+
     def requirement(orig_func):
         '''Requirement decorator.'''
-        @wraps(orig_func)
-        def replacement(*pargs, **kargs):
-            jwt_claims = get_jwt_claims(jwt_key=jwt_key)
-            if not jwt_claims:
-                if redirect_url:
-                    if type(redirect_url) != str:
-                        return redirect(redirect_url(request), code=code)
-                    return redirect(redirect_url, code=code)
-                else:
-                    raise APIUnauthorized("User authentication is required to access this resource.")
-            return orig_func(*pargs, **kargs)
-
+        if is_async(orig_func):
+            @wraps(orig_func)
+            async def async_replacement(*pargs, **kargs):
+                rv = check()
+                if rv is not None:
+                    return rv
+                return await orig_func(*pargs, **kargs)
+
+            replacement = async_replacement
+        else:
+            @wraps(orig_func)
+            def replacement(*pargs, **kargs):
+                rv = check()
+                if rv is not None:
+                    return rv
+                return orig_func(*pargs, **kargs)
+
+        # run before cached responses are served, see cache.cached_response
+        replacement.user_required = True
+        replacement.request_guards = (guard,) + getattr(
+            orig_func, 'request_guards', ())
         return replacement
 
     if not orig_func:
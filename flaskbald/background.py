@@ -0,0 +1,172 @@
+# encoding: utf-8
+
+import atexit
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from flask import after_this_request, current_app, has_app_context
+
+log = logging.getLogger(__name__)
+
+# key of an app's executor in app.extensions
+EXTENSION = 'flaskbald.background'
+_extension_lock = threading.Lock()
+
+
+class BackgroundQueueFull(Exception):
+    '''Raised when a job is submitted while the executor queue is full.'''
+    pass
+
+
+class BackgroundExecutor(object):
+    '''
+    Small bounded in-process thread pool for lightweight side effects
+    (sending mail, audit logs, cache warming) that should not delay the
+    response but don't warrant a round trip through the Celery broker.
+
+    Jobs run inside an app context of the app that submitted them, so
+    `db.session`, `current_app.config` and extensions work as in a request;
+    the session is removed by Flask-SQLAlchemy when the context is popped.
+    Jobs are lost if the process is killed, use Celery for anything that
+    must survive a restart; on a normal exit queued jobs are drained.
+
+    Each app has its own executor, see :py:func:`get_executor`.
+    '''
+    def __init__(self, app=None, max_workers=4, max_queue=1000):
+        self.app = app
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        '''
+        Configure the executor from the BACKGROUND_WORKERS and
+        BACKGROUND_MAX_QUEUE settings and make it *app*'s executor.
+        '''
+        if self._pool is not None:
+            raise RuntimeError("The executor has already been started")
+        self.app = app
+        self.max_workers = app.config.get('BACKGROUND_WORKERS',
+                                          self.max_workers)
+        self.max_queue = app.config.get('BACKGROUND_MAX_QUEUE', self.max_queue)
+        app.extensions[EXTENSION] = self
+
+    @property
+    def pool(self):
+        # threads are only started once the first job is submitted
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self.max_workers)
+                    atexit.register(self.shutdown)
+        return self._pool
+
+    def submit(self, func, *pargs, **kargs):
+        '''
+        Queue func(*pargs, **kargs) and return its Future. Raises
+        BackgroundQueueFull when *max_queue* jobs are already waiting.
+        '''
+        app = (current_app._get_current_object() if has_app_context()
+               else self.app)
+        return self._submit(app, func, pargs, kargs)
+
+    def _submit(self, app, func, pargs, kargs):
+        with self._lock:
+            if self._pending >= self.max_queue:
+                self._rejected += 1
+                raise BackgroundQueueFull(
+                    "Background queue is full ({0} jobs)".format(
+                        self._pending))
+            self._pending += 1
+        return self.pool.submit(self._run, app, func, pargs, kargs)
+
+    def _run(self, app, func, pargs, kargs):
+        with self._lock:
+            self._pending -= 1
+            self._running += 1
+        try:
+            if app is None:
+                result = func(*pargs, **kargs)
+            else:
+                with app.app_context():
+                    result = func(*pargs, **kargs)
+        except Exception:
+            log.exception("Background job {0} failed".format(
+                getattr(func, '__name__', func)))
+            with self._lock:
+                self._failed += 1
+            raise
+        else:
+            with self._lock:
+                self._completed += 1
+            return result
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def metrics(self):
+        '''Queue depth and job counters.'''
+        with self._lock:
+            return {'pending': self._pending,
+                    'running': self._running,
+                    'completed': self._completed,
+                    'failed': self._failed,
+                    'rejected': self._rejected,
+                    'max_workers': self.max_workers,
+                    'max_queue': self.max_queue}
+
+    def shutdown(self, wait=True):
+        '''
+        Stop the threads, waiting for queued jobs with *wait*. The executor
+        starts again if another job is submitted.
+        '''
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            atexit.unregister(self.shutdown)
+            pool.shutdown(wait=wait)
+
+
+def get_executor(app=None):
+    '''
+    The executor of *app* (by default the current app), created with the
+    default settings for apps that didn't go through `create_app`.
+    '''
+    if app is None:
+        app = current_app._get_current_object()
+    executor = app.extensions.get(EXTENSION)
+    if executor is None:
+        with _extension_lock:
+            executor = app.extensions.get(EXTENSION)
+            if executor is None:
+                executor = BackgroundExecutor(app)
+    return executor
+
+
+def after_response(func, *pargs, **kargs):
+    '''
+    Run func(*pargs, **kargs) on the background executor once the current
+    response has been sent to the client.
+    '''
+    app = current_app._get_current_object()
+
+    @after_this_request
+    def schedule(response):
+        def submit():
+            try:
+                get_executor(app)._submit(app, func, pargs, kargs)
+            except BackgroundQueueFull:
+                log.warning("Dropped after response job {0}".format(
+                    getattr(func, '__name__', func)))
+        response.call_on_close(submit)
+        return response
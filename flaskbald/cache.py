@@ -0,0 +1,283 @@
+# encoding: utf-8
+
+import threading
+import time
+
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request
+
+# methods whose responses may be served from the cache
+CACHEABLE_METHODS = frozenset(['GET', 'HEAD'])
+
+# request guards that passed for the current request, see run_guard
+GUARDS_KEY = 'flaskbald.passed_guards'
+
+
+class CacheBackend(object):
+    '''
+    Interface of the shared (cross-process) response cache tier.
+
+    Values are plain tuples of status, headers and body bytes, so a redis or
+    memcached backed implementation only has to (de)serialize them.
+    '''
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl, tags=()):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def invalidate_tags(self, tags):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    '''
+    Thread-safe in-process LRU with per entry TTL and a tag index used to
+    evict every entry depending on a tag.
+    '''
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._tags = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value, tags = entry
+            if expires < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl, tags=()):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + ttl, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_tags(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LocalSharedBackend(LRUCache):
+    '''
+    Stand-in for a shared cache server: a process wide LRU, used for local
+    development and tests in place of i.e. a redis backend.
+    '''
+    def __init__(self, maxsize=10000):
+        LRUCache.__init__(self, maxsize)
+
+
+class ResponseCache(object):
+    '''
+    Two tier (in-process LRU, then an optional shared backend) cache of
+    rendered responses with request coalescing: concurrent misses on the
+    same key wait for the first one to compute the response.
+    '''
+    def __init__(self, maxsize=1024, backend=None):
+        self.local = LRUCache(maxsize)
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None and self.backend is not None:
+            value = self.backend.get(key)
+            if value is not None:
+                expires, value, tags = value
+                ttl = expires - time.time()
+                if ttl <= 0:
+                    return None
+                # with its tags, so invalidate_tags() evicts the local copy
+                self.local.set(key, value, ttl, tags)
+        return value
+
+    def set(self, key, value, ttl, tags=()):
+        self.local.set(key, value, ttl, tags)
+        if self.backend is not None:
+            self.backend.set(key, (time.time() + ttl, value, tuple(tags)),
+                             ttl, tags)
+
+    def get_or_compute(self, key, compute, ttl, tags=()):
+        '''
+        Return the cached value for *key*, calling *compute* on a miss. Only
+        one caller computes a given key at a time; *compute* returning None
+        means the result is not cacheable.
+        '''
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                inflight = self._inflight[key] = [threading.Lock(), 0]
+            inflight[1] += 1
+        try:
+            with inflight[0]:
+                value = self.get(key)
+                if value is None:
+                    value = compute()
+                    if value is not None:
+                        self.set(key, value, ttl, tags)
+                return value
+        finally:
+            with self._lock:
+                inflight[1] -= 1
+                if not inflight[1]:
+                    del self._inflight[key]
+
+    def invalidate_tags(self, tags):
+        self.local.invalidate_tags(tags)
+        if self.backend is not None:
+            self.backend.invalidate_tags(tags)
+
+    def clear(self):
+        self.local.clear()
+        if self.backend is not None:
+            self.backend.clear()
+
+
+response_cache = ResponseCache()
+
+
+def invalidate_tags(*tags):
+    '''Evict every cached response depending on any of the given tags.'''
+    response_cache.invalidate_tags(tags)
+
+
+def cache_key(per_user=False):
+    '''Cache key for the current request: path, query args and user.'''
+    key = [request.method, request.path]
+    key.extend('{0}={1}'.format(arg, value) for arg, value in
+               sorted(request.args.items(multi=True)))
+    if per_user:
+        from .auth import get_auth_id
+        key.append('sub={0}'.format(get_auth_id()))
+    return '|'.join(key)
+
+
+def run_guard(guard):
+    '''
+    Run a request guard (i.e. the check of `user_required` or `rate_limit`)
+    once per request: a guard that passed is not run again. Returns None
+    when the request passes, or the response rejecting it.
+
+    Decorators list their guards in the `request_guards` attribute of the
+    view they return, so :py:func:`cached_response` runs them before
+    looking up the cache.
+    '''
+    passed = request.environ.setdefault(GUARDS_KEY, set())
+    if guard in passed:
+        return None
+    rv = guard()
+    if rv is None:
+        passed.add(guard)
+    return rv
+
+
+def cached_response(ttl, per_user=False, tags=(), cache=None):
+    '''
+    Decorator caching the response of a view for *ttl* seconds.
+
+    *tags* may contain format placeholders filled from the view arguments
+    (i.e. 'user:{id}') and are used to evict entries with
+    :py:func:`invalidate_tags` when models change. Only successful GET/HEAD
+    responses are cached and Set-Cookie headers are never stored.
+
+    The request guards of the view (`user_required`, `rate_limit`) run
+    before the cache is looked up, and views requiring a user must be
+    cached *per_user*.
+    '''
+    def decorator(orig_func):
+        if getattr(orig_func, 'user_required', False) and not per_user:
+            raise ValueError(
+                "'{0}' requires a user, its responses must be cached per "
+                "user".format(orig_func.__name__))
+        guards = getattr(orig_func, 'request_guards', ())
+
+        @wraps(orig_func)
+        def replacement(*args, **kargs):
+            if request.method not in CACHEABLE_METHODS:
+                return orig_func(*args, **kargs)
+
+            for guard in guards:
+                rv = run_guard(guard)
+                if rv is not None:
+                    return rv
+
+            store = cache or response_cache
+            computed = []
+
+            def compute():
+                rv = orig_func(*args, **kargs)
+                if isinstance(rv, Exception):
+                    # api errors are returned, not raised, by api_action
+                    computed.append(rv)
+                    return None
+                response = current_app.make_response(rv)
+                computed.append(response)
+                if response.status_code != 200 or response.direct_passthrough:
+                    return None
+                headers = [(name, value) for name, value in
+                           response.headers.items() if name != 'Set-Cookie']
+                return response.status, headers, response.get_data()
+
+            entry_tags = [tag.format(**(request.view_args or {}))
+                          for tag in tags]
+            entry = store.get_or_compute(cache_key(per_user), compute, ttl,
+                                         entry_tags)
+            if computed:
+                return computed[0]
+            status, headers, body = entry
+            etag = dict(headers).get('ETag')
+            if etag and request.if_none_match.contains_weak(etag.strip('"')):
+                return current_app.response_class(
+                    status=304, headers=[('ETag', etag)])
+            return current_app.response_class(body, status=status,
+                                              headers=headers)
+        return replacement
+    return decorator
@@ -1,11 +1,192 @@
 # encoding: utf-8
 
 import flask
+import logging
+import os
+import threading
+import time
+import uuid
 from celery import Celery
+from celery.signals import worker_process_init
 from functools import wraps
-from sqlalchemy.exc import SQLAlchemyError
+from kombu import compression, serialization
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 from .db_ext import db
+from .loader import reset_loaders
+from .shard import close_shards, commit_shards
+
+log = logging.getLogger(__name__)
+
+# how a task gets its Flask app context:
+#   push   - push a fresh app context around every task call (default)
+#   worker - push one long-lived app context per worker process/thread
+#   none   - run the task without any app context (pure CPU tasks)
+APP_CONTEXT_PUSH = 'push'
+APP_CONTEXT_WORKER = 'worker'
+APP_CONTEXT_NONE = 'none'
+APP_CONTEXT_CONFIG = 'CELERY_FLASK_APP_CONTEXT'
+
+# claim check: task payloads above the threshold are written to a blob store
+# and only a reference to them travels through the broker
+CLAIM_CHECK_PATH = 'CELERY_CLAIM_CHECK_PATH'
+CLAIM_CHECK_THRESHOLD = 'CELERY_CLAIM_CHECK_THRESHOLD'
+CLAIM_CHECK_KWARG = '__flaskbald_claim_check__'
+DEFAULT_CLAIM_CHECK_THRESHOLD = 256 * 1024
+
+# lz4 is an optional, much faster alternative to the zlib/bzip2 compressors
+# that ship with kombu: @celery.task(compression='lz4')
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+else:
+    compression.register(lz4.frame.compress, lz4.frame.decompress,
+                         'application/x-lz4', aliases=['lz4'])
+
+# per-thread accumulator for the time spent inside the DB driver while a
+# task is running
+_task_timer = threading.local()
+
+# the long-lived app context used by APP_CONTEXT_WORKER tasks, per thread
+_worker_context = threading.local()
+
+
+class TaskMetrics(object):
+    '''
+    Aggregated per-task timings (call count, total time and DB time) for the
+    tasks wrapped by :py:func:`flaskbald_task`.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = {}
+
+    def record(self, name, total_time, db_time):
+        with self._lock:
+            count, total, db_total = self._timings.get(name, (0, 0.0, 0.0))
+            self._timings[name] = (count + 1, total + total_time,
+                                   db_total + db_time)
+
+    def snapshot(self):
+        '''Return a plain dict of task name to count/total/db timings.'''
+        with self._lock:
+            return dict((name, {'count': count, 'total': total, 'db': db_total})
+                        for name, (count, total, db_total)
+                        in self._timings.items())
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+
+
+task_metrics = TaskMetrics()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if getattr(_task_timer, 'active', False):
+        _task_timer.started = time.time()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if getattr(_task_timer, 'active', False):
+        _task_timer.db_time += time.time() - _task_timer.started
+
+
+def enable_task_timing():
+    '''Hook the SQLAlchemy engine events used to time DB work in tasks.'''
+    if not event.contains(Engine, 'before_cursor_execute',
+                          _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def dispose_engines(app):
+    '''
+    Dispose of the connection pools of every engine bound to the app.
+
+    Pools are re-created lazily on the next checkout, so calling this right
+    after a fork guarantees the child never shares sockets with its parent.
+    '''
+    with app.app_context():
+        binds = [None] + list(app.config.get('SQLALCHEMY_BINDS') or ())
+        for bind in binds:
+            db.get_engine(app, bind=bind).dispose()
+
+
+def session_in_use(session):
+    '''
+    Check whether the scoped session has pending objects or has checked out
+    a connection, i.e. whether there is anything to commit or roll back.
+    '''
+    if session.new or session.dirty or session.deleted:
+        return True
+    # the scoped_session proxy doesn't forward .transaction
+    transaction = session().transaction
+    return bool(transaction is not None and
+                getattr(transaction, '_connections', None))
+
+
+def estimate_size(value, limit):
+    '''
+    Cheap estimate of the serialized size of *value* (nested containers of
+    strings and scalars), without serializing it. Counting stops once
+    *limit* is reached, so large payloads are not walked in full.
+    '''
+    size = 0
+    pending = [value]
+    while pending and size < limit:
+        item = pending.pop()
+        if isinstance(item, (bytes, bytearray, str)):
+            size += len(item) + 2
+        elif isinstance(item, dict):
+            pending.extend(item)
+            pending.extend(item.values())
+            size += 2
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            pending.extend(item)
+            size += 2
+        else:
+            size += 8
+    return size
+
+
+class LocalBlobStore(object):
+    '''
+    Claim check store writing payloads to files in a local directory.
+
+    Any object with the same ``put``/``get``/``delete`` methods can be
+    assigned to ``FlaskCelery.claim_check_store`` (i.e. a shared volume or
+    object storage backed store when workers run on other hosts).
+    '''
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _file_path(self, key):
+        return os.path.join(self.path, os.path.basename(key))
+
+    def put(self, data):
+        '''Store the payload and return the key referencing it.'''
+        key = uuid.uuid4().hex
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        with open(self._file_path(key), 'wb') as blob:
+            blob.write(data)
+        return key
+
+    def get(self, key):
+        with open(self._file_path(key), 'rb') as blob:
+            return blob.read()
+
+    def delete(self, key):
+        try:
+            os.remove(self._file_path(key))
+        except OSError:
+            pass
 
 
 class FlaskCelery(Celery):
@@ -18,15 +199,111 @@ class FlaskCelery(Celery):
 
     #     self.patch_task()
 
+    app_context_mode = APP_CONTEXT_PUSH
+    claim_check_store = None
+    claim_check_threshold = DEFAULT_CLAIM_CHECK_THRESHOLD
+    # the Celery base Task that ContextTask extends
+    _task_base = None
+
+    def worker_app_context(self):
+        '''
+        Push (once per process and thread) and return the long-lived app
+        context shared by APP_CONTEXT_WORKER tasks.
+        '''
+        pid = os.getpid()
+        if getattr(_worker_context, 'pid', None) != pid:
+            _worker_context.context = self.app.app_context()
+            _worker_context.context.push()
+            _worker_context.pid = pid
+        return _worker_context.context
+
+    def in_worker_app_context(self):
+        '''Whether the current app context is this thread's worker one.'''
+        return (getattr(_worker_context, 'pid', None) == os.getpid() and
+                flask._app_ctx_stack.top is _worker_context.context)
+
     def patch_task(self):
-        TaskBase = self.Task
+        '''
+        Replace the base Task with one that provides a Flask app context.
+
+        The context strategy is read from the task's ``app_context`` option
+        (``@celery.task(app_context=APP_CONTEXT_NONE)``) and falls back to
+        the ``CELERY_FLASK_APP_CONTEXT`` config value.
+
+        When a claim check store is configured, payloads larger than
+        ``claim_check_threshold`` are stored there and the broker message
+        only carries a reference. Opt a task out with ``claim_check=False``.
+        '''
+        # when init_app is called again, extend the Celery base rather than
+        # the previous ContextTask: its __call__ would dispatch to the new
+        # _call_in_context, which calls it back
+        if self._task_base is None:
+            self._task_base = self.Task
+        TaskBase = self._task_base
         _celery = self
 
         class ContextTask(TaskBase):
             abstract = True
+            app_context = None
+            claim_check = True
+
+            def apply_async(self, args=None, kwargs=None, **options):
+                store = _celery.claim_check_store
+                if (store is None or not self.claim_check or
+                        _celery.conf.task_always_eager):
+                    return TaskBase.apply_async(self, args, kwargs, **options)
+
+                args, kwargs = args or (), kwargs or {}
+                # only payloads estimated above the threshold are serialized
+                # here, the rest go to the broker (serialized once) as usual
+                threshold = _celery.claim_check_threshold
+                if estimate_size((args, kwargs), threshold) < threshold:
+                    return TaskBase.apply_async(self, args, kwargs, **options)
+
+                if self.typing:
+                    self.__header__(*args, **kwargs)
+                serializer = (options.get('serializer') or self.serializer or
+                              _celery.conf.task_serializer)
+                content_type, encoding, data = serialization.dumps(
+                    (args, kwargs), serializer)
+                claim = {'key': store.put(data),
+                         'content_type': content_type,
+                         'encoding': encoding}
+                options = dict(self._get_exec_options(), **options)
+                options.setdefault('ignore_result', self.ignore_result)
+                return _celery.send_task(self.name, (),
+                                         {CLAIM_CHECK_KWARG: claim},
+                                         result_cls=self.AsyncResult,
+                                         **options)
 
             def __call__(self, *args, **kwargs):
-                if flask.has_app_context():
+                claim = kwargs.get(CLAIM_CHECK_KWARG)
+                if claim is None:
+                    return self._call_in_context(*args, **kwargs)
+
+                data = _celery.claim_check_store.get(claim['key'])
+                args, kwargs = serialization.loads(
+                    data, claim['content_type'], claim['encoding'],
+                    accept=[claim['content_type']])
+                result = self._call_in_context(*args, **kwargs)
+                _celery.claim_check_store.delete(claim['key'])
+                return result
+
+            def _call_in_context(self, *args, **kwargs):
+                mode = self.app_context or _celery.app_context_mode
+                if mode == APP_CONTEXT_WORKER and (
+                        not flask.has_app_context() or
+                        _celery.in_worker_app_context()):
+                    _celery.worker_app_context()
+                    try:
+                        return TaskBase.__call__(self, *args, **kwargs)
+                    finally:
+                        # the context outlives the task but what the app
+                        # scopes to it (sessions, shard sessions, loaders)
+                        # must not
+                        reset_loaders()
+                        _celery.app.do_teardown_appcontext()
+                elif mode == APP_CONTEXT_NONE or flask.has_app_context():
                     return TaskBase.__call__(self, *args, **kwargs)
                 else:
                     with _celery.app.app_context():
@@ -37,30 +314,96 @@ class FlaskCelery(Celery):
     def init_app(self, app):
         self.app = app
         self.config_from_object(app.config)
+        self.app_context_mode = app.config.get(APP_CONTEXT_CONFIG,
+                                               APP_CONTEXT_PUSH)
+        self.setup_serialization(app)
         self.patch_task()
+        self.setup_worker_hooks()
+
+    def setup_serialization(self, app):
+        '''
+        Make the configured serializers acceptable to workers and set up the
+        claim check store.
+
+        Serializer and compression are standard Celery options and can be set
+        globally (``CELERY_TASK_SERIALIZER``, ``CELERY_MESSAGE_COMPRESSION``,
+        ``CELERY_RESULT_SERIALIZER``) or per task
+        (``@celery.task(serializer='msgpack', compression='lz4')``). Per task
+        serializers must also be listed in ``CELERY_ACCEPT_CONTENT``.
+        '''
+        accept = list(self.conf.accept_content or ())
+        for serializer in (self.conf.task_serializer,
+                           self.conf.result_serializer):
+            if serializer and serializer not in accept:
+                accept.append(serializer)
+        self.conf.accept_content = accept
+
+        if app.config.get(CLAIM_CHECK_PATH):
+            self.claim_check_store = LocalBlobStore(
+                app.config[CLAIM_CHECK_PATH])
+        self.claim_check_threshold = app.config.get(
+            CLAIM_CHECK_THRESHOLD, DEFAULT_CLAIM_CHECK_THRESHOLD)
+
+    def setup_worker_hooks(self):
+        '''
+        Connect the worker signals that make DB usage fork-safe: engine pools
+        inherited from the parent process are disposed of in every prefork
+        child before it runs its first task.
+        '''
+        _celery = self
+
+        def reset_engines(**kargs):
+            if _celery.app.config.get('SQLALCHEMY_DATABASE_URI'):
+                dispose_engines(_celery.app)
+
+        # keep a reference, signals only hold weak references to receivers
+        self._reset_engines = reset_engines
+        worker_process_init.connect(reset_engines)
+        enable_task_timing()
 
 
 def flaskbald_task(**kargs):
     """
     Wrapper for Celery @task decorator to ensure DB sessions are
     properly closed once tasks execution has completed.
+
+    The session and the shard sessions are committed on success and rolled
+    back on any exception so a failing task never leaks a dirty session to
+    the next task on the same worker thread. Tasks that never touched the
+    session skip the cleanup.
+    Per task total and DB time are collected in ``task_metrics``.
     """
     def requirement(task_function):
 
         @celery.task(**kargs)
         @wraps(task_function)
         def replacement(*pargs, **kargs):
-            task_result = None
-            # try:
-            task_result = task_function(*pargs, **kargs)
-            db.session.commit()
-            # except SQLAlchemyError:
-                # db.session.rollback()
-                # raise SQLAlchemyError("Session Rolled Back")
-            # finally:
-            db.session.close()
-            db.session.remove()
-            return task_result
+            _task_timer.active = True
+            _task_timer.db_time = 0.0
+            start = time.time()
+            try:
+                task_result = task_function(*pargs, **kargs)
+                if db.session.registry.has() and session_in_use(db.session):
+                    db.session.commit()
+                commit_shards()
+                return task_result
+            except Exception:
+                if db.session.registry.has():
+                    db.session.rollback()
+                raise
+            finally:
+                if db.session.registry.has():
+                    db.session.close()
+                    db.session.remove()
+                # rolls back what is left uncommitted on failure
+                close_shards()
+                reset_loaders()
+                _task_timer.active = False
+                total_time = time.time() - start
+                task_metrics.record(replacement.name, total_time,
+                                    _task_timer.db_time)
+                log.debug("task {0} total: {1:.4f}s db: {2:.4f}s".format(
+                    replacement.name, total_time, _task_timer.db_time))
 
         return replacement
 
@@ -0,0 +1,186 @@
+# encoding: utf-8
+
+import hashlib
+import itertools
+import zlib
+
+from werkzeug.wsgi import ClosingIterator
+
+from .cache import LRUCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = frozenset([
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+])
+# gzip container for zlib.compressobj
+GZIP_WBITS = 31
+
+
+def parse_accept_encoding(header):
+    '''Map of accepted content codings to their q value.'''
+    accepted = {}
+    for item in header.split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+class Compress(object):
+    '''
+    WSGI middleware compressing JSON, text and other compressible responses
+    with brotli (when the `brotli` package is installed) or gzip, negotiated
+    through Accept-Encoding.
+
+    Bodies with a Content-Length below *min_size* are sent as is, streamed
+    responses (no Content-Length) are compressed chunk by chunk, and the
+    compressed body of responses carrying an ETag is kept in an LRU (by a
+    digest of the uncompressed body) so cacheable responses are only
+    compressed once.
+    '''
+    def __init__(self, application, level=6, brotli_quality=4, min_size=500,
+                 cache_size=256, cache_ttl=3600):
+        self.application = application
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.min_size = min_size
+        self.cache = LRUCache(cache_size) if cache_size else None
+        self.cache_ttl = cache_ttl
+
+    def negotiate(self, environ):
+        '''The content coding to use for this request, or None.'''
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return None
+        accepted = parse_accept_encoding(environ.get('HTTP_ACCEPT_ENCODING',
+                                                     ''))
+        if brotli is not None and accepted.get('br', 0) > 0:
+            return 'br'
+        if accepted.get('gzip', accepted.get('*', 0)) > 0:
+            return 'gzip'
+        return None
+
+    def compressible(self, status, headers):
+        if not status.startswith('200'):
+            return False
+        names = dict((name.lower(), value) for name, value in headers)
+        if 'content-encoding' in names:
+            return False
+        if 'no-transform' in names.get('cache-control', ''):
+            return False
+        mimetype = names.get('content-type', '').split(';')[0].strip()
+        if not (mimetype.startswith('text/') or
+                mimetype in COMPRESSIBLE_TYPES):
+            return False
+        length = names.get('content-length')
+        return length is None or int(length) >= self.min_size
+
+    def compressor(self, encoding):
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            return compressor.process, compressor.flush, compressor.finish
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, GZIP_WBITS)
+        return (compressor.compress,
+                lambda: compressor.flush(zlib.Z_SYNC_FLUSH),
+                compressor.flush)
+
+    def cache_key(self, body, encoding):
+        '''
+        Key of a compressed body in the cache: a digest of the uncompressed
+        body, so a cached body is only served for the very bytes the
+        application just produced. ETags can't be trusted for this, a
+        version based one is shared by the responses built for every user.
+        '''
+        return hashlib.blake2b(body, digest_size=32).digest(), encoding
+
+    def compress(self, body, encoding):
+        compress, flush, finish = self.compressor(encoding)
+        return compress(body) + finish()
+
+    def stream(self, app_iter, encoding, written=()):
+        compress, flush, finish = self.compressor(encoding)
+        for chunk in itertools.chain(written, app_iter):
+            data = compress(chunk)
+            # flush every chunk so streamed data reaches the client without
+            # waiting for the compressor's buffer to fill up
+            yield data + flush()
+        yield finish()
+
+    def __call__(self, environ, start_response):
+        encoding = self.negotiate(environ)
+        if encoding is None:
+            return self.application(environ, start_response)
+
+        captured = []
+        written = []
+
+        def capture(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return written.append
+
+        app_iter = self.application(environ, capture)
+        status, original_headers, exc_info = captured
+        if not self.compressible(status, original_headers):
+            start_response(status, original_headers, exc_info)
+            if written:
+                return ClosingIterator(itertools.chain(written, app_iter),
+                                       getattr(app_iter, 'close', None))
+            return app_iter
+
+        names = dict((name.lower(), value) for name, value in original_headers)
+        headers = [(name, value) for name, value in original_headers
+                   if name.lower() not in ('content-length', 'etag', 'vary')]
+        headers.append(('Content-Encoding', encoding))
+        vary = names.get('vary')
+        headers.append(('Vary', vary + ', Accept-Encoding' if vary else
+                        'Accept-Encoding'))
+        etag = names.get('etag')
+        if etag:
+            # the compressed representation differs byte-wise
+            headers.append(('ETag', etag if etag.startswith('W/') else
+                            'W/' + etag))
+
+        # app_iter.close() is left to the server closing the returned
+        # iterable: it runs call_on_close callbacks (i.e. after_response
+        # jobs) that must only start once the response has been sent
+        close = getattr(app_iter, 'close', None)
+        if 'content-length' not in names:
+            start_response(status, headers, exc_info)
+            return ClosingIterator(self.stream(app_iter, encoding, written),
+                                   close)
+
+        try:
+            body = b''.join(written) + b''.join(app_iter)
+        except Exception:
+            if close is not None:
+                close()
+            raise
+        cache_key = None
+        if etag and self.cache is not None:
+            cache_key = self.cache_key(body, encoding)
+        compressed = self.cache.get(cache_key) if cache_key else None
+        if compressed is None:
+            compressed = self.compress(body, encoding)
+            if cache_key:
+                self.cache.set(cache_key, compressed, self.cache_ttl)
+        body = compressed
+
+        headers.append(('Content-Length', str(len(body))))
+        start_response(status, headers, exc_info)
+        return ClosingIterator([body], close)
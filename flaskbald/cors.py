@@ -0,0 +1,109 @@
+# encoding: utf-8
+
+import fnmatch
+import re
+
+ALL_ORIGINS = '*'
+DEFAULT_METHODS = 'GET, HEAD, POST, PUT, PATCH, DELETE, OPTIONS'
+DEFAULT_ALLOW_HEADERS = ('Origin, X-Requested-With, Content-Type, Accept, '
+                         'Authorization')
+DEFAULT_EXPOSE_HEADERS = 'ETag'
+DEFAULT_MAX_AGE = 86400
+# bound on the per origin header cache filled by wildcard origin matches
+MAX_CACHED_ORIGINS = 1024
+
+
+def _as_list(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(',') if item.strip()]
+    return list(value)
+
+
+class CrossOrigin(object):
+    '''
+    WSGI middleware owning every Access-Control-* header of the app.
+
+    Header sets are computed once per origin policy: responses get the
+    precomputed headers (replacing any Access-Control-* header set further
+    down, so none is ever duplicated) and preflight OPTIONS requests are
+    answered right here, without running the Flask request handlers, with a
+    cacheable Access-Control-Max-Age.
+    '''
+    def __init__(self, application, origins=ALL_ORIGINS,
+                 methods=DEFAULT_METHODS, allow_headers=DEFAULT_ALLOW_HEADERS,
+                 expose_headers=DEFAULT_EXPOSE_HEADERS,
+                 supports_credentials=False, max_age=DEFAULT_MAX_AGE):
+        self.application = application
+        self.supports_credentials = supports_credentials
+
+        origins = _as_list(origins) or [ALL_ORIGINS]
+        self.any_origin = ALL_ORIGINS in origins and not supports_credentials
+        self.reflect_any = ALL_ORIGINS in origins and supports_credentials
+        self.origins = frozenset(origin.lower() for origin in origins
+                                 if '*' not in origin)
+        self.patterns = tuple(re.compile(fnmatch.translate(origin.lower()))
+                              for origin in origins
+                              if '*' in origin and origin != ALL_ORIGINS)
+
+        common = []
+        if supports_credentials:
+            common.append(('Access-Control-Allow-Credentials', 'true'))
+        self.simple = list(common)
+        expose = ', '.join(_as_list(expose_headers))
+        if expose:
+            self.simple.append(('Access-Control-Expose-Headers', expose))
+        self.preflight = list(common) + [
+            ('Access-Control-Allow-Methods', ', '.join(_as_list(methods))),
+            ('Access-Control-Allow-Headers',
+             ', '.join(_as_list(allow_headers))),
+            ('Access-Control-Max-Age', str(int(max_age))),
+        ]
+
+        self._headers = {}
+        if self.any_origin:
+            self._headers[ALL_ORIGINS] = self._build(ALL_ORIGINS)
+        for origin in self.origins:
+            self._headers[origin] = self._build(origin)
+
+    def _build(self, origin):
+        '''(response headers, preflight headers) for an allowed origin.'''
+        allow = [('Access-Control-Allow-Origin', origin)]
+        if origin != ALL_ORIGINS:
+            allow.append(('Vary', 'Origin'))
+        return allow + self.simple, allow + self.preflight
+
+    def headers_for(self, origin):
+        '''Precomputed header sets for *origin*, None if not allowed.'''
+        if self.any_origin:
+            return self._headers[ALL_ORIGINS]
+        key = origin.lower()
+        headers = self._headers.get(key)
+        if headers is None and (self.reflect_any or any(
+                pattern.match(key) for pattern in self.patterns)):
+            headers = self._build(origin)
+            if len(self._headers) < MAX_CACHED_ORIGINS:
+                self._headers[key] = headers
+        return headers
+
+    def __call__(self, environ, start_response):
+        origin = environ.get('HTTP_ORIGIN')
+        headers = self.headers_for(origin) if origin else None
+        if headers is None:
+            return self.application(environ, start_response)
+
+        response_headers, preflight_headers = headers
+        if (environ.get('REQUEST_METHOD') == 'OPTIONS' and
+                'HTTP_ACCESS_CONTROL_REQUEST_METHOD' in environ):
+            start_response('204 No Content',
+                           preflight_headers + [('Content-Length', '0')])
+            return []
+
+        def cors_start_response(status, app_headers, exc_info=None):
+            app_headers = [(name, value) for name, value in app_headers
+                           if not name.lower().startswith('access-control-')]
+            return start_response(status, app_headers + response_headers,
+                                  exc_info)
+
+        return self.application(environ, cors_start_response)
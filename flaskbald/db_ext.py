@@ -1,6 +1,13 @@
 # encoding: utf-8
 
+import json
+import zlib
+
+import sqlalchemy as sa
+
+from sqlalchemy import event
 from sqlalchemy.ext.mutable import Mutable
+from sqlalchemy.orm.state import InstanceState
 from flask_sqlalchemy import SQLAlchemy
 
 from .model import create_model
@@ -9,6 +16,183 @@ from .model import create_model
 db = SQLAlchemy()
 Model = create_model(db)
 
+# first byte of a PackedJSON value: msgpack, or zlib compressed msgpack
+PACKED = b'M'
+PACKED_ZLIB = b'Z'
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise ImportError("PackedJSON columns require the msgpack package")
+    return msgpack
+
+
+def pack(value, compress_threshold=1024, level=6):
+    '''
+    Encode a JSON-compatible value as msgpack, zlib compressed when the
+    encoding is at least *compress_threshold* bytes (None to never).
+    '''
+    data = _msgpack().packb(value, use_bin_type=True)
+    if compress_threshold is not None and len(data) >= compress_threshold:
+        return PACKED_ZLIB + zlib.compress(data, level)
+    return PACKED + data
+
+
+def unpack(data):
+    '''Decode a value encoded by :py:func:`pack`.'''
+    data = bytes(data)
+    header, data = data[:1], data[1:]
+    if header == PACKED_ZLIB:
+        data = zlib.decompress(data)
+    elif header != PACKED:
+        raise ValueError("Not a packed value (header {0!r})".format(header))
+    return _msgpack().unpackb(data, raw=False)
+
+
+def is_packed(data):
+    return (isinstance(data, (bytes, bytearray, memoryview)) and
+            bytes(data[:1]) in (PACKED, PACKED_ZLIB))
+
+
+class Packed(object):
+    '''Still encoded value of a PackedJSON column, see unpack().'''
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def unpack(self):
+        return unpack(self.data)
+
+
+class PackedJSON(sa.TypeDecorator):
+    '''
+    Binary column type storing JSON-compatible documents as msgpack,
+    compressed with zlib above *compress_threshold* bytes: smaller than
+    text JSON and cheaper to encode and decode.
+
+    Pairs with MutationDict, which leaves the value encoded when a row is
+    loaded and only decodes it when the attribute is first read (values
+    reloaded after an expire are decoded right away)::
+
+        document = db.Column(MutationDict.as_mutable(PackedJSON))
+
+    Outside of the ORM (Core queries, Model.select) values are returned as
+    :py:class:`Packed`.
+    '''
+    impl = sa.LargeBinary
+
+    def __init__(self, compress_threshold=1024, level=6, *pargs, **kargs):
+        sa.TypeDecorator.__init__(self, *pargs, **kargs)
+        self.compress_threshold = compress_threshold
+        self.level = level
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, Packed):
+            return value.data
+        return pack(value, self.compress_threshold, self.level)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else Packed(value)
+
+    def serialize_value(self, value):
+        "Plain value for Model.serialize(), decoding rows from select()."
+        return value.unpack() if isinstance(value, Packed) else value
+
+
+class LazyUnpack(object):
+    '''
+    Instance level loader of a PackedJSON attribute (the mechanism used by
+    deferred columns): decodes the value and wraps it in the mutable type
+    on first access.
+    '''
+    __slots__ = ('packed', 'mutable', 'key')
+
+    def __init__(self, packed, mutable, key):
+        self.packed = packed
+        self.mutable = mutable
+        self.key = key
+
+    def __call__(self, state, passive):
+        value = self.mutable.coerce(self.key, self.packed.unpack())
+        value._parents[state.obj()] = self.key
+        return value
+
+
+def _lazy_unpack(mutable, attribute):
+    # InstanceState.callables isn't public API (tests/test_packed_json.py
+    # checks it still behaves as expected): without it, values are simply
+    # decoded when the row is loaded.
+    if not hasattr(InstanceState, 'callables'):
+        return
+    key = attribute.key
+
+    def load(state, *args):
+        value = state.dict.get(key)
+        if isinstance(value, Packed):
+            # leave the attribute unloaded, with a loader decoding it
+            del state.dict[key]
+            if 'callables' not in state.__dict__:
+                state.callables = {}
+            state.callables[key] = LazyUnpack(value, mutable, key)
+
+    # before the Mutable listener, which would coerce (decode) the value.
+    # Refreshes of expired attributes stay eager: the attribute being read
+    # may be this one, and it must be populated when the refresh returns.
+    event.listen(attribute.class_, 'load', load, raw=True, propagate=True,
+                 insert=True)
+
+
+def convert_json_column(bind, table, source, target=None, batch_size=500,
+                        compress_threshold=1024):
+    '''
+    Migrate a text JSON column to PackedJSON, *batch_size* rows at a time.
+
+    The packed values are written to *target* (the same column by default,
+    which works on sqlite; on postgres add a bytea column, convert into it,
+    then drop the text column and rename). Values already packed are
+    skipped, so an interrupted migration can simply be run again. Returns
+    the number of converted rows.
+    '''
+    source = table.c[source]
+    target = table.c[target] if target is not None else source
+    primary_key = list(table.primary_key.columns)
+    update = table.update().where(sa.and_(*[
+        column == sa.bindparam('pk_' + column.name)
+        for column in primary_key])).values(
+            {target.name: sa.bindparam('packed')})
+
+    converted = 0
+    last = None
+    while True:
+        query = sa.select(primary_key + [source]).order_by(*primary_key)
+        if last is not None:
+            query = query.where(sa.tuple_(*primary_key) > sa.tuple_(*last)
+                                if len(primary_key) > 1 else
+                                primary_key[0] > last[0])
+        rows = bind.execute(query.limit(batch_size)).fetchall()
+        if not rows:
+            return converted
+        params = []
+        for row in rows:
+            value = row[source.name]
+            if value is None or is_packed(value):
+                continue
+            if isinstance(value, (bytes, bytearray, memoryview)):
+                value = bytes(value).decode('utf-8')
+            params.append(dict(
+                [('pk_' + column.name, row[column.name])
+                 for column in primary_key] +
+                [('packed', pack(json.loads(value), compress_threshold))]))
+        if params:
+            bind.execute(update, params)
+            converted += len(params)
+        last = [rows[-1][column.name] for column in primary_key]
+
 
 class MutationDict(Mutable, dict):
     '''
@@ -20,22 +204,43 @@ class MutationDict(Mutable, dict):
     @classmethod
     def coerce(cls, key, value):
         "Convert plain dictionaries to MutationDict."
-        if not isinstance(value, MutationDict):
+        if isinstance(value, Packed):
+            value = value.unpack()
+        if not isinstance(value, cls):
             if isinstance(value, dict):
-                return MutationDict(value)
+                return cls(value)
             # this call will raise ValueError
             return Mutable.coerce(key, value)
         else:
             return value
 
+    @classmethod
+    def associate_with_attribute(cls, attribute):
+        "Decode PackedJSON columns lazily, on first access."
+        if isinstance(attribute.property.columns[0].type, PackedJSON):
+            _lazy_unpack(cls, attribute)
+        super(MutationDict, cls).associate_with_attribute(attribute)
+
     def update(self, *args, **kwargs):
         '''
-        Updates the current dictionary with kargs or a passed in dict.
-        Calls the internal setitem for the update method to maintain
-        mutation tracking.
+        Updates the current dictionary with kargs or a passed in dict,
+        emitting a single change event for the whole update.
         '''
-        for k, v in dict(*args, **kwargs).iteritems():
-            self[k] = v
+        dict.update(self, *args, **kwargs)
+        self.changed()
+
+    def setdefault(self, key, default=None):
+        "Emits a change event only when the key gets inserted."
+        if key in self:
+            return dict.__getitem__(self, key)
+        dict.__setitem__(self, key, default)
+        self.changed()
+        return default
+
+    def clear(self):
+        "Clear the dictionary with a single change event."
+        dict.clear(self)
+        self.changed()
 
     def __setitem__(self, key, value):
         "Detect dictionary set events and emit change events."
@@ -51,12 +256,18 @@ class MutationDict(Mutable, dict):
         '''Get state returns a plain dictionary for pickling purposes.'''
         return dict(self)
 
+    def __reduce_ex__(self, protocol):
+        # the default dict subclass reduction restores items one
+        # __setitem__ (so one change event) at a time, use __setstate__
+        return (self.__class__, (), self.__getstate__())
+
     def __setstate__(self, state):
         '''
         Set state assumes a plain dictionary and then re-constitutes a
-        Mutable dict.
+        Mutable dict. Restoring state is not a change, so no event is
+        emitted and the unpickled parent isn't marked dirty.
         '''
-        self.update(state)
+        dict.update(self, state)
 
     def pop(self, *pargs, **kargs):
         """
@@ -81,3 +292,115 @@ class MutationDict(Mutable, dict):
         else:
             self.changed()
             return result
+
+
+class TrackedDict(dict):
+    '''
+    Nested dictionary of a :py:class:`NestedMutationDict`, reporting its
+    mutations to the root.
+    '''
+    __slots__ = ('root',)
+
+    def __init__(self, value, root):
+        dict.__init__(self, value)
+        self.root = root
+
+    def __getitem__(self, key):
+        return _tracked(self, key, dict.__getitem__(self, key), self.root)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            dict.__setitem__(self, key, default)
+            self.root.changed()
+        return self[key]
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+class TrackedList(list):
+    '''
+    Nested list of a :py:class:`NestedMutationDict`, reporting its
+    mutations to the root.
+    '''
+    __slots__ = ('root',)
+
+    def __init__(self, value, root):
+        list.__init__(self, value)
+        self.root = root
+
+    def __getitem__(self, index):
+        value = list.__getitem__(self, index)
+        if isinstance(index, slice):
+            return value
+        return _tracked(self, index, value, self.root)
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+def _changes_root(method):
+    def replacement(self, *pargs, **kargs):
+        result = method(self, *pargs, **kargs)
+        self.root.changed()
+        return result
+    replacement.__name__ = method.__name__
+    return replacement
+
+
+for _name in ('__setitem__', '__delitem__', 'update', 'pop', 'popitem',
+              'clear'):
+    setattr(TrackedDict, _name, _changes_root(getattr(dict, _name)))
+for _name in ('__setitem__', '__delitem__', '__iadd__', '__imul__', 'append',
+              'extend', 'insert', 'pop', 'remove', 'clear', 'sort',
+              'reverse'):
+    setattr(TrackedList, _name, _changes_root(getattr(list, _name)))
+
+
+def _tracked(container, key, value, root):
+    '''
+    Wrap a plain nested dict or list the first time it is read, storing the
+    wrapper back in place so later reads return the same object.
+    '''
+    value_type = type(value)
+    if value_type is dict:
+        value = TrackedDict(value, root)
+    elif value_type is list:
+        value = TrackedList(value, root)
+    else:
+        return value
+    if isinstance(container, dict):
+        dict.__setitem__(container, key, value)
+    else:
+        list.__setitem__(container, key, value)
+    return value
+
+
+class NestedMutationDict(MutationDict):
+    '''
+    A MutationDict that also tracks changes made deep inside nested dicts
+    and lists, i.e. `model.document['settings']['theme'] = 'dark'`.
+
+    Nothing is converted on load: a nested container is only wrapped when
+    it is read through indexing or get(), so large documents cost no more
+    to load than with MutationDict. Containers reached by iterating
+    (values(), items()) are the plain ones and their changes aren't seen.
+    '''
+    def __getitem__(self, key):
+        return _tracked(self, key, dict.__getitem__(self, key), self)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def setdefault(self, key, default=None):
+        # the inserted container is returned wrapped, so changes made
+        # through it are tracked too
+        MutationDict.setdefault(self, key, default)
+        return self[key]
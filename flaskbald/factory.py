@@ -1,22 +1,113 @@
 # encoding: utf-8
 
 import os
+import re
 import jinja2
 
 from flask import Flask, render_template, request
-from flask_cors import CORS, cross_origin
-from flask_errormail import mail_on_500
-from flask_mail import Mail
-from flask_sslify import SSLify
 
+from .background import BackgroundExecutor
 from .db_ext import db
-from .celery_ext import celery
 from .response import APINotFound, api_action
+from .loader import reset_loaders
 from .log import default_debug_log
+from .routes import RouteIndex
+from .shard import close_shards, commit_shards
 
 ALLOWED_HOSTS = 'ALLOWED_HOSTS'
 ALL_HOSTS = '*'
 
+# a DNS name or IPv4 address, or a bracketed IPv6 address, and a port
+host_validation = re.compile(
+    r'^([a-z0-9](?:[a-z0-9-]*[a-z0-9])?'
+    r'(?:\.[a-z0-9](?:[a-z0-9-]*[a-z0-9])?)*\.?'
+    r'|\[[a-f0-9]*:[a-f0-9.:]+\])(?::([0-9]+))?$')
+
+
+def compile_host_pattern(pattern):
+    '''
+    Compile a wildcard host pattern where '*' matches exactly one DNS label
+    and '?' one character of a label: '*.example.com' matches
+    'api.example.com', but not 'example.com' or 'a.b.example.com'.
+    '''
+    wildcards = {'*': '[a-z0-9-]+', '?': '[a-z0-9-]'}
+    return re.compile('^{0}$'.format(''.join(
+        wildcards.get(char) or re.escape(char) for char in pattern)))
+
+
+def compile_allowed_hosts(allowed_hosts):
+    '''
+    Compile the ALLOWED_HOSTS setting into a frozenset of exact host names
+    and a tuple of compiled wildcard patterns (i.e. '*.example.com').
+
+    Returns None when every host is allowed.
+    '''
+    if not allowed_hosts or allowed_hosts == ALL_HOSTS:
+        return None
+    if isinstance(allowed_hosts, str):
+        allowed_hosts = allowed_hosts.replace(',', ' ').split()
+
+    names = set()
+    patterns = []
+    for host in allowed_hosts:
+        host = host.strip().lower()
+        if host == ALL_HOSTS:
+            return None
+        if '*' in host or '?' in host:
+            patterns.append(compile_host_pattern(host))
+        else:
+            names.add(host)
+    return frozenset(names), tuple(patterns)
+
+
+def environ_host(environ):
+    '''The requested host (with port, if any) read from the WSGI environ.'''
+    host = environ.get('HTTP_HOST')
+    if host:
+        return host.lower()
+    host = environ.get('SERVER_NAME', '')
+    port = environ.get('SERVER_PORT')
+    if port and port not in ('80', '443'):
+        host = '{0}:{1}'.format(host, port)
+    return host.lower()
+
+
+def split_host(host):
+    '''
+    Split a host into its name (without any trailing dot) and port, or
+    return (None, None) when it isn't a valid DNS name or IP address.
+    '''
+    match = host_validation.match(host)
+    if match is None:
+        return None, None
+    name, port = match.groups()
+    if name.endswith('.'):
+        name = name[:-1]
+    return name, port
+
+
+def host_allowed(host, allowed_hosts):
+    '''
+    Check a host against compiled allowed hosts, with and without its port.
+    Hosts that are not valid DNS names or IP addresses are never allowed.
+    '''
+    if allowed_hosts is None:
+        return True
+    names, patterns = allowed_hosts
+    hostname, port = split_host(host)
+    if hostname is None:
+        return False
+    candidates = [hostname]
+    if port:
+        candidates.append('{0}:{1}'.format(hostname, port))
+    for candidate in candidates:
+        if candidate in names:
+            return True
+        for pattern in patterns:
+            if pattern.match(candidate):
+                return True
+    return False
+
 
 def load_config(app, config_file=None, env='development'):
     if not config_file:
@@ -82,14 +173,20 @@ def before_handler(app, custom_handler, custom_handler_args, custom_handler_karg
 
         return app
 
+    allowed_hosts = compile_allowed_hosts(app.config.get(ALLOWED_HOSTS))
+    if allowed_hosts is None:
+        return app
+
+    debug = app.config.get('DEBUG', app.config.get('debug'))
+
     @app.before_request
     def before_request():
-        origin_request = request.from_values()
-        if app.config[ALLOWED_HOSTS] != ALL_HOSTS and origin_request.host not in app.config[ALLOWED_HOSTS]:
-            if app.config.get('DEBUG', app.config.get('debug')):
-                return APINotFound(message="Invalid host: '{0}'".format(origin_request.host))
+        host = environ_host(request.environ)
+        if not host_allowed(host, allowed_hosts):
+            if debug:
+                return APINotFound(message="Invalid host: '{0}'".format(host))
             else:
-                return APINotFound()
+                return APINotFound(message='Not Found')
 
     return app
 
@@ -99,9 +196,6 @@ def after_handler(app, custom_handler, custom_handler_args, custom_handler_kargs
     if custom_handler:
         @app.after_request
         def after_request(response):
-            response.headers.add('Access-Control-Allow-Origin', '*')
-            response.headers.add('Access-Control-Allow-Headers', '*')
-            response.headers.add('Access-Control-Allow-Methods', '*')
             custom_handler_kargs['response'] = response
             return custom_handler(*custom_handler_args, **custom_handler_kargs)
 
@@ -110,8 +204,9 @@ def after_handler(app, custom_handler, custom_handler_args, custom_handler_kargs
     @app.after_request
     def after_request(response):
         if db_enabled:
-            # Commit the session
+            # Commit the session, and those of the shards used
             db.session.commit()
+            commit_shards()
 
             # Close the session
             db.session.close()
@@ -127,29 +222,68 @@ def after_handler(app, custom_handler, custom_handler_args, custom_handler_kargs
 
 def init_db(app):
     db.init_app(app)
+    app.teardown_appcontext(close_shards)
+    app.teardown_appcontext(reset_loaders)
     return app
 
 
-def setup_routes(app):
-    routes = {}
-    print('{:40s} {:45s} {}'.format(
-            'Function', 'Valid Methods', 'Route'
-    ))
-    for rule in app.url_map.iter_rules():
-        routes[rule.endpoint] = {
-            'url': rule.rule if rule.rule else None,
-            'methods': rule.methods if rule.methods else [],
-            'args': {arg:arg for arg in rule.arguments} if rule.arguments else {}
-        }
+def setup_routes(app, print_routes=False):
+    # precomputed reverse URL building, see template.route_url
+    index = app.config['route_index'] = RouteIndex(app.url_map)
+    app.config['routes'] = index.to_dict()
 
-        methods = rule.methods #[m for m in rule.methods if m not in ('HEAD', 'OPTIONS')]
+    if print_routes is True or app.config.get('PRINT_ROUTES') is True:
         print('{:40s} {:45s} {}'.format(
-            rule.endpoint,
-            ' '.join(methods),
-            rule.rule
+                'Function', 'Valid Methods', 'Route'
         ))
+        for rule in app.url_map.iter_rules():
+            print('{:40s} {:45s} {}'.format(
+                rule.endpoint,
+                ' '.join(rule.methods),
+                rule.rule
+            ))
+
+    return app
+
+
+def setup_slow_query_log(app):
+    from .log import slow_query_log
+    slow_query_log.init_app(app)
+    return app
+
 
-    app.config['routes'] = routes
+def setup_background(app):
+    # the app's own executor, see background.get_executor
+    BackgroundExecutor(app)
+    return app
+
+
+def setup_compression(app):
+    from .compress import Compress
+    app.wsgi_app = Compress(
+        app.wsgi_app,
+        level=app.config.get('COMPRESS_LEVEL', 6),
+        brotli_quality=app.config.get('COMPRESS_BROTLI_QUALITY', 4),
+        min_size=app.config.get('COMPRESS_MIN_SIZE', 500),
+        cache_size=app.config.get('COMPRESS_CACHE_SIZE', 256))
+    return app
+
+
+def setup_cors(app):
+    from .cors import (CrossOrigin, ALL_ORIGINS, DEFAULT_METHODS,
+                       DEFAULT_ALLOW_HEADERS, DEFAULT_EXPOSE_HEADERS,
+                       DEFAULT_MAX_AGE)
+    app.wsgi_app = CrossOrigin(
+        app.wsgi_app,
+        origins=app.config.get('CORS_ORIGINS', ALL_ORIGINS),
+        methods=app.config.get('CORS_METHODS', DEFAULT_METHODS),
+        allow_headers=app.config.get('CORS_ALLOW_HEADERS',
+                                     DEFAULT_ALLOW_HEADERS),
+        expose_headers=app.config.get('CORS_EXPOSE_HEADERS',
+                                      DEFAULT_EXPOSE_HEADERS),
+        supports_credentials=app.config.get('CORS_SUPPORTS_CREDENTIALS',
+                                            False),
+        max_age=app.config.get('CORS_MAX_AGE', DEFAULT_MAX_AGE))
     return app
 
 
@@ -159,7 +293,8 @@ def create_app(config_file, blueprints=[], custom_error_endpoints=False,
                custom_after_handler=None, custom_after_handler_args=[],
                custom_after_handler_kargs={}, template_folder=None,
                cors=True, ssl_only=True, db_enabled=True, static_url_path=None,
-               static_folder=None):
+               static_folder=None, print_routes=False, compress=False,
+               asgi=False):
 
     if config_file is None:
         raise(Exception("Hey, 'config_files' cannot be 'None'!"))
@@ -175,7 +310,9 @@ def create_app(config_file, blueprints=[], custom_error_endpoints=False,
     app = Flask(__name__, **flask_init_options)
     app = load_config(app, config_file)
 
+    # optional extensions are imported only when enabled to keep startup fast
     if ssl_only is True and app.config.get("DEBUG") is False:
+        from flask_sslify import SSLify
         sslify = SSLify(app)
 
     app = setup_templates(app, custom_template_paths)
@@ -186,13 +323,28 @@ def create_app(config_file, blueprints=[], custom_error_endpoints=False,
     app = after_handler(app, custom_after_handler, custom_after_handler_args, custom_after_handler_kargs, db_enabled)
     if db_enabled:
         app = init_db(app)
-    app = setup_routes(app)
+        if app.config.get('SLOW_QUERY_THRESHOLD') is not None:
+            app = setup_slow_query_log(app)
+    app = setup_routes(app, print_routes)
+
+    if compress is True:
+        app = setup_compression(app)
 
+    # wrapped last so preflight requests are answered before anything else
     if cors is True:
-        cors = CORS(app)
-        app.config['CORS_HEADERS'] = 'Content-Type'
+        app = setup_cors(app)
+
+    # ASGI entry point for async servers: `uvicorn project.run:app.asgi_app`
+    if asgi is True:
+        from .async_ext import ASGIApp
+        app.asgi_app = ASGIApp(app.wsgi_app,
+                               max_workers=app.config.get('ASGI_MAX_WORKERS'))
+
+    app = setup_background(app)
 
     if app.config.get('DEBUG') is False:
+        from flask_errormail import mail_on_500
+        from flask_mail import Mail
         mail = Mail(app)
         mail_on_500(app, app.config.get('ADMINS'))
 
@@ -200,5 +352,6 @@ def create_app(config_file, blueprints=[], custom_error_endpoints=False,
 
 
 def create_celery_app(app):
+    from .celery_ext import celery
     celery.init_app(app)
     return celery
@@ -0,0 +1,176 @@
+# encoding: utf-8
+
+import sqlalchemy as sa
+
+from flask import g, has_app_context
+from sqlalchemy.orm.util import identity_key
+
+# bound on the number of keys sent in a single IN (...) clause
+MAX_BATCH = 500
+# marks a key that was looked up and not found
+MISSING = object()
+
+
+class Deferred(object):
+    '''
+    Value of a :py:meth:`Loader.load` call. Reading `value` (or any
+    attribute of the instance through the deferred) resolves every key
+    queued on the loader so far in one query.
+    '''
+    __slots__ = ('loader', 'key')
+
+    def __init__(self, loader, key):
+        self.loader = loader
+        self.key = key
+
+    @property
+    def value(self):
+        '''The loaded instance, None when no row has this key.'''
+        return self.loader.result(self.key)
+
+    def __getattr__(self, name):
+        return getattr(self.value, name)
+
+    def __repr__(self):
+        return '<Deferred {0}.{1}={2!r}>'.format(
+            self.loader.model.__name__, self.loader.attribute, self.key)
+
+
+class Loader(object):
+    '''
+    Batching loader of *model* instances by *attribute* (the primary key by
+    default), DataLoader style: keys passed to load() are collected and
+    resolved together in a single `WHERE attribute IN (...)` query, and
+    results are memoized for the life of the loader (a request, see
+    :py:func:`request_loader`).
+    '''
+    def __init__(self, model, session, attribute=None):
+        self.model = model
+        self.session = session
+        mapper = sa.inspect(model)
+        if attribute is None:
+            if len(mapper.primary_key) != 1:
+                raise ValueError("{0} has a composite primary key, pass the "
+                                 "attribute to load by".format(model.__name__))
+            attribute = mapper.get_property_by_column(
+                mapper.primary_key[0]).key
+        self.attribute = attribute
+        # primary key lookups can be answered by the session identity map
+        self.by_identity = (attribute == mapper.get_property_by_column(
+            mapper.primary_key[0]).key and len(mapper.primary_key) == 1)
+        self.pending = []
+        self.results = {}
+
+    def load(self, key):
+        '''Queue *key* and return a :py:class:`Deferred` of its instance.'''
+        if key not in self.results:
+            self.results[key] = None
+            self.pending.append(key)
+        return Deferred(self, key)
+
+    def load_many(self, keys):
+        '''Deferred values of *keys*, in the same order.'''
+        return [self.load(key) for key in keys]
+
+    def result(self, key):
+        if key not in self.results:
+            self.load(key)
+        if self.pending:
+            self.dispatch()
+        value = self.results[key]
+        return None if value is MISSING else value
+
+    def dispatch(self):
+        '''Resolve all queued keys, one query per MAX_BATCH keys.'''
+        keys, self.pending = self.pending, []
+        session = self.session()
+        if self.by_identity:
+            missing = []
+            for key in keys:
+                instance = session.identity_map.get(
+                    identity_key(self.model, key))
+                if instance is None:
+                    missing.append(key)
+                else:
+                    self.results[key] = instance
+            keys = missing
+
+        column = getattr(self.model, self.attribute)
+        for start in range(0, len(keys), MAX_BATCH):
+            batch = keys[start:start + MAX_BATCH]
+            for instance in session.query(self.model).filter(
+                    column.in_(batch)):
+                self.results[getattr(instance, self.attribute)] = instance
+            for key in batch:
+                if self.results[key] is None:
+                    self.results[key] = MISSING
+
+    def prime(self, key, instance):
+        '''Memoize *instance* (or its absence, when None) for *key*.'''
+        self.results[key] = MISSING if instance is None else instance
+
+    def clear(self, key=None):
+        '''Forget the memoized result of *key*, or of every key.'''
+        if key is None:
+            self.results.clear()
+            self.pending = []
+        else:
+            self.results.pop(key, None)
+            if key in self.pending:
+                self.pending.remove(key)
+
+
+def request_loader(model, session, attribute=None):
+    '''
+    The :py:class:`Loader` of *model* by *attribute* for the current
+    request or Celery task (stored on the app context and dropped by
+    :py:func:`reset_loaders` when it ends); a fresh, unshared loader
+    outside of one.
+    '''
+    if not has_app_context():
+        return Loader(model, session, attribute)
+    loaders = getattr(g, '_flaskbald_loaders', None)
+    if loaders is None:
+        loaders = g._flaskbald_loaders = {}
+    key = (model, attribute)
+    loader = loaders.get(key)
+    if loader is None:
+        loader = loaders[key] = Loader(model, session, attribute)
+    return loader
+
+
+def reset_loaders(exception=None):
+    '''
+    Drop the loaders (and their memoized instances) of the current app
+    context. Registered as an app context teardown by the factory and
+    called after every Celery task, so memoized results never outlive
+    their request or task, even in a long-lived worker app context.
+    '''
+    if has_app_context():
+        g.pop('_flaskbald_loaders', None)
+
+
+def clear_loaders(instance):
+    '''Forget *instance* in every loader of its model in this context.'''
+    if not has_app_context():
+        return
+    for (model, attribute), loader in getattr(g, '_flaskbald_loaders',
+                                              {}).items():
+        if isinstance(instance, model):
+            loader.clear(getattr(instance, loader.attribute))
+
+
+class LoaderProperty(object):
+    '''
+    Class attribute giving the request scoped loader of the model it is
+    accessed on, i.e. `User.loader.load(id)`. Declare more on a model to
+    load by other unique columns:
+
+        email_loader = LoaderProperty(db.session, 'email')
+    '''
+    def __init__(self, session, attribute=None):
+        self.session = session
+        self.attribute = attribute
+
+    def __get__(self, instance, owner):
+        return request_loader(owner, self.session, self.attribute)
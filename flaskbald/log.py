@@ -1,8 +1,21 @@
 # encoding: utf-8
 
+import json
 import logging
 import logging.handlers
+import sys
+import threading
+import time
+
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from textwrap import TextWrapper
+
+from flask import abort, has_request_context, request
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import NullPool
+
 log = logging.getLogger(__name__)
 
 
@@ -96,3 +109,261 @@ class LogPoint(object):
         resp = self.application(environ, start_response)
         log.debug(self.log.format(' {0} '.format(self.end_message)))
         return resp
+
+
+# statements worth an EXPLAIN; others are recorded without a plan
+EXPLAINABLE = ('select', 'with', 'update', 'delete')
+REDACTED = '?'
+# plan of an entry while its EXPLAIN is queued
+PLAN_PENDING = 'pending'
+
+
+def redact_parameters(parameters):
+    '''Replace every bound parameter value with a placeholder.'''
+    if isinstance(parameters, dict):
+        return dict((name, REDACTED) for name in parameters)
+    if isinstance(parameters, (list, tuple)):
+        return [redact_parameters(item)
+                if isinstance(item, (dict, list, tuple)) else REDACTED
+                for item in parameters]
+    return REDACTED
+
+
+def query_source():
+    '''The endpoint or Celery task running the current statement.'''
+    if has_request_context():
+        return '{0} {1} ({2})'.format(request.method, request.path,
+                                      request.endpoint)
+    # only look for a task when celery is loaded
+    if 'celery' in sys.modules:
+        from celery import current_task
+        if current_task:
+            return 'task {0}'.format(current_task.name)
+    return None
+
+
+class SlowQueryLog(object):
+    '''
+    Recorder of the statements taking at least *threshold* seconds, hooked
+    into the SQLAlchemy engine events.
+
+    Each entry holds the statement, its parameters (passed through
+    *redact*: True masks every value, or a callable), the duration, the
+    endpoint or Celery task that issued it and, when *explain* is set, the
+    query plan (EXPLAIN QUERY PLAN on sqlite, EXPLAIN elsewhere; cached per
+    database and statement). Entries are kept in a ring buffer of the last
+    *maxlen*.
+
+    Plans are collected off the request path, by a single background
+    thread on its own unpooled connections, so a slow database is not also
+    asked for a second pool connection per slow statement; at most
+    *max_pending* EXPLAINs are queued, later entries go without a plan.
+    '''
+    def __init__(self, threshold=0.5, maxlen=200, explain=True, redact=False,
+                 max_plans=256, max_pending=100, authorize=None):
+        self.threshold = threshold
+        self.explain = explain
+        self.redact = redact
+        self.max_plans = max_plans
+        self.max_pending = max_pending
+        self.authorize = authorize
+        self.entries = deque(maxlen=maxlen)
+        self._plans = OrderedDict()
+        self._engines = {}
+        self._pending = 0
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        '''
+        Configure from SLOW_QUERY_THRESHOLD, SLOW_QUERY_MAXLEN,
+        SLOW_QUERY_EXPLAIN and SLOW_QUERY_REDACT, start recording, and
+        serve the entries as JSON on SLOW_QUERY_URL when set. Statements
+        and parameters reveal the schema and data, so the URL also needs
+        SLOW_QUERY_AUTHORIZE: a function called in the request, returning
+        whether it may read the log (i.e. checking an admin claim).
+        '''
+        config = app.config
+        self.threshold = config.get('SLOW_QUERY_THRESHOLD', self.threshold)
+        self.explain = config.get('SLOW_QUERY_EXPLAIN', self.explain)
+        self.redact = config.get('SLOW_QUERY_REDACT', self.redact)
+        self.authorize = config.get('SLOW_QUERY_AUTHORIZE', self.authorize)
+        maxlen = config.get('SLOW_QUERY_MAXLEN')
+        if maxlen is not None and maxlen != self.entries.maxlen:
+            self.entries = deque(self.entries, maxlen=maxlen)
+        self.enable()
+        if config.get('SLOW_QUERY_URL'):
+            if self.authorize is None:
+                raise ValueError("SLOW_QUERY_URL needs SLOW_QUERY_AUTHORIZE, "
+                                 "the slow query log exposes statements and "
+                                 "their parameters")
+            app.add_url_rule(config['SLOW_QUERY_URL'], 'slow_queries',
+                             self.view)
+
+    def enable(self, target=Engine):
+        '''Start recording statements of *target* (all engines).'''
+        if not event.contains(target, 'before_cursor_execute', self._before):
+            event.listen(target, 'before_cursor_execute', self._before)
+            event.listen(target, 'after_cursor_execute', self._after)
+            event.listen(target, 'handle_error', self._error)
+
+    def disable(self, target=Engine):
+        if event.contains(target, 'before_cursor_execute', self._before):
+            event.remove(target, 'before_cursor_execute', self._before)
+            event.remove(target, 'after_cursor_execute', self._after)
+            event.remove(target, 'handle_error', self._error)
+
+    def _before(self, conn, cursor, statement, parameters, context,
+                executemany):
+        # keyed by cursor: a failing statement never gets to _after, its
+        # start is dropped by _error without touching the others
+        conn.info.setdefault('slow_query_start', {})[id(cursor)] = time.time()
+
+    def _after(self, conn, cursor, statement, parameters, context,
+               executemany):
+        start = conn.info.get('slow_query_start', {}).pop(id(cursor), None)
+        if start is None:
+            return
+        duration = time.time() - start
+        if duration >= self.threshold:
+            self.record(conn.engine, statement, parameters, duration,
+                        executemany)
+
+    def _error(self, context):
+        if context.connection is None:
+            return
+        # the failed cursor may already be closed and unset on the
+        # exception context, the execution context still refers to it
+        cursor = getattr(context.execution_context, 'cursor', context.cursor)
+        context.connection.info.get('slow_query_start', {}).pop(id(cursor),
+                                                                None)
+
+    def record(self, engine, statement, parameters, duration,
+               executemany=False):
+        if executemany:
+            parameters = list(parameters)
+        entry = {
+            'time': time.time(),
+            'duration': duration,
+            'statement': statement,
+            'parameters': self.redacted(parameters),
+            'executemany': executemany,
+            'source': query_source(),
+            'plan': None,
+        }
+        if self.explain:
+            self.queue_plan(
+                entry, engine, statement,
+                parameters[0] if executemany and parameters else parameters)
+        self.entries.append(entry)
+        log.warning("Slow query ({0:.3f}s) from {1}: {2}".format(
+            duration, entry['source'], statement))
+        return entry
+
+    def redacted(self, parameters):
+        if self.redact is True:
+            return redact_parameters(parameters)
+        if callable(self.redact):
+            return self.redact(parameters)
+        if isinstance(parameters, tuple):
+            return list(parameters)
+        return parameters
+
+    def queue_plan(self, entry, engine, statement, parameters):
+        '''
+        Set the plan of *entry*: at once when cached or not explainable,
+        otherwise PLAN_PENDING until the background EXPLAIN completes.
+        '''
+        if not statement.lstrip().lower().startswith(EXPLAINABLE):
+            return
+        if engine.url.database in (None, '', ':memory:'):
+            # a new connection would open a different, empty database
+            return
+        with self._lock:
+            if (engine.url, statement) in self._plans:
+                entry['plan'] = self._plans[engine.url, statement]
+                return
+            if self._pending >= self.max_pending:
+                return
+            self._pending += 1
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=1)
+        entry['plan'] = PLAN_PENDING
+        self._pool.submit(self._explain, entry, engine.url, statement,
+                          parameters)
+
+    def _explain(self, entry, url, statement, parameters):
+        try:
+            entry['plan'] = self.plan(self.explain_engine(url), statement,
+                                      parameters)
+        except Exception as e:
+            entry['plan'] = 'EXPLAIN failed: {0}'.format(e)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def explain_engine(self, url):
+        '''
+        Unpooled engine to the database at *url*, used for EXPLAIN only so
+        it never takes a connection from the application's pool.
+        '''
+        engine = self._engines.get(url)
+        if engine is None:
+            engine = self._engines[url] = create_engine(url,
+                                                        poolclass=NullPool)
+        return engine
+
+    def plan(self, engine, statement, parameters):
+        '''Query plan rows of *statement*, None when not explainable.'''
+        if not statement.lstrip().lower().startswith(EXPLAINABLE):
+            return None
+        key = engine.url, statement
+        with self._lock:
+            if key in self._plans:
+                return self._plans[key]
+        prefix = ('EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite'
+                  else 'EXPLAIN ')
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(prefix + statement, parameters)
+                plan = [' '.join(str(column) for column in row)
+                        for row in cursor.fetchall()]
+            finally:
+                cursor.close()
+        except Exception as e:
+            return 'EXPLAIN failed: {0}'.format(e)
+        finally:
+            connection.close()
+        with self._lock:
+            self._plans[key] = plan
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        return plan
+
+    def snapshot(self):
+        '''Copy of the recorded entries, oldest first.'''
+        return list(self.entries)
+
+    def dump(self, path):
+        '''Append the entries as JSON lines to the file at *path*.'''
+        entries = self.snapshot()
+        with open(path, 'a') as output:
+            for entry in entries:
+                output.write(json.dumps(entry, default=str) + '\n')
+        return len(entries)
+
+    def clear(self):
+        self.entries.clear()
+
+    def view(self):
+        if self.authorize is None or not self.authorize():
+            abort(403)
+        from .response import JSONResponse
+        return JSONResponse(json.dumps({'status': 'success',
+                                        'data': self.snapshot()},
+                                       default=str))
+
+
+slow_query_log = SlowQueryLog()
@@ -14,14 +14,22 @@ from flask_sqlalchemy import SQLAlchemy
 
 import sys
 import re
+import itertools
+import threading
 import sqlalchemy as sa
 
+from collections import namedtuple
+from sqlalchemy.ext import baked
+
 from sqlalchemy.orm.attributes import (
     instance_state
     )
 from sqlalchemy.orm.util import (
     has_identity
 )
+from .cache import invalidate_tags
+from .loader import LoaderProperty, clear_loaders
+from .serialize import compile_serializer, serialize_many
 from .text import camel_to_underscore, pluralize
 
 # the surrogate_pk template that assures that surrogate primary keys
@@ -29,6 +37,143 @@ from .text import camel_to_underscore, pluralize
 surrogate_pk_template = sa.Column(sa.Integer, nullable=False, primary_key=True)
 
 
+# row classes returned by Model.select, by model and column names
+_row_classes = {}
+_row_lock = threading.Lock()
+
+
+def row_class(name, fields):
+    '''
+    Cached namedtuple class for projection rows: a plain tuple per row
+    (no __dict__, no session state) that still supports `row.name`.
+    '''
+    key = (name, fields)
+    cls = _row_classes.get(key)
+    if cls is None:
+        with _row_lock:
+            cls = _row_classes.setdefault(
+                key, namedtuple(name, fields, rename=True))
+    return cls
+
+
+# cache tags of the rows changed in a session's current transaction
+CACHE_TAGS_KEY = 'flaskbald_cache_tags'
+
+
+@sa.event.listens_for(sa.orm.Session, 'after_flush')
+def _collect_cache_tags(session, flush_context):
+    '''Remember the cache tags of the instances written by this flush.'''
+    tags = session.info.setdefault(CACHE_TAGS_KEY, set())
+    for instance in itertools.chain(session.new, session.dirty,
+                                    session.deleted):
+        cache_tags = getattr(instance, 'cache_tags', None)
+        if cache_tags is not None:
+            tags.update(cache_tags())
+
+
+@sa.event.listens_for(sa.orm.Session, 'after_commit')
+def _invalidate_cache_tags(session):
+    # only once committed: invalidating earlier lets a concurrent request
+    # cache the old rows again for the whole TTL
+    tags = session.info.pop(CACHE_TAGS_KEY, None)
+    if tags:
+        invalidate_tags(*tags)
+
+
+@sa.event.listens_for(sa.orm.Session, 'after_transaction_end')
+def _discard_cache_tags(session, transaction):
+    if transaction.parent is None:
+        # rolled back, nothing changed
+        session.info.pop(CACHE_TAGS_KEY, None)
+
+
+# compiled query cache shared by the baked get/all lookups
+bakery = baked.bakery(size=1000)
+# baked queries by model and filter keys, False when they can't be baked
+_baked_queries = {}
+
+
+# selectinload arrived in SQLAlchemy 1.2, subqueryload is the closest
+selectinload = getattr(sa.orm, 'selectinload', sa.orm.subqueryload)
+# loader options of the loading profiles, by model and profile name
+_profile_options = {}
+
+
+def loader_option(model, path):
+    '''
+    Eager loader option for a dotted relationship *path* of *model*:
+    joinedload for many-to-one/one-to-one steps, selectinload for
+    collections, i.e. 'comments.author'.
+    '''
+    option = None
+    mapper = sa.inspect(model)
+    for name in path.split('.'):
+        if name not in mapper.relationships:
+            raise ValueError("'{0}' is not a relationship of {1}".format(
+                name, mapper.class_.__name__))
+        relationship = mapper.relationships[name]
+        strategy = selectinload if relationship.uselist else sa.orm.joinedload
+        attribute = getattr(mapper.class_, name)
+        option = (strategy(attribute) if option is None else
+                  getattr(option, strategy.__name__)(attribute))
+        mapper = relationship.mapper
+    return option
+
+
+def profile_options(model, profile=None):
+    '''
+    Loader options of the *profile* loading profile declared on *model*
+    (its 'default' profile when None), built once. Profile entries are
+    relationship paths (see :py:func:`loader_option`) or loader options.
+    '''
+    key = (model, profile)
+    options = _profile_options.get(key)
+    if options is None:
+        profiles = model.profiles
+        if profile is None:
+            entries = profiles.get('default', ())
+        elif profile in profiles:
+            entries = profiles[profile]
+        else:
+            raise KeyError("{0} has no loading profile '{1}'".format(
+                model.__name__, profile))
+        options = _profile_options[key] = tuple(
+            loader_option(model, entry) if isinstance(entry, str) else entry
+            for entry in entries)
+    return options
+
+
+def baked_query(model, where, profile=None):
+    '''
+    Baked query of *model* filtered by equality on the keys of *where*,
+    keyed on the model, the set of keys (None values filter with IS NULL)
+    and the loading profile, so the SQL is built and compiled once per key
+    set. Returns None when a key is not a column (i.e. a relationship),
+    which needs filter_by().
+    '''
+    key = (model, tuple(sorted((name, where[name] is None)
+                               for name in where)), profile)
+    query = _baked_queries.get(key)
+    if query is None:
+        columns = sa.inspect(model).columns
+        if all(name in columns for name in where):
+            def criteria(q):
+                return q.filter(*[getattr(model, name).is_(None) if is_none
+                                  else getattr(model, name) ==
+                                  sa.bindparam(name)
+                                  for name, is_none in key[1]])
+            query = bakery(lambda session: session.query(model), model)
+            if where:
+                query.add_criteria(criteria, key[1])
+            options = profile_options(model, profile)
+            if options:
+                query.add_criteria(lambda q: q.options(*options), profile)
+        else:
+            query = False
+        _baked_queries[key] = query
+    return query or None
+
+
 def get_models(module):
     models_dict = {}
     def assign_attr(item):
@@ -69,6 +214,40 @@ def create_model(db):
         NotFound = sa.orm.exc.NoResultFound
         MultipleFound = sa.orm.exc.MultipleResultsFound
 
+        # columns left out of serialize()/to_dict() unless asked for by name
+        __serialize_exclude__ = ()
+        # heavy columns (large text, JSON documents) only loaded on access
+        # and left out of select() and serialize() unless asked for by name
+        __deferred__ = ()
+
+        # named eager loading profiles accepted by get/all/load (the
+        # first argument, or `_profile=`), i.e.
+        # {'list': ['author'], 'detail': ['author', 'comments.author']}:
+        # relationship paths (joined for scalars, selectin for collections)
+        # or loader options. A 'default' profile applies when none is given.
+        profiles = {}
+
+        # request scoped batching loader by primary key, i.e.
+        # `authors = [User.loader.load(post.author_id) for post in posts]`
+        # runs a single IN (...) query when the first value is read
+        loader = LoaderProperty(db.session)
+
+        def __init_subclass__(cls, **kargs):
+            # runs before the declarative mapping, so __deferred__ columns
+            # are mapped as if declared with sa.orm.deferred()
+            super(Model, cls).__init_subclass__(**kargs)
+            for name in cls.__dict__.get('__deferred__', ()):
+                column = getattr(cls, name, None)
+                if not isinstance(column, sa.Column):
+                    raise AttributeError(
+                        "{0}.{1} in __deferred__ is not a column".format(
+                            cls.__name__, name))
+                if name not in cls.__dict__:
+                    # inherited from a mixin or the base: declarative would
+                    # copy it per table, so must we
+                    column = column.copy()
+                setattr(cls, name, sa.orm.deferred(column))
+
         def is_modified(self):
             '''Check if SQLAlchemy believes this instance is modified.'''
             return instance_state(self).modified
@@ -87,6 +266,52 @@ def create_model(db):
             '''
             return has_identity(self)
 
+        def cache_tags(self):
+            '''
+            Response cache tags evicted when a change to this instance is
+            committed: the table name and, once persisted,
+            `table:primary_key`.
+            '''
+            tags = [self.__tablename__]
+            identity = instance_state(self).identity
+            if identity:
+                tags.append('{0}:{1}'.format(
+                    self.__tablename__, ':'.join(str(key) for key in identity)))
+            return tags
+
+        def to_dict(self, *fields, **options):
+            '''
+            JSON-ready dict of this instance, see
+            :py:meth:`~flaskbald.model.Model.serializer`.
+            '''
+            return self.serializer(*fields, **options)(self)
+
+        @classmethod
+        def serializer(cls, *fields, **options):
+            '''
+            Compiled function turning an instance, or a result row with the
+            same attribute names, into a JSON-ready dict. Compiled once per
+            model and options.
+
+            Defaults to every column but `__serialize_exclude__` and
+            `__deferred__` ones; options are
+            `exclude`, `nested` (relationship name to fields) and
+            `datetime_format`::
+
+                Post.serializer('id', 'title', 'author', 'date_created',
+                                nested={'author': ('id', 'name')})
+            '''
+            return compile_serializer(cls, fields or None, **options)
+
+        @classmethod
+        def serialize(cls, items, *fields, **options):
+            '''
+            Serialize a list of instances or rows, i.e.
+            `Post.serialize(db.session.query(Post.id, Post.title), 'id',
+            'title')` for a list endpoint without ORM hydration.
+            '''
+            return serialize_many(cls.serializer(*fields, **options), items)
+
         def flush(self):
             '''
             Syncs all pending SQL changes (including other pending objects) to
@@ -113,6 +338,7 @@ def create_model(db):
             for that use :py:meth:`~pybald.db.models.Model.commit`)
             '''
             db.session.add(self)
+            clear_loaders(self)
             if flush:
                 self.flush()
             return self
@@ -127,6 +353,7 @@ def create_model(db):
             the database and commit the transaction.
             '''
             db.session.delete(self)
+            clear_loaders(self)
             if flush:
                 self.flush()
             return self
@@ -144,36 +371,134 @@ def create_model(db):
             return self
 
         @classmethod
-        def get(cls, **where):
+        def baked(cls, _profile=None, **where):
+            '''
+            Precompiled query result of the instances matching *where*,
+            supporting one(), first() and all(); falls back to a regular
+            query for filters on relationships.
+            '''
+            query = baked_query(cls, where, _profile)
+            if query is None:
+                return cls.load(_profile, **where)
+            return query(db.session()).params(**dict(
+                (name, value) for name, value in where.items()
+                if value is not None))
+
+        @classmethod
+        def get(cls, _profile=None, **where):
             '''
             A convenience method that constructs a load query with keyword
             arguments as the filter arguments and return a single instance.
+
+            The query is baked: built and compiled once per model and set of
+            filter keys. *_profile* names one of the model's loading
+            `profiles` (underscored so it can't shadow a column filter).
             '''
-            return cls.load(**where).one()
+            return cls.baked(_profile, **where).one()
 
         @classmethod
-        def all(cls, **where):
+        def all(cls, _profile=None, **where):
             '''
             Returns a collection of objects that can be filtered for
             specific collections.
 
-            all() without arguments returns all the items of the model type.
+            all() without arguments returns all the items of the model type,
+            `all('list')` eager loads them with the 'list' profile.
+            '''
+            return cls.baked(_profile, **where).all()
+
+        @classmethod
+        def get_many(cls, ids):
+            '''
+            Instances with the primary keys *ids*, in the same order (None
+            for missing ones), loaded with one query through the request
+            loader and memoized for the rest of the request.
+            '''
+            loader = cls.loader
+            deferred = loader.load_many(ids)
+            if loader.pending:
+                loader.dispatch()
+            return [item.value for item in deferred]
+
+        @classmethod
+        def version(cls, **where):
+            '''
+            Cheap version key of the (filtered) rows: the most recent
+            `date_modified` and the row count, suitable for ETags.
+            '''
+            query = db.session.query(sa.func.max(cls.date_modified),
+                                     sa.func.count()).select_from(cls)
+            if where:
+                query = query.filter_by(**where)
+            last_modified, count = query.one()
+            return '{0}-{1}'.format(last_modified, count)
+
+        @classmethod
+        def projection(cls, *columns, **where):
             '''
-            return cls.load(**where).all()
+            Core SELECT of the given columns (attribute names or column
+            expressions) filtered by equality on *where*. Defaults to every
+            column that isn't deferred.
+            '''
+            if not columns:
+                columns = [attr.key for attr in sa.inspect(cls).column_attrs
+                           if not attr.deferred]
+            columns = [getattr(cls, column).label(column)
+                       if isinstance(column, str) else column
+                       for column in columns]
+            statement = sa.select(columns)
+            for key, value in where.items():
+                statement = statement.where(getattr(cls, key) == value)
+            return statement
 
         @classmethod
-        def load(cls, **where):
+        def select(cls, *columns, **where):
+            '''
+            Read-only listing without ORM hydration: returns namedtuple rows
+            of the selected columns, not tracked by the session.
+
+                for row in Post.select('id', 'title', author_id=1):
+                    row.title
+            '''
+            if db.session.autoflush:
+                db.session.flush()
+            result = db.session.execute(cls.projection(*columns, **where))
+            row = row_class(cls.__name__ + 'Row', tuple(result.keys()))
+            return [row._make(values) for values in result]
+
+        @classmethod
+        def values(cls, *columns, **where):
+            '''
+            Like :py:meth:`select` but returning plain tuples, or the values
+            themselves when a single column is selected, i.e.
+            `Post.values('id', author_id=1)` is a list of ids.
+            '''
+            if db.session.autoflush:
+                db.session.flush()
+            result = db.session.execute(cls.projection(*columns, **where))
+            if len(columns) == 1:
+                return [values[0] for values in result]
+            return [tuple(values) for values in result]
+
+        @classmethod
+        def load(cls, _profile=None, **where):
             '''
             Convenience method to build a sqlalchemy query to return stored
             objects.
 
             Returns a query object. This query object must be executed to retrieve
             actual items from the database.
+
+            *_profile* names one of the model's loading `profiles`.
             '''
+            query = db.session.query(cls)
+            options = profile_options(cls, _profile)
+            if options:
+                query = query.options(*options)
             if where:
-                return db.session.query(cls).filter_by(**where)
+                return query.filter_by(**where)
             else:
-                return db.session.query(cls)
+                return query
 
         @classmethod
         def filter(cls, *pargs, **kargs):
@@ -0,0 +1,156 @@
+# encoding: utf-8
+
+import threading
+import time
+
+from collections import OrderedDict
+from flask import request
+from functools import wraps
+
+from .async_ext import is_async
+from .cache import run_guard
+from .response import APITooManyRequests
+
+KEY_AUTH = 'auth'
+KEY_IP = 'ip'
+
+
+class RateLimitStore(object):
+    '''
+    Interface of a token bucket store. A shared implementation (i.e. a redis
+    script doing the same arithmetic atomically) makes limits global across
+    processes instead of per process.
+    '''
+    def consume(self, key, rate, capacity, cost=1):
+        '''
+        Take *cost* tokens from the bucket *key*, refilled at *rate* tokens
+        per second up to *capacity*. Returns (allowed, remaining tokens,
+        seconds until enough tokens are available).
+        '''
+        raise NotImplementedError
+
+
+class MemoryStore(RateLimitStore):
+    '''
+    In-process token buckets: O(1) per request. Buckets idle long enough to
+    be full again are evicted every *evict_interval* seconds, or as soon as
+    there are more than *max_buckets* of them.
+
+    Buckets are kept in the order they were last used, so eviction only
+    walks the idle ones at the front and stops at the first bucket still
+    refilling (a bucket refilling faster behind it waits for the next
+    sweep).
+    '''
+    def __init__(self, evict_interval=60, max_buckets=10000):
+        self.evict_interval = evict_interval
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self._last_evict = time.time()
+
+    def consume(self, key, rate, capacity, cost=1):
+        now = time.time()
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            if bucket is None:
+                tokens = capacity
+            else:
+                tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                allowed = True
+                retry_after = 0.0
+            else:
+                allowed = False
+                retry_after = (cost - tokens) / rate
+            # full time (seconds) after which the bucket is full again
+            self._buckets[key] = [tokens, now, (capacity - tokens) / rate]
+            if (len(self._buckets) > self.max_buckets or
+                    now - self._last_evict > self.evict_interval):
+                self._evict(now)
+            return allowed, tokens, retry_after
+
+    def _evict(self, now):
+        self._last_evict = now
+        while self._buckets:
+            key, (tokens, updated, refill) = next(iter(self._buckets.items()))
+            if now - updated < refill:
+                break
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+default_store = MemoryStore()
+
+
+def client_identity(key=KEY_AUTH):
+    '''
+    Identity a bucket is keyed on: the JWT `sub` (falling back to the client
+    IP for anonymous requests), the client IP or a custom callable.
+    '''
+    if callable(key):
+        return key()
+    if key == KEY_AUTH:
+        from .auth import get_auth_id
+        auth_id = get_auth_id()
+        if auth_id:
+            return 'auth:{0}'.format(auth_id)
+    return 'ip:{0}'.format(request.remote_addr)
+
+
+def rate_limit(rate, per=60, burst=None, key=KEY_AUTH, scope=None,
+               store=None, cost=1):
+    '''
+    Limit a view to *rate* requests every *per* seconds per client, with
+    bursts of up to *burst* requests (defaults to *rate*).
+
+    Place it under `api_action` so rejections are returned as 429 JSON
+    errors before the handler runs:
+
+        @api_action
+        @rate_limit(100, per=60)
+        def list_users(): ...
+    '''
+    capacity = burst or rate
+    refill = float(rate) / per
+
+    def decorator(orig_func):
+        bucket_scope = scope or '{0}.{1}'.format(orig_func.__module__,
+                                                 orig_func.__name__)
+
+        def guard():
+            bucket = '{0}|{1}'.format(bucket_scope, client_identity(key))
+            allowed, remaining, retry_after = (store or default_store).consume(
+                bucket, refill, capacity, cost)
+            if not allowed:
+                return APITooManyRequests(
+                    "Rate limit exceeded, retry in {0:.0f} seconds.".format(
+                        retry_after + 0.5),
+                    payload={'retry_after': retry_after})
+
+        def check():
+            rv = run_guard(guard)
+            if rv is not None:
+                raise rv
+
+        if is_async(orig_func):
+            @wraps(orig_func)
+            async def async_replacement(*pargs, **kargs):
+                check()
+                return await orig_func(*pargs, **kargs)
+
+            replacement = async_replacement
+        else:
+            @wraps(orig_func)
+            def replacement(*pargs, **kargs):
+                check()
+                return orig_func(*pargs, **kargs)
+
+        # run before cached responses are served, see cache.cached_response
+        replacement.request_guards = (guard,) + getattr(
+            orig_func, 'request_guards', ())
+        return replacement
+
+    return decorator
@@ -1,17 +1,38 @@
 # encoding: utf-8
+import hashlib
 import json
+import math
 
 from flask import request, Response, current_app, render_template
-from webob import Response
 from functools import wraps
 
+from .async_ext import is_async, run_coroutine
+from .cache import cached_response, run_guard
 from .template import template_functions
 
 
-def action(orig_func):
+def action(orig_func=None, cache_ttl=None, cache_per_user=False,
+           cache_tags=()):
     '''
     Return rendered template with environment data and template functions.
+
+    With *cache_ttl* the rendered page is cached, see
+    :py:func:`flaskbald.cache.cached_response`.
     '''
+    def actual_decorator(orig_func):
+        replacement = _action(orig_func)
+        if cache_ttl:
+            replacement = cached_response(cache_ttl, per_user=cache_per_user,
+                                          tags=cache_tags)(replacement)
+        return replacement
+
+    if not orig_func:
+        return actual_decorator
+    else:
+        return actual_decorator(orig_func)
+
+
+def _action(orig_func):
     @wraps(orig_func)
     def replacement(*args, **kargs):
         handler_response = orig_func(*args, **kargs)
@@ -72,36 +93,89 @@ def action_v2(orig_func):
     return replacement
 
 
-def json_response(body, status, status_code=200, jwt_cookie=None):
+# static headers of every JSON response, built once instead of per call;
+# Access-Control-* headers are owned by flaskbald.cors.CrossOrigin
+JSON_HEADERS = (
+    ('Content-Type', 'application/json; charset=utf-8'),
+)
+
+
+class JSONResponse(Response):
     '''
-    Return response JSON encoded with proper headers.
+    Flask response for already serialized JSON bodies, created with the
+    static JSON_HEADERS so no per call content type handling is needed.
     '''
-    resp = Response(json.dumps({"status": "success", "data": body}),
-                    status=status, content_type="application/json",
-                    charset='utf-8')
+    default_mimetype = 'application/json'
+
+    def __init__(self, payload, status=200, headers=()):
+        if not isinstance(payload, bytes):
+            payload = payload.encode('utf-8')
+        Response.__init__(self, payload, status=status,
+                          headers=JSON_HEADERS + tuple(headers))
+
+
+def make_etag(data):
+    '''
+    Strong ETag (quoted) for a response body or a version key, i.e. the max
+    `date_modified` returned by :py:meth:`Model.version`.
+    '''
+    if not isinstance(data, bytes):
+        data = str(data).encode('utf-8')
+    return '"{0}"'.format(hashlib.blake2b(data, digest_size=16).hexdigest())
+
 
-    # resp = Response(json.dumps({"status": "success", "data": body}))
-    # resp.status_code = status_code
-    # resp.status = status
-    # resp.headers['Content-Type'] = "application/json; charset=utf-8"
-    # resp.headers['Access-Control-Expose-Headers'] = 'Access-Control-Allow-Origin'
-    # resp.headers['Access-Control-Allow-Headers'] = 'Origin, X-Requested-With, Content-Type, Accept'
+def etag_matches(etag):
+    '''Check the current GET/HEAD request's If-None-Match against etag.'''
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    return request.if_none_match.contains_weak(etag.strip('"'))
+
+
+def not_modified(etag, cache_control=None):
+    '''Return an empty 304 response for a matching conditional GET.'''
+    headers = [('ETag', etag)]
+    if cache_control:
+        headers.append(('Cache-Control', cache_control))
+    return Response(status=304, headers=headers)
+
+
+def json_response(body, status, status_code=200, jwt_cookie=None, etag=True,
+                  version=None, cache_control=None):
+    '''
+    Return response JSON encoded with proper headers.
+
+    A strong ETag is computed from *version* when given, or else from the
+    serialized body, and a matching If-None-Match is answered with a 304.
+    An *etag* string is an ETag the caller already computed and checked.
+    '''
+    if etag and version is not None:
+        etag = make_etag(version)
+        if etag_matches(etag):
+            return not_modified(etag, cache_control)
+
+    payload = json.dumps({"status": "success", "data": body})
+    if etag is True:
+        etag = make_etag(payload)
+        if etag_matches(etag):
+            return not_modified(etag, cache_control)
+
+    headers = []
+    if etag:
+        headers.append(('ETag', etag))
+    if cache_control:
+        headers.append(('Cache-Control', cache_control))
+    resp = JSONResponse(payload, status=status, headers=headers)
 
     if jwt_cookie:
         resp.set_cookie(key="jwt", value=jwt_cookie.get('token'),
                         httponly=True)
-        # resp.set_cookie('jwt', jwt_cookie.get('token'), httponly=True)
-
-    resp.headers.update({
-        # 'Access-Control-Allow-Origin': '*',
-        'Access-Control-Expose-Headers': 'Access-Control-Allow-Origin',
-        'Access-Control-Allow-Headers': 'Origin, X-Requested-With, Content-Type, Accept',
-    })
 
     return resp
 
 
-def api_action(orig_func=None, set_jwt_cookie=False):
+def api_action(orig_func=None, set_jwt_cookie=False, cache_ttl=None,
+               cache_per_user=False, cache_tags=(), etag=True,
+               etag_version=None, cache_control=None):
     """
     Decorator that wraps an action in API goodness.
 
@@ -109,24 +183,65 @@ def api_action(orig_func=None, set_jwt_cookie=False):
     structure, or raise any ApiException (which will be wrapped in a
     standard JSON structure).
 
+    With *cache_ttl* successful GET responses are cached per path and query
+    args (and per JWT `sub` with *cache_per_user*). *cache_tags* name the
+    data the response depends on, i.e. ['users', 'users:{id}'], so saving or
+    deleting models evicts it. `user_required` and `rate_limit` checks run
+    before the cache is looked up; views requiring a user must be cached
+    with *cache_per_user*.
+
+    JSON responses carry a strong ETag and honor If-None-Match. When
+    *etag_version* is given it is called with the view arguments and must
+    return a cheap version key (i.e. `User.version(id=id)`); a matching
+    request then gets a 304 without running the handler at all.
+    *cache_control* sets the Cache-Control header of the response.
+
+    `async def` handlers are run on the worker thread's event loop, so they
+    can fan out to several backends with `flaskbald.async_ext.gather`.
     """
     def actual_decorator(orig_func):
+        async_handler = is_async(orig_func)
+
+        guards = getattr(orig_func, 'request_guards', ())
+
         @wraps(orig_func)
         # @cross_origin()
         def replacement(*args, **kargs):
+            response_etag = etag
+            if etag and etag_version is not None:
+                # user_required/rate_limit checks are not skipped by a 304
+                for guard in guards:
+                    rv = run_guard(guard)
+                    if rv is not None:
+                        return rv
+                response_etag = make_etag(etag_version(*args, **kargs))
+                if etag_matches(response_etag):
+                    return not_modified(response_etag, cache_control)
+
             try:
-                handler_response = orig_func(*args, **kargs)
+                if async_handler:
+                    handler_response = run_coroutine(orig_func(*args, **kargs))
+                else:
+                    handler_response = orig_func(*args, **kargs)
             except APIError as api_error_response:
                 return api_error_response
 
-            # return the response or reformat for proper response
-            if isinstance(handler_response, Response):
+            # return the response or reformat for proper response; any WSGI
+            # callable (Flask/Werkzeug or legacy WebOb response) passes as is
+            if callable(handler_response):
                 return handler_response
             else:
                 jwt_cookie = None
                 if set_jwt_cookie and handler_response.get('token'):
                     jwt_cookie = {'token': handler_response.get('token')}
-                return json_response(handler_response, status='200 OK', jwt_cookie=jwt_cookie)
+                return json_response(handler_response, status='200 OK',
+                                     jwt_cookie=jwt_cookie,
+                                     etag=response_etag,
+                                     cache_control=cache_control)
+
+        if cache_ttl:
+            replacement = cached_response(cache_ttl, per_user=cache_per_user,
+                                          tags=cache_tags)(replacement)
         return replacement
 
 
@@ -171,6 +286,19 @@ class APIError(Exception):
         rv['message'] = self.message
         return rv
 
+    def to_response(self):
+        return JSONResponse(json.dumps({"status": "error",
+                                        "data": self.to_dict()}),
+                            status=self.status_code)
+
+    def __call__(self, environ, start_response):
+        '''
+        WSGI interface, so an error returned by `api_action` (or a before
+        request handler) is rendered by Flask as a JSON error response with
+        the error's status code.
+        '''
+        return self.to_response()(environ, start_response)
+
 
 class APIPaymentRequired(APIError):
     status_code = 402
@@ -192,6 +320,17 @@ class APIResourceConflict(APIError):
     status_code = 409
 
 
+class APITooManyRequests(APIError):
+    status_code = 429
+
+    def to_response(self):
+        resp = APIError.to_response(self)
+        retry_after = (self.payload or {}).get('retry_after')
+        if retry_after is not None:
+            resp.headers['Retry-After'] = str(int(math.ceil(retry_after)))
+        return resp
+
+
 class APIUserUnsubscribed(APIUnauthorized):
     """
     Indicates that the targeted User account is no longer
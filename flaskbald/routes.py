@@ -0,0 +1,98 @@
+# encoding: utf-8
+
+import re
+
+from collections import namedtuple
+
+try:
+    from urllib.parse import quote, urlencode
+except ImportError:
+    from urllib import quote, urlencode
+
+# <converter(args):name> or <name> placeholders in a werkzeug rule
+rule_variable = re.compile(r'<(?:[^<>:]+:)?([^<>]+)>')
+
+Route = namedtuple('Route', ['url', 'methods', 'args', 'defaults', 'template'])
+
+
+def compile_rule(rule):
+    '''
+    Convert a werkzeug rule string ('/users/<int:id>') into a str.format
+    template ('/users/{id}').
+    '''
+    escaped = rule.replace('{', '{{').replace('}', '}}')
+    return rule_variable.sub(r'{\1}', escaped)
+
+
+class RouteIndex(dict):
+    '''
+    Precomputed endpoint -> Route index of an app's url map.
+
+    Built once at startup, it allows reverse URL building without going
+    through `url_for` (and its request/app context lookups) for every link.
+    Paths are built relative to the application root (`route_url` adds the
+    request's script root), query args are appended for any value that is
+    not a rule argument.
+    '''
+    def __init__(self, url_map=None):
+        dict.__init__(self)
+        self._alternatives = {}
+        if url_map is not None:
+            for rule in url_map.iter_rules():
+                self.add(rule)
+
+    def add(self, rule):
+        route = Route(url=rule.rule,
+                      methods=frozenset(rule.methods or ()),
+                      args=frozenset(rule_variable.findall(rule.rule)),
+                      defaults=dict(rule.defaults or {}),
+                      template=compile_rule(rule.rule))
+        # the first rule of an endpoint is the canonical one, URLs are built
+        # from the first that fits the values in werkzeug's order, i.e. a rule
+        # with defaults ('/list/') before the rule taking them ('/list/<page>')
+        self.setdefault(rule.endpoint, route)
+        routes = self._alternatives.setdefault(rule.endpoint, [])
+        routes.append((self._build_order(rule), route))
+        routes.sort(key=lambda item: item[0])
+        return route
+
+    @staticmethod
+    def _build_order(rule):
+        # werkzeug's Rule.build_compare_key
+        return (1 if rule.alias else 0, -len(rule.arguments),
+                -len(rule.defaults or ()))
+
+    @staticmethod
+    def _fits(route, values):
+        return route.args.issubset(values) and all(
+            values.get(key, default) == default
+            for key, default in route.defaults.items())
+
+    def build(self, endpoint, **values):
+        '''
+        Build the URL of *endpoint*, relative to the application root, from
+        the given values.
+        '''
+        for order, route in self._alternatives[endpoint]:
+            if self._fits(route, values):
+                break
+        else:
+            route = self[endpoint]
+            raise KeyError("Missing URL arguments for '{0}': {1}".format(
+                endpoint, ', '.join(sorted(route.args.difference(values)))))
+
+        url = route.template.format(**dict(
+            (arg, quote(str(values[arg]), safe='/:')) for arg in route.args))
+        query = [(key, value) for key, value in sorted(values.items())
+                 if key not in route.args and key not in route.defaults and
+                 value is not None]
+        if query:
+            url = '{0}?{1}'.format(url, urlencode(query))
+        return url
+
+    def to_dict(self):
+        '''JSON-serializable version of the index for API clients.'''
+        return dict((endpoint, {'url': route.url,
+                                'methods': sorted(route.methods),
+                                'args': sorted(route.args)})
+                    for endpoint, route in self.items())
@@ -0,0 +1,233 @@
+# encoding: utf-8
+
+import re
+
+import sqlalchemy as sa
+
+from sqlalchemy import event, orm
+
+from .text import strip_accents
+
+# databases with a full text index implementation
+DIALECTS = ('sqlite', 'postgresql')
+# text search configuration of the postgres index; accents and case are
+# already normalized by normalize() so no stemming dictionary is needed
+POSTGRES_CONFIG = 'simple'
+WORD = re.compile(r'\w+', re.UNICODE)
+# letters that are not a base letter plus combining accents, so survive
+# strip_accents()
+LETTERS = str.maketrans({'ø': 'o', 'æ': 'ae', 'œ': 'oe', 'ß': 'ss',
+                         'ł': 'l', 'đ': 'd', 'ð': 'd', 'þ': 'th', 'ı': 'i'})
+
+# searchable models, filled as they are declared
+_searchable = []
+
+
+def normalize(text):
+    '''Lower case *text* with diacriticals removed, as stored in the index.'''
+    if text is None:
+        return ''
+    if not isinstance(text, (str, bytes)):
+        text = str(text)
+    return strip_accents(text).lower().translate(LETTERS)
+
+
+def search_terms(q):
+    '''Normalized words of the query string *q*.'''
+    return WORD.findall(normalize(q))
+
+
+def index_name(table):
+    return '{0}_fts'.format(table.name)
+
+
+class Searchable(object):
+    '''
+    Full text search mixin, put before Model:
+
+        class Place(Searchable, Model):
+            __searchable__ = ('name', 'address')
+
+    A side index table (`<table>_fts`: FTS5 on sqlite, a GIN indexed
+    tsvector on postgres) is created with the model's table and kept in
+    sync by mapper events, with accents and case normalized on the way in.
+    :py:meth:`search` runs ranked prefix queries against it. The model
+    needs a single integer primary key, and a sqlite or postgres database:
+    on others creating the table raises NotImplementedError, as do the
+    index updates and searches.
+    '''
+    __searchable__ = ()
+
+    def __init_subclass__(cls, **kargs):
+        super(Searchable, cls).__init_subclass__(**kargs)
+        if cls.__searchable__:
+            _searchable.append(cls)
+
+    @classmethod
+    def search_document(cls, values):
+        '''Normalized text indexed for a row's searchable *values*.'''
+        return [normalize(value) for value in values]
+
+    @classmethod
+    def search(cls, q, limit=20, **where):
+        '''
+        Instances matching every word of *q* (as a prefix), best ranked
+        first (bm25 on sqlite, ts_rank on postgres), optionally filtered by
+        equality on *where*.
+        '''
+        terms = search_terms(q)
+        if not terms:
+            return []
+        query = cls.query().filter_by(**where)
+        dialect = _check_dialect(
+            cls, query.session.get_bind(sa.inspect(cls)).dialect)
+        name = index_name(cls.__table__)
+        primary_key = _primary_key(cls)
+        if dialect == 'sqlite':
+            index = sa.table(name, sa.column('rowid'))
+            match = ' '.join('"{0}"*'.format(term) for term in terms)
+            query = query.join(index, index.c.rowid == primary_key).filter(
+                sa.text('{0} MATCH :search_query'.format(name))).order_by(
+                sa.text('bm25({0})'.format(name)))
+        else:
+            index = sa.table(name, sa.column('id'))
+            match = ' & '.join('{0}:*'.format(term) for term in terms)
+            tsquery = "to_tsquery('{0}', :search_query)".format(
+                POSTGRES_CONFIG)
+            query = query.join(index, index.c.id == primary_key).filter(
+                sa.text('{0}.document @@ {1}'.format(name, tsquery))).order_by(
+                sa.text('ts_rank({0}.document, {1}) DESC'.format(
+                    name, tsquery)))
+        return query.params(search_query=match).limit(limit).all()
+
+    @classmethod
+    def rebuild_search_index(cls, batch_size=1000):
+        '''
+        Re-index every row, i.e. after bulk loads through Core that bypass
+        the mapper events, or to index an existing table.
+        '''
+        session = cls.query().session
+        connection = session.connection(mapper=sa.inspect(cls))
+        _execute(connection, cls, 'clear', [{}])
+        primary_key = _primary_key(cls)
+        columns = [getattr(cls, name) for name in cls.__searchable__]
+        result = connection.execute(sa.select([primary_key] + columns))
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            _execute(connection, cls, 'insert',
+                     [_params(cls, row[0], row[1:]) for row in rows])
+
+
+def _primary_key(model):
+    columns = orm.class_mapper(model).primary_key
+    if len(columns) != 1:
+        raise ValueError("{0} needs a single column primary key to be "
+                         "searchable".format(model.__name__))
+    return columns[0]
+
+
+def _params(model, key, values):
+    document = model.search_document(values)
+    params = {'rowid': key, 'document': ' '.join(document)}
+    for index, name in enumerate(model.__searchable__):
+        params['c{0}'.format(index)] = document[index]
+    return params
+
+
+def _check_dialect(model, dialect):
+    '''Name of *dialect*, NotImplementedError when it has no index.'''
+    if dialect.name not in DIALECTS:
+        raise NotImplementedError(
+            "Full text search of {0} is not supported on {1}".format(
+                model.__name__, dialect.name))
+    return dialect.name
+
+
+def _statements(model, dialect):
+    '''Index maintenance SQL of *model* for *dialect*, by operation.'''
+    name = index_name(model.__table__)
+    if _check_dialect(model, dialect) == 'sqlite':
+        columns = ', '.join(model.__searchable__)
+        values = ', '.join(':c{0}'.format(index) for index in
+                           range(len(model.__searchable__)))
+        return {
+            'create': ["CREATE VIRTUAL TABLE IF NOT EXISTS {0} USING fts5("
+                       "{1}, tokenize='unicode61')".format(name, columns)],
+            'insert': ['INSERT INTO {0} (rowid, {1}) VALUES (:rowid, {2})'
+                       .format(name, columns, values)],
+            'delete': ['DELETE FROM {0} WHERE rowid = :rowid'.format(name)],
+            'clear': ['DELETE FROM {0}'.format(name)],
+            'drop': ['DROP TABLE IF EXISTS {0}'.format(name)],
+        }
+    primary_key = _primary_key(model)
+    tsvector = "to_tsvector('{0}', :document)".format(POSTGRES_CONFIG)
+    return {
+        'create': [
+            'CREATE TABLE IF NOT EXISTS {0} (id {1} PRIMARY KEY '
+            'REFERENCES {2} ({3}) ON DELETE CASCADE, document tsvector)'
+            .format(name, primary_key.type.compile(dialect=dialect),
+                    model.__table__.name, primary_key.name),
+            'CREATE INDEX IF NOT EXISTS {0}_document ON {0} USING '
+            'GIN (document)'.format(name)],
+        'insert': ['INSERT INTO {0} (id, document) VALUES (:rowid, {1})'
+                   .format(name, tsvector)],
+        'delete': ['DELETE FROM {0} WHERE id = :rowid'.format(name)],
+        'clear': ['DELETE FROM {0}'.format(name)],
+        'drop': ['DROP TABLE IF EXISTS {0}'.format(name)],
+    }
+
+
+def _execute(connection, model, operation, params):
+    for statement in _statements(model, connection.dialect)[operation]:
+        connection.execute(sa.text(statement), *params)
+
+
+def _row_params(mapper, target):
+    model = type(target)
+    key = mapper.primary_key_from_instance(target)[0]
+    return _params(model, key, [getattr(target, name)
+                                for name in model.__searchable__])
+
+
+@event.listens_for(Searchable, 'after_insert', propagate=True)
+def _index_insert(mapper, connection, target):
+    _execute(connection, type(target), 'insert', [_row_params(mapper, target)])
+
+
+@event.listens_for(Searchable, 'after_update', propagate=True)
+def _index_update(mapper, connection, target):
+    state = sa.inspect(target)
+    if not any(state.attrs[name].history.has_changes()
+               for name in type(target).__searchable__):
+        return
+    params = _row_params(mapper, target)
+    _execute(connection, type(target), 'delete', [params])
+    _execute(connection, type(target), 'insert', [params])
+
+
+@event.listens_for(Searchable, 'after_delete', propagate=True)
+def _index_delete(mapper, connection, target):
+    _execute(connection, type(target), 'delete', [_row_params(mapper, target)])
+
+
+def _table_model(table):
+    for model in _searchable:
+        if model.__dict__.get('__table__') is table:
+            return model
+    return None
+
+
+@event.listens_for(sa.Table, 'after_create')
+def _create_index(table, connection, **kargs):
+    model = _table_model(table)
+    if model is not None:
+        _execute(connection, model, 'create', [{}])
+
+
+@event.listens_for(sa.Table, 'before_drop')
+def _drop_index(table, connection, **kargs):
+    model = _table_model(table)
+    if model is not None:
+        _execute(connection, model, 'drop', [{}])
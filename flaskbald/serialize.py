@@ -0,0 +1,191 @@
+# encoding: utf-8
+
+import datetime
+import decimal
+import threading
+import uuid
+
+import sqlalchemy as sa
+
+# compiled serializer functions by (model, fields, exclude, nested, format)
+_compiled = {}
+_lock = threading.Lock()
+
+DATE_TYPES = (datetime.datetime, datetime.date, datetime.time)
+
+
+def date_formatter(datetime_format=None):
+    '''
+    Function formatting dates, times and datetimes: isoformat by default,
+    a strftime pattern when *datetime_format* is a string, or
+    *datetime_format* itself when it is a callable. None is passed through.
+    '''
+    if datetime_format is None:
+        def format_date(value):
+            return None if value is None else value.isoformat()
+    elif callable(datetime_format):
+        def format_date(value):
+            return None if value is None else datetime_format(value)
+    else:
+        def format_date(value):
+            return None if value is None else value.strftime(datetime_format)
+    return format_date
+
+
+def plain_value(value, format_date):
+    '''Convert a value of unknown type to something json.dumps accepts.'''
+    if isinstance(value, DATE_TYPES):
+        return format_date(value)
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def _decimal(value):
+    return None if value is None else float(value)
+
+
+def _column_converter(column_type):
+    '''Name of the converter used for columns of *column_type*, if any.'''
+    if isinstance(column_type, (sa.DateTime, sa.Date, sa.Time)):
+        return '_date'
+    if isinstance(column_type, sa.Numeric) and column_type.asdecimal:
+        return '_decimal'
+    return None
+
+
+def _hashable(spec):
+    '''Hashable cache key of a nested spec (fields, options or function).'''
+    if isinstance(spec, dict):
+        return tuple(sorted((name, _hashable(value))
+                            for name, value in spec.items()))
+    if isinstance(spec, (list, tuple)):
+        return tuple(spec)
+    return spec
+
+
+def _accessor(name, instance_dict):
+    attribute = ('obj.' + name if name.isidentifier() else
+                 'getattr(obj, {0!r})'.format(name))
+    if not instance_dict:
+        return attribute
+    # loaded attributes are read straight from the instance __dict__, which
+    # skips the instrumented descriptor; expired, deferred or lazy loaded
+    # ones (and rows without a __dict__) go through the attribute
+    return "(d[{0!r}] if {0!r} in d else {1})".format(name, attribute)
+
+
+def default_fields(model, exclude=()):
+    '''Column attributes of *model* minus *exclude*, the model's own
+    `__serialize_exclude__` and deferred columns (which would be loaded
+    with one SELECT per instance; ask for them by name).'''
+    exclude = set(exclude) | set(getattr(model, '__serialize_exclude__', ()))
+    return tuple(attr.key for attr in sa.inspect(model).column_attrs
+                 if attr.key not in exclude and not attr.deferred)
+
+
+def compile_serializer(model, fields=None, exclude=(), nested=None,
+                       datetime_format=None):
+    '''
+    Return a function turning an instance of *model* (or a result row
+    carrying the same attribute names) into a JSON-ready dict.
+
+    The function is generated once per model and options and builds the
+    dict in a single literal, i.e. for fields ('id', 'date_created'):
+
+        def serialize(obj):
+            d = getattr(obj, '__dict__', _empty)
+            return {'id': (d['id'] if 'id' in d else obj.id),
+                    'date_created': _date(...)}
+
+    *fields* defaults to every column of the model except *exclude* and
+    deferred ones.
+    *nested* maps relationship names to the fields to serialize for the
+    related instance(s), a dict of compile_serializer options, or an
+    already compiled serializer; collections become lists. Dates are
+    formatted with :py:func:`date_formatter` (*datetime_format*) and
+    Numeric columns become floats. *model* may be None for plain rows, in
+    which case *fields* is required and values are converted by their type.
+    '''
+    key = (model, tuple(fields) if fields else None, tuple(exclude),
+           _hashable(nested or {}), datetime_format)
+    serializer = _compiled.get(key)
+    if serializer is None:
+        serializer = _compile(model, fields, exclude, nested or {},
+                              datetime_format)
+        with _lock:
+            serializer = _compiled.setdefault(key, serializer)
+    return serializer
+
+
+def _compile(model, fields, exclude, nested, datetime_format):
+    format_date = date_formatter(datetime_format)
+    namespace = {
+        '_date': format_date,
+        '_decimal': _decimal,
+        '_plain': lambda value: plain_value(value, format_date),
+        '_empty': {},
+    }
+    mapper = sa.inspect(model) if model is not None else None
+    if fields is None:
+        if mapper is None:
+            raise ValueError("fields are required to serialize plain rows")
+        fields = default_fields(model, exclude) + tuple(
+            name for name in nested if name not in exclude)
+    else:
+        fields = tuple(name for name in fields if name not in exclude)
+
+    items = []
+    for index, name in enumerate(fields):
+        value = _accessor(name, mapper is not None)
+        if name in nested:
+            if mapper is None or name not in mapper.relationships:
+                raise ValueError("'{0}' is not a relationship of {1}".format(
+                    name, model))
+            relationship = mapper.relationships[name]
+            spec = nested[name]
+            if not callable(spec):
+                options = (dict(spec) if isinstance(spec, dict)
+                           else {'fields': tuple(spec)})
+                options.setdefault('datetime_format', datetime_format)
+                spec = compile_serializer(relationship.mapper.class_,
+                                          **options)
+            function = '_nested{0}'.format(index)
+            if relationship.uselist:
+                namespace[function] = spec
+                value = '[{0}(item) for item in {1}]'.format(function, value)
+            else:
+                namespace[function] = (lambda item, spec=spec:
+                                       None if item is None else spec(item))
+                value = '{0}({1})'.format(function, value)
+        elif mapper is not None and name in mapper.columns:
+            column_type = mapper.columns[name].type
+            converter = _column_converter(column_type)
+            if hasattr(column_type, 'serialize_value'):
+                # column types may convert their own values, i.e. PackedJSON
+                converter = '_type{0}'.format(index)
+                namespace[converter] = column_type.serialize_value
+            if converter:
+                value = '{0}({1})'.format(converter, value)
+        else:
+            # rows, properties and hybrid attributes: convert by value type
+            value = '_plain({0})'.format(value)
+        items.append('{0!r}: {1}'.format(name, value))
+
+    source = 'def serialize(obj):\n'
+    if mapper is not None:
+        source += "    d = getattr(obj, '__dict__', _empty)\n"
+    source += '    return {{{0}}}\n'.format(', '.join(items))
+    exec(compile(source, '<serializer {0}>'.format(
+        getattr(model, '__name__', 'row')), 'exec'), namespace)
+    serializer = namespace['serialize']
+    serializer.fields = fields
+    serializer.source = source
+    return serializer
+
+
+def serialize_many(serializer, items):
+    '''Serialize every item (instances or rows) of *items* into a list.'''
+    return [serializer(item) for item in items]
@@ -0,0 +1,380 @@
+# encoding: utf-8
+
+import bisect
+import heapq
+import threading
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy as sa
+
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy import get_state
+from sqlalchemy.orm import Session, object_session
+
+from .loader import MAX_BATCH, clear_loaders
+from .model import baked_query, profile_options, row_class
+
+# threads running the per shard queries of a cross shard all()
+FANOUT_WORKERS = 8
+
+_fanout_pool = None
+_fanout_lock = threading.Lock()
+
+
+class HashResolver(object):
+    '''
+    Spread keys evenly over *shards* (bind names) by a stable hash (crc32)
+    of the key, i.e. HashResolver(['shard0', 'shard1']).
+    '''
+    def __init__(self, shards):
+        self.shards = list(shards)
+
+    def __call__(self, key):
+        data = str(key).encode('utf-8')
+        return self.shards[zlib.crc32(data) % len(self.shards)]
+
+
+class RangeResolver(object):
+    '''
+    Assign keys to shards by range: *ranges* is a list of (lower bound,
+    shard) pairs, i.e. [(0, 'shard0'), (1000000, 'shard1')] sends keys from
+    1000000 up to shard1.
+    '''
+    def __init__(self, ranges):
+        ranges = sorted(ranges)
+        self.bounds = [bound for bound, shard in ranges]
+        self.shards = [shard for bound, shard in ranges]
+
+    def __call__(self, key):
+        index = bisect.bisect_right(self.bounds, key) - 1
+        if index < 0:
+            raise ValueError("Shard key {0!r} is below the first range".format(
+                key))
+        return self.shards[index]
+
+
+def shard_engine(shard):
+    '''Engine of the *shard* bind (a SQLALCHEMY_BINDS key).'''
+    app = current_app._get_current_object()
+    return get_state(app).db.get_engine(app, bind=shard)
+
+
+def shard_session(shard):
+    '''
+    Session of *shard* for the current app context (request or task),
+    created on first use. Shard sessions are committed by the factory's
+    after request handler along with db.session and closed on teardown.
+    '''
+    sessions = getattr(g, '_flaskbald_shard_sessions', None)
+    if sessions is None:
+        sessions = g._flaskbald_shard_sessions = {}
+    session = sessions.get(shard)
+    if session is None:
+        session = sessions[shard] = Session(bind=shard_engine(shard))
+    return session
+
+
+def _shard_sessions():
+    if not has_app_context():
+        return {}
+    return getattr(g, '_flaskbald_shard_sessions', None) or {}
+
+
+def commit_shards():
+    '''Commit the shard sessions used in the current app context.'''
+    for session in _shard_sessions().values():
+        session.commit()
+
+
+def close_shards(exception=None):
+    '''Close (rolling back anything uncommitted) the shard sessions.'''
+    sessions = _shard_sessions()
+    for session in sessions.values():
+        session.close()
+    sessions.clear()
+
+
+def fanout_pool():
+    global _fanout_pool
+    if _fanout_pool is None:
+        with _fanout_lock:
+            if _fanout_pool is None:
+                _fanout_pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS)
+    return _fanout_pool
+
+
+def _order_key(model, order_by):
+    '''(column expression, sort key of an instance, descending).'''
+    descending = order_by.startswith('-')
+    name = order_by.lstrip('-')
+    column = getattr(model, name)
+    return (column.desc() if descending else column,
+            lambda instance: getattr(instance, name), descending)
+
+
+def _query_shard(engine, model, where, order_by, limit, options):
+    # each shard is read on its own short lived session and connection, in
+    # the worker thread; results are merged into the request's sessions
+    session = Session(bind=engine)
+    try:
+        query = session.query(model).options(*options).filter_by(**where)
+        if order_by is not None:
+            query = query.order_by(order_by)
+        if limit is not None:
+            query = query.limit(limit)
+        instances = query.all()
+        session.expunge_all()
+        return instances
+    finally:
+        session.close()
+
+
+class Unsharded(object):
+    '''
+    Class attribute hiding a Model feature bound to db.session (the
+    default bind), which would query the wrong database on a sharded model.
+    Reading it raises AttributeError, so hasattr() and getattr() with a
+    default see the feature as missing.
+    '''
+    def __init__(self, name, alternative):
+        self.name = name
+        self.alternative = alternative
+
+    def __get__(self, instance, owner):
+        raise AttributeError("{0}.{1} is not shard aware, use {2}".format(
+            owner.__name__, self.name, self.alternative))
+
+
+class Sharded(object):
+    '''
+    Mixin for models whose rows are spread over several databases (the
+    SQLALCHEMY_BINDS named by the resolver), put before Model:
+
+        class Order(Sharded, Model):
+            __shard_key__ = 'customer_id'
+            __shard_resolver__ = HashResolver(['orders0', 'orders1'])
+
+    get/load/baked/all/select/values/version/save/delete are routed to the
+    shard of the shard key value; get(), all(), select(), values(),
+    version() and get_many() without it query every shard. The request
+    loader is not available, use get_many().
+    '''
+    __shard_key__ = None
+    __shard_resolver__ = None
+
+    loader = Unsharded('loader', 'get_many()')
+
+    @classmethod
+    def shards(cls):
+        return list(cls.__shard_resolver__.shards)
+
+    @classmethod
+    def shard_for(cls, key):
+        '''Shard (bind name) holding the rows with shard key *key*.'''
+        return cls.__shard_resolver__(key)
+
+    @classmethod
+    def create_tables(cls):
+        '''Create the model's table on every shard, if missing.'''
+        for shard in cls.shards():
+            cls.__table__.create(shard_engine(shard), checkfirst=True)
+
+    @classmethod
+    def where_shards(cls, where):
+        '''Shards with the rows matching *where*: the shard key's, or all.'''
+        if cls.__shard_key__ in where:
+            return [cls.shard_for(where[cls.__shard_key__])]
+        return cls.shards()
+
+    @classmethod
+    def query(cls, shard=None):
+        '''Query of the model on *shard*.'''
+        if shard is None:
+            raise ValueError("{0} is sharded, pass the shard to query "
+                             "(one of {1})".format(cls.__name__, cls.shards()))
+        return shard_session(shard).query(cls)
+
+    @classmethod
+    def filter(cls, *pargs, **kargs):
+        return cls.query(kargs.pop('shard', None)).filter(*pargs, **kargs)
+
+    @classmethod
+    def load(cls, _profile=None, **where):
+        '''
+        Query of the instances matching *where*, on the shard of the shard
+        key value, which *where* must contain.
+        '''
+        if cls.__shard_key__ not in where:
+            raise ValueError("{0}.load() needs the shard key '{1}'".format(
+                cls.__name__, cls.__shard_key__))
+        query = cls.query(cls.shard_for(where[cls.__shard_key__]))
+        options = cls.profile_options(_profile)
+        if options:
+            query = query.options(*options)
+        return query.filter_by(**where)
+
+    @classmethod
+    def baked(cls, _profile=None, **where):
+        '''
+        Precompiled query result of the instances matching *where* on the
+        shard of the shard key value, which *where* must contain.
+        '''
+        query = baked_query(cls, where, _profile)
+        if query is None:
+            return cls.load(_profile, **where)
+        if cls.__shard_key__ not in where:
+            raise ValueError("{0}.baked() needs the shard key '{1}'".format(
+                cls.__name__, cls.__shard_key__))
+        session = shard_session(cls.shard_for(where[cls.__shard_key__]))
+        return query(session).params(**dict(
+            (name, value) for name, value in where.items()
+            if value is not None))
+
+    @classmethod
+    def get(cls, _profile=None, **where):
+        if cls.__shard_key__ in where:
+            return cls.baked(_profile, **where).one()
+        found = cls.all(_profile, **where)
+        if not found:
+            raise cls.NotFound("No row was found for one()")
+        if len(found) > 1:
+            raise cls.MultipleFound("Multiple rows were found for one()")
+        return found[0]
+
+    @classmethod
+    def all(cls, _profile=None, _order_by=None, _limit=None, **where):
+        '''
+        Instances matching *where*. With the shard key only its shard is
+        queried, otherwise every shard is, in parallel, and the results
+        merged; *_order_by* (a column name, '-name' for descending) keeps
+        the merged list ordered and *_limit* applies to it.
+        '''
+        options = cls.profile_options(_profile)
+        if cls.__shard_key__ in where:
+            query = cls.load(_profile, **where)
+            if _order_by is not None:
+                query = query.order_by(_order_key(cls, _order_by)[0])
+            if _limit is not None:
+                query = query.limit(_limit)
+            return query.all()
+
+        column = sort_key = descending = None
+        if _order_by is not None:
+            column, sort_key, descending = _order_key(cls, _order_by)
+        shards = cls.shards()
+        futures = [fanout_pool().submit(_query_shard, shard_engine(shard), cls,
+                                        where, column, _limit, options)
+                   for shard in shards]
+        results = []
+        for shard, future in zip(shards, futures):
+            session = shard_session(shard)
+            results.append([session.merge(instance, load=False)
+                            for instance in future.result()])
+        if sort_key is None:
+            merged = [instance for result in results for instance in result]
+        else:
+            merged = list(heapq.merge(*results, key=sort_key,
+                                      reverse=descending))
+        return merged[:_limit] if _limit is not None else merged
+
+    @classmethod
+    def get_many(cls, ids):
+        '''
+        Instances with the primary keys *ids*, in the same order (None for
+        missing ones), with one IN (...) query per shard and MAX_BATCH ids.
+        '''
+        mapper = sa.inspect(cls)
+        column = mapper.primary_key[0]
+        name = mapper.get_property_by_column(column).key
+        found = {}
+        for shard in cls.shards():
+            session = shard_session(shard)
+            for start in range(0, len(ids), MAX_BATCH):
+                for instance in session.query(cls).filter(
+                        column.in_(ids[start:start + MAX_BATCH])):
+                    found.setdefault(getattr(instance, name), instance)
+        return [found.get(key) for key in ids]
+
+    @classmethod
+    def execute(cls, statement, where):
+        '''Results of the Core *statement* on each shard of *where*.'''
+        for shard in cls.where_shards(where):
+            session = shard_session(shard)
+            if session.autoflush:
+                session.flush()
+            yield session.execute(statement)
+
+    @classmethod
+    def select(cls, *columns, **where):
+        rows = []
+        for result in cls.execute(cls.projection(*columns, **where), where):
+            row = row_class(cls.__name__ + 'Row', tuple(result.keys()))
+            rows.extend(row._make(values) for values in result)
+        return rows
+
+    @classmethod
+    def values(cls, *columns, **where):
+        values = []
+        for result in cls.execute(cls.projection(*columns, **where), where):
+            if len(columns) == 1:
+                values.extend(row[0] for row in result)
+            else:
+                values.extend(tuple(row) for row in result)
+        return values
+
+    @classmethod
+    def version(cls, **where):
+        '''
+        Version key of the (filtered) rows over their shards: the most
+        recent `date_modified` and the total row count.
+        '''
+        statement = sa.select([sa.func.max(cls.date_modified),
+                               sa.func.count()]).select_from(cls.__table__)
+        for key, value in where.items():
+            statement = statement.where(getattr(cls, key) == value)
+        modified, count = [], 0
+        for result in cls.execute(statement, where):
+            last_modified, rows = result.first()
+            if last_modified is not None:
+                modified.append(last_modified)
+            count += rows
+        return '{0}-{1}'.format(max(modified) if modified else None, count)
+
+    @classmethod
+    def profile_options(cls, profile=None):
+        return profile_options(cls, profile)
+
+    def shard(self):
+        '''Shard of this instance, from its shard key value.'''
+        key = getattr(self, self.__shard_key__)
+        if key is None:
+            raise ValueError("{0}.{1} (the shard key) is not set".format(
+                type(self).__name__, self.__shard_key__))
+        return self.shard_for(key)
+
+    def session(self):
+        return object_session(self) or shard_session(self.shard())
+
+    def flush(self):
+        self.session().flush()
+        return self
+
+    def save(self, flush=False):
+        self.session().add(self)
+        clear_loaders(self)
+        if flush:
+            self.flush()
+        return self
+
+    def delete(self, flush=False):
+        self.session().delete(self)
+        clear_loaders(self)
+        if flush:
+            self.flush()
+        return self
+
+    def commit(self):
+        self.session().commit()
+        return self
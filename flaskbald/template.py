@@ -1,4 +1,4 @@
-from flask import current_app
+from flask import current_app, has_request_context, request
 import json
 import os
 
@@ -50,9 +50,18 @@ def front_end_hash():
     return manifest.get('hash')
 
 
+def route_url(endpoint, **values):
+    url = current_app.config['route_index'].build(endpoint, **values)
+    if has_request_context():
+        # like url_for, include the prefix the app is mounted on (SCRIPT_NAME)
+        return request.script_root + url
+    return url
+
+
 template_functions = {
     "asset_url": asset_url,
     "front_end_js_src": front_end_js_src,
     "front_end_css_src": front_end_css_src,
-    "front_end_hash": front_end_hash
+    "front_end_hash": front_end_hash,
+    "route_url": route_url
 }
@@ -1,6 +1,5 @@
 import re
 import unicodedata
-import phonenumbers
 
 
 try:
@@ -76,7 +75,7 @@ def strip_accents(text):
     better than fran-ais or fran?ais.
     '''
     if isinstance(text, bytes):
-        return unicode(text, errors='ignore')
+        text = text.decode('utf-8', errors='ignore')
     return ''.join((c for c in unicodedata.normalize('NFD', text) if
                                               unicodedata.category(c) != 'Mn'))
 
@@ -105,6 +104,7 @@ def split_full_name(full_name):
 
 
 def valid_phone_number(phone_number):
+    import phonenumbers
     try:
         parsed_phone_number = phonenumbers.parse(phone_number, None)
     except phonenumbers.phonenumberutil.NumberParseException:
@@ -114,6 +114,7 @@ def valid_phone_number(phone_number):
 
 
 def format_phone_number(phone_number):
+    import phonenumbers
     DEFAULT_COUNTRY_REGION = '+1'
     try:
         parsed_phone_number = phonenumbers.parse(phone_number, None)
@@ -132,6 +133,7 @@ def format_phone_number(phone_number):
 
 
 def pretty_phone_number(phone_number):
+    import phonenumbers
     parsed_phone_number = phonenumbers.parse(phone_number, None)
     formatted_number = phonenumbers.format_number(parsed_phone_number, phonenumbers.PhoneNumberFormat.NATIONAL)
     split_number = formatted_number.split(" ")
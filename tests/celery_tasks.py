@@ -0,0 +1,54 @@
+# encoding: utf-8
+'''
+Tasks used by test_celery_ext. They live outside the test module because
+pytest's collection would evaluate Celery's lazy task proxies, building the
+tasks before FlaskCelery.init_app sets up their base class.
+'''
+import flask
+
+from flaskbald.celery_ext import (celery, flaskbald_task, APP_CONTEXT_NONE,
+                                  APP_CONTEXT_WORKER)
+from flaskbald.db_ext import db, Model
+
+
+class Job(Model):
+    __tablename__ = 'celery_jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20))
+
+
+@flaskbald_task()
+def add_job(name):
+    Job(name=name).save()
+
+
+@flaskbald_task()
+def add_job_and_fail(name):
+    Job(name=name).save(flush=True)
+    raise ValueError(name)
+
+
+@flaskbald_task()
+def double(value):
+    return value * 2
+
+
+@celery.task
+def current_context():
+    return flask._app_ctx_stack.top
+
+
+@celery.task(app_context=APP_CONTEXT_NONE)
+def no_context():
+    return flask._app_ctx_stack.top
+
+
+@flaskbald_task(app_context=APP_CONTEXT_WORKER)
+def worker_context(name):
+    Job(name=name).save()
+    return flask._app_ctx_stack.top
+
+
+@celery.task
+def payload_size(data, suffix=''):
+    return len(data + suffix)
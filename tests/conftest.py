@@ -0,0 +1,42 @@
+# encoding: utf-8
+
+import pytest
+
+from flaskbald import factory
+from flaskbald.db_ext import db
+
+SETTINGS = {
+    'DEBUG': False,
+    'TESTING': True,
+    'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+    'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+}
+
+
+@pytest.fixture
+def make_app(tmpdir):
+    '''
+    Build apps with factory.create_app from *settings* (added to SETTINGS)
+    and create_app options, with the tables of every model created.
+    '''
+    # apps with a database, disposed of afterwards
+    apps = []
+
+    def make_app(settings=None, **options):
+        config = tmpdir.join('config{0}.py'.format(len(tmpdir.listdir())))
+        config.write(''.join(
+            '{0} = {1!r}\n'.format(name, value) for name, value
+            in sorted(dict(SETTINGS, **(settings or {})).items())))
+        options.setdefault('ssl_only', False)
+        app = factory.create_app(str(config), **options)
+        if options.get('db_enabled', True):
+            with app.app_context():
+                db.create_all()
+            apps.append(app)
+        return app
+
+    yield make_app
+    for app in apps:
+        with app.app_context():
+            db.session.remove()
+            db.get_engine(app).dispose()
@@ -0,0 +1,190 @@
+# encoding: utf-8
+
+import asyncio
+import json
+import time
+
+import pytest
+
+from flask import request
+
+from flaskbald.async_ext import ASGIApp, gather, run_coroutine, run_sync
+from flaskbald.background import after_response
+from flaskbald.response import api_action
+
+
+def call(asgi, path='/', method='GET', body=b'', headers=(), send=None):
+    '''Run one http request through *asgi*, returning the sent messages.'''
+    scope = {'type': 'http', 'method': method, 'path': path,
+             'query_string': b'q=1', 'headers': list(headers),
+             'client': ('127.0.0.1', 5000), 'server': ('app.test', 80)}
+    received = [{'type': 'http.request', 'body': body[:3],
+                 'more_body': True},
+                {'type': 'http.request', 'body': body[3:]}]
+    sent = []
+
+    async def receive():
+        return received.pop(0)
+
+    async def record(message):
+        sent.append(message)
+        if send is not None:
+            send(message)
+
+    asyncio.run(asgi(scope, receive, record))
+    return sent
+
+
+def test_run_coroutine():
+    async def add(a, b):
+        await asyncio.sleep(0)
+        return a + b
+    assert run_coroutine(add(1, 2)) == 3
+    # the thread's loop is reused
+    assert run_coroutine(add(2, 2)) == 4
+
+
+def test_gather_run_sync():
+    async def fan_out():
+        return await gather(asyncio.sleep(0.05, 'a'),
+                            run_sync(time.sleep, 0.05),
+                            asyncio.sleep(0.05, 'b'))
+    start = time.time()
+    assert run_coroutine(fan_out()) == ['a', None, 'b']
+    # sequential calls would take 0.15s
+    assert time.time() - start < 0.14
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app(db_enabled=False, asgi=True)
+    events = app.events = []
+
+    @app.route('/async')
+    @api_action
+    async def async_handler():
+        values = await gather(asyncio.sleep(0, 1), asyncio.sleep(0, 2))
+        return {'values': values, 'path': request.path}
+
+    @app.route('/echo', methods=['POST'])
+    def echo():
+        after_response(events.append, 'after_response')
+        return json.dumps({'body': request.get_data().decode('utf-8'),
+                           'query': request.query_string.decode('utf-8'),
+                           'type': request.content_type,
+                           'host': request.host})
+
+    return app
+
+
+def test_async_handler(app):
+    response = app.test_client().get('/async')
+    assert json.loads(response.data.decode('utf-8'))['data'] == {
+        'values': [1, 2], 'path': '/async'}
+
+
+def test_asgi(app):
+    sent = call(app.asgi_app, '/echo', method='POST', body=b'hello',
+                headers=[(b'content-type', b'text/plain'),
+                         (b'host', b'app.test')],
+                send=lambda message: app.events.append(message['type']))
+    assert sent[0]['type'] == 'http.response.start'
+    assert sent[0]['status'] == 200
+    body = b''.join(message.get('body', b'') for message in sent[1:])
+    assert json.loads(body.decode('utf-8')) == {
+        'body': 'hello', 'query': 'q=1', 'type': 'text/plain',
+        'host': 'app.test'}
+    assert sent[-1] == {'type': 'http.response.body', 'body': b''}
+    # after_response jobs only run once the response has been sent
+    assert app.events[-1] == 'after_response'
+    assert app.events.count('http.response.body') == len(sent) - 1
+
+
+@pytest.mark.parametrize('path', [u'/u/\xe9', u'/u/\u65e5\u672c'])
+def test_asgi_path(app, path):
+    @app.route('/u/<name>')
+    def user(name):
+        return json.dumps({'name': name, 'path': request.path})
+
+    sent = call(app.asgi_app, path)
+    assert sent[0]['status'] == 200
+    body = b''.join(message.get('body', b'') for message in sent[1:])
+    assert json.loads(body.decode('utf-8')) == {'name': path[3:],
+                                                'path': path}
+
+
+def test_asgi_content_length(app):
+    sent = call(app.asgi_app, '/echo', method='POST', body=b'hello world',
+                headers=[(b'content-length', b'11')])
+    body = b''.join(message.get('body', b'') for message in sent[1:])
+    assert json.loads(body.decode('utf-8'))['body'] == 'hello world'
+
+
+class Streamed(object):
+    '''WSGI app streaming *chunks* chunks, recording when it is closed.'''
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.produced = 0
+        self.closed = False
+
+    def __call__(self, environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return self
+
+    def __iter__(self):
+        for index in range(self.chunks):
+            self.produced += 1
+            yield 'chunk {0}\n'.format(index).encode('ascii')
+
+    def close(self):
+        self.closed = True
+
+
+def test_asgi_stream():
+    wsgi = Streamed(20)
+    sent = call(ASGIApp(wsgi))
+    bodies = [message['body'] for message in sent[1:-1]]
+    assert bodies == ['chunk {0}\n'.format(index).encode('ascii')
+                      for index in range(20)]
+    assert all(message['more_body'] for message in sent[1:-1])
+    assert wsgi.closed
+
+
+def test_asgi_client_gone():
+    wsgi = Streamed(1000)
+
+    def send(message):
+        if message['type'] == 'http.response.body':
+            raise IOError('client gone')
+
+    with pytest.raises(IOError):
+        call(ASGIApp(wsgi), send=send)
+    # the app stopped early, with its response closed
+    assert wsgi.closed
+    assert wsgi.produced < 1000
+
+
+def test_asgi_app_error():
+    def failing(environ, start_response):
+        raise ValueError('broken')
+
+    with pytest.raises(ValueError):
+        call(ASGIApp(failing))
+
+
+def test_lifespan():
+    asgi = ASGIApp(Streamed(1))
+    received = [{'type': 'lifespan.startup'},
+                {'type': 'lifespan.shutdown'}]
+    sent = []
+
+    async def receive():
+        return received.pop(0)
+
+    async def send(message):
+        sent.append(message['type'])
+
+    asyncio.run(asgi({'type': 'lifespan'}, receive, send))
+    assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+    with pytest.raises(ValueError):
+        asyncio.run(asgi({'type': 'websocket'}, receive, send))
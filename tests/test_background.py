@@ -0,0 +1,106 @@
+# encoding: utf-8
+
+import threading
+
+import pytest
+
+from flask import Flask, current_app
+
+from flaskbald.background import (BackgroundExecutor, BackgroundQueueFull,
+                                  after_response, get_executor)
+
+BODY = 'x' * 2000
+
+
+@pytest.fixture
+def executor(make_app):
+    executor = BackgroundExecutor(make_app(db_enabled=False), max_workers=1,
+                                  max_queue=2)
+    yield executor
+    executor.shutdown()
+
+
+def test_app_context(executor):
+    future = executor.submit(lambda: current_app.name)
+    assert future.result(timeout=5) == executor.app.name
+    assert executor.metrics()['completed'] == 1
+
+
+def test_queue_full(executor):
+    started, release = threading.Event(), threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    running = executor.submit(block)
+    started.wait(5)
+    queued = [executor.submit(int, '1'), executor.submit(int, '2')]
+    with pytest.raises(BackgroundQueueFull):
+        executor.submit(int, '3')
+    assert executor.metrics() == dict(executor.metrics(), pending=2,
+                                      running=1, rejected=1)
+    release.set()
+    running.result(timeout=5)
+    assert [future.result(timeout=5) for future in queued] == [1, 2]
+
+
+def test_failed(executor):
+    future = executor.submit(int, 'x')
+    with pytest.raises(ValueError):
+        future.result(timeout=5)
+    assert executor.metrics()['failed'] == 1
+
+
+def test_executor_per_app(make_app):
+    small = make_app({'BACKGROUND_WORKERS': 1}, db_enabled=False)
+    large = make_app({'BACKGROUND_WORKERS': 3, 'BACKGROUND_MAX_QUEUE': 5},
+                     db_enabled=False)
+    with small.app_context():
+        executor = get_executor()
+        assert get_executor() is executor
+        assert executor.submit(lambda: current_app.name).result(5) == (
+            small.name)
+    assert get_executor(large) is not executor
+    assert (get_executor(large).max_workers,
+            get_executor(large).max_queue) == (3, 5)
+    # the pool size can't change once threads have started
+    with pytest.raises(RuntimeError):
+        executor.init_app(large)
+    executor.shutdown()
+    assert executor._pool is None
+
+
+def test_plain_app():
+    app = Flask(__name__)
+    executor = get_executor(app)
+    assert app.extensions['flaskbald.background'] is executor
+    assert executor.max_workers == 4
+
+
+@pytest.fixture
+def make_job_app(make_app):
+    def make_job_app(**options):
+        app = make_app(db_enabled=False, **options)
+        app.done = threading.Event()
+
+        @app.route('/job')
+        def job():
+            after_response(app.done.set)
+            return current_app.response_class(BODY, mimetype='text/plain')
+
+        return app
+    return make_job_app
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_after_response(make_job_app, compress):
+    app = make_job_app(compress=compress)
+    response = app.test_client().get('/job', headers={
+        'Accept-Encoding': 'gzip'})
+    assert response.headers.get('Content-Encoding') == (
+        'gzip' if compress else None)
+    assert not app.done.wait(0.05)
+    # submitted once the server closes the response
+    response.close()
+    assert app.done.wait(5)
@@ -0,0 +1,82 @@
+# encoding: utf-8
+
+import pytest
+import sqlalchemy as sa
+
+from flaskbald import model
+from flaskbald.db_ext import db, Model
+
+
+class Team(Model):
+    __tablename__ = 'baked_teams'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20))
+
+
+class Player(Model):
+    __tablename__ = 'baked_players'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20))
+    team_id = db.Column(db.Integer, db.ForeignKey(Team.id))
+    team = db.relationship(Team)
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    with app.app_context():
+        team = Team(id=1, name='red')
+        db.session.add_all([Player(id=1, name='ann', team=team),
+                            Player(id=2, name='bob', team=team),
+                            Player(id=3, name='cid')])
+        db.session.commit()
+        yield app
+
+
+@pytest.fixture
+def statements(app):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db.get_engine(app)
+    sa.event.listen(engine, 'before_cursor_execute', record)
+    yield statements
+    sa.event.remove(engine, 'before_cursor_execute', record)
+
+
+def test_get(app):
+    assert Player.get(id=2).name == 'bob'
+    assert Player.get(name='ann', team_id=1).id == 1
+    with pytest.raises(Player.NotFound):
+        Player.get(id=9)
+    with pytest.raises(Player.MultipleFound):
+        Player.get(team_id=1)
+
+
+def test_all(app):
+    assert sorted(player.id for player in Player.all()) == [1, 2, 3]
+    assert sorted(player.id for player in Player.all(team_id=1)) == [1, 2]
+    # None filters with IS NULL
+    assert [player.id for player in Player.all(team_id=None)] == [3]
+    assert Player.baked(id=1).first().name == 'ann'
+
+
+def test_cached(app, statements):
+    Player.get(id=1)
+    Player.get(id=2)
+    assert statements[0] == statements[1]
+    key = (Player, (('id', False),), None)
+    query = model._baked_queries[key]
+    Player.get(id=3)
+    assert model._baked_queries[key] is query
+
+
+def test_relationship_filter(app):
+    # not a column: a regular query
+    team = Team.get(id=1)
+    assert isinstance(Player.baked(team=team), sa.orm.Query)
+    assert sorted(player.name for player in Player.all(team=team)) == [
+        'ann', 'bob']
+    assert model._baked_queries[(Player, (('team', False),), None)] is False
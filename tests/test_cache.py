@@ -0,0 +1,242 @@
+# encoding: utf-8
+
+import threading
+import time
+
+import pytest
+
+from flask import Response
+
+from flaskbald.auth import create_jwt, get_auth_id, user_required
+from flaskbald.cache import (LRUCache, LocalSharedBackend, ResponseCache,
+                             cached_response, response_cache)
+from flaskbald.db_ext import db, Model
+from flaskbald.ratelimit import MemoryStore, rate_limit, KEY_IP
+from flaskbald.response import api_action, APINotFound
+
+
+class Note(Model):
+    __tablename__ = 'cache_notes'
+    id = db.Column(db.Integer, primary_key=True)
+    text = db.Column(db.String(20))
+
+
+def test_lru_ttl():
+    cache = LRUCache()
+    cache.set('a', 1, ttl=60)
+    cache.set('b', 2, ttl=-1)
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert len(cache) == 1
+
+
+def test_lru_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1, 60)
+    cache.set('b', 2, 60)
+    cache.get('a')
+    cache.set('c', 3, 60)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+
+
+def test_lru_tags():
+    cache = LRUCache()
+    cache.set('a', 1, 60, tags=['x', 'y'])
+    cache.set('b', 2, 60, tags=['y'])
+    cache.set('c', 3, 60)
+    cache.invalidate_tags(['x'])
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (None, 2, 3)
+    cache.invalidate_tags(['y'])
+    assert (cache.get('b'), cache.get('c')) == (None, 3)
+    assert cache._tags == {}
+
+
+def test_shared_backend():
+    backend = LocalSharedBackend()
+    first = ResponseCache(backend=backend)
+    second = ResponseCache(backend=backend)
+    first.set('a', 1, 60, tags=['x'])
+    # filled from the shared tier, with its tags
+    assert second.get('a') == 1
+    assert len(second.local) == 1
+    second.invalidate_tags(['x'])
+    assert second.get('a') is None
+    assert len(second.local) == 0
+
+
+def test_coalescing():
+    cache = ResponseCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.05)
+        return 'value'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        cache.get_or_compute('key', compute, 60))) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['value'] * 5
+    assert len(calls) == 1
+    assert cache._inflight == {}
+
+
+def test_not_cacheable():
+    cache = ResponseCache()
+    assert cache.get_or_compute('key', lambda: None, 60) is None
+    assert cache.get('key') is None
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    calls = app.calls = []
+
+    @app.route('/notes/<int:id>', methods=['GET', 'POST'])
+    @api_action(cache_ttl=60, cache_tags=['cache_notes:{id}'])
+    def note(id):
+        calls.append(id)
+        note = Note.load(id=id).first()
+        if note is None:
+            raise APINotFound('No note {0}'.format(id))
+        return {'id': note.id, 'text': note.text}
+
+    @app.route('/cookie')
+    @cached_response(60)
+    def cookie():
+        calls.append('cookie')
+        response = Response('body')
+        response.set_cookie('session', 'secret')
+        return response
+
+    with app.app_context():
+        Note(id=1, text='a').save()
+        db.session.commit()
+    response_cache.clear()
+    yield app
+    response_cache.clear()
+
+
+def test_cached(app):
+    client = app.test_client()
+    first = client.get('/notes/1')
+    assert client.get('/notes/1').data == first.data
+    assert app.calls == [1]
+    client.get('/notes/1?page=2')
+    client.post('/notes/1')
+    client.post('/notes/1')
+    assert app.calls == [1, 1, 1, 1]
+
+
+def test_errors_not_cached(app):
+    client = app.test_client()
+    assert client.get('/notes/2').status_code == 404
+    assert client.get('/notes/2').status_code == 404
+    assert app.calls == [2, 2]
+
+
+def test_cached_not_modified(app):
+    client = app.test_client()
+    etag = client.get('/notes/1').headers['ETag']
+    response = client.get('/notes/1', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert app.calls == [1]
+
+
+def test_cookies_not_cached(app):
+    client = app.test_client()
+    assert 'Set-Cookie' in client.get('/cookie').headers
+    response = client.get('/cookie')
+    assert response.data == b'body'
+    assert 'Set-Cookie' not in response.headers
+    assert app.calls == ['cookie']
+
+
+def test_invalidated_on_commit(app):
+    client = app.test_client()
+    client.get('/notes/1')
+    with app.app_context():
+        Note.get(id=1).text = 'b'
+        db.session.flush()
+        # not before the commit, or the old row could be cached again
+        assert len(response_cache.local) == 1
+        db.session.commit()
+        assert len(response_cache.local) == 0
+    assert b'"b"' in client.get('/notes/1').data
+    assert app.calls == [1, 1]
+
+
+def test_kept_on_rollback(app):
+    client = app.test_client()
+    client.get('/notes/1')
+    with app.app_context():
+        Note.get(id=1).text = 'c'
+        db.session.flush()
+        db.session.rollback()
+        Note(id=2, text='d').save()
+        db.session.commit()
+    # changes to other notes don't evict it
+    with app.app_context():
+        Note.get(id=2).text = 'e'
+        db.session.commit()
+    assert b'"a"' in client.get('/notes/1').data
+    assert app.calls == [1]
+
+
+@pytest.fixture
+def guarded_app(make_app):
+    app = make_app({'JWT_CLIENT_SECRET': 'secret'}, db_enabled=False)
+    calls = app.calls = []
+
+    @app.route('/private')
+    @api_action(cache_ttl=60, cache_per_user=True)
+    @user_required
+    def private():
+        calls.append('private')
+        return {'sub': get_auth_id()}
+
+    @app.route('/limited')
+    @api_action(cache_ttl=60)
+    @rate_limit(2, per=60, key=KEY_IP, store=MemoryStore())
+    def limited():
+        calls.append('limited')
+        return 'ok'
+
+    response_cache.clear()
+    yield app
+    response_cache.clear()
+
+
+def test_user_required(guarded_app):
+    client = guarded_app.test_client()
+    token = create_jwt('secret', {'sub': 'ann'}).decode('ascii')
+    for i in range(2):
+        response = client.get('/private', headers={'Authorization': token})
+        assert response.status_code == 200
+    assert guarded_app.calls == ['private']
+    # the check runs before the cache is looked up
+    assert client.get('/private').status_code == 401
+    assert guarded_app.calls == ['private']
+
+
+def test_rate_limited(guarded_app):
+    client = guarded_app.test_client()
+    # checked once per request, cached or not
+    assert [client.get('/limited').status_code for i in range(3)] == [
+        200, 200, 429]
+    assert guarded_app.calls == ['limited']
+
+
+def test_user_required_shared_cache():
+    def private():
+        return {}
+
+    with pytest.raises(ValueError):
+        api_action(cache_ttl=60)(user_required(private))
+    with pytest.raises(ValueError):
+        cached_response(60)(user_required(private))
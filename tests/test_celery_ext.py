@@ -0,0 +1,203 @@
+# encoding: utf-8
+
+import flask
+import pytest
+
+from flaskbald import celery_ext, factory
+from flaskbald.celery_ext import (celery, session_in_use, dispose_engines,
+                                  task_metrics, estimate_size,
+                                  LocalBlobStore, CLAIM_CHECK_KWARG,
+                                  _worker_context)
+from flaskbald.db_ext import db
+
+from . import celery_tasks as tasks
+
+CELERY_SETTINGS = {
+    'BROKER_URL': 'memory://',
+    'CELERY_ALWAYS_EAGER': True,
+    'CELERY_EAGER_PROPAGATES_EXCEPTIONS': True,
+}
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app(CELERY_SETTINGS)
+    factory.create_celery_app(app)
+    return app
+
+
+def names(app):
+    with app.app_context():
+        return sorted(job.name for job in tasks.Job.all())
+
+
+def test_commit_on_success(app):
+    tasks.add_job.delay('a')
+    assert names(app) == ['a']
+
+
+def test_rollback_on_failure(app):
+    with pytest.raises(ValueError):
+        tasks.add_job_and_fail.delay('b')
+    assert names(app) == []
+
+
+def test_session_removed(app):
+    with app.app_context():
+        tasks.add_job('c')
+        assert not db.session.registry.has()
+        with pytest.raises(ValueError):
+            tasks.add_job_and_fail('d')
+        assert not db.session.registry.has()
+    assert names(app) == ['c']
+
+
+def test_session_not_used(app):
+    with app.app_context():
+        assert tasks.double(2) == 4
+        assert not db.session.registry.has()
+
+
+def test_session_in_use(app):
+    with app.app_context():
+        assert not session_in_use(db.session)
+        tasks.Job.query().count()
+        # a checked out connection is something to roll back
+        assert session_in_use(db.session)
+        db.session.rollback()
+        assert not session_in_use(db.session)
+        db.session.add(tasks.Job(name='e'))
+        assert session_in_use(db.session)
+        db.session.remove()
+
+
+def test_task_metrics(app):
+    task_metrics.reset()
+    tasks.add_job.delay('f')
+    tasks.add_job.delay('g')
+    tasks.double.delay(1)
+    timings = task_metrics.snapshot()
+    add_job = timings[tasks.add_job.name]
+    assert add_job['count'] == 2
+    assert 0 < add_job['db'] <= add_job['total']
+    double = timings[tasks.double.name]
+    assert double['count'] == 1
+    assert double['db'] == 0
+
+
+def test_dispose_engines(app):
+    with app.app_context():
+        pool = db.get_engine(app).pool
+    dispose_engines(app)
+    with app.app_context():
+        assert db.get_engine(app).pool is not pool
+
+
+def test_push_app_context(app):
+    context = tasks.current_context()
+    assert context is not None
+    assert context.app is app
+    assert tasks.current_context() is not context
+    assert not flask.has_app_context()
+    with app.app_context() as outer:
+        assert tasks.current_context() is outer
+
+
+def test_no_app_context(app):
+    assert tasks.no_context() is None
+    with app.app_context() as outer:
+        assert tasks.no_context() is outer
+
+
+@pytest.fixture
+def worker_app(app):
+    yield app
+    if getattr(_worker_context, 'pid', None) is not None:
+        _worker_context.context.pop()
+        del _worker_context.pid
+
+
+def test_worker_app_context(worker_app):
+    context = tasks.worker_context('a')
+    assert context.app is worker_app
+    # the context stays pushed, what is scoped to it is torn down
+    assert flask._app_ctx_stack.top is context
+    assert celery.in_worker_app_context()
+    assert not db.session.registry.has()
+    assert tasks.worker_context('b') is context
+    assert names(worker_app) == ['a', 'b']
+
+
+def test_worker_mode_in_app_context(worker_app):
+    with worker_app.app_context() as outer:
+        assert tasks.worker_context('c') is outer
+        assert not celery.in_worker_app_context()
+    assert getattr(_worker_context, 'pid', None) is None
+
+
+def test_accept_serializers(make_app):
+    factory.create_celery_app(make_app(dict(
+        CELERY_SETTINGS, CELERY_TASK_SERIALIZER='msgpack',
+        CELERY_RESULT_SERIALIZER='pickle')))
+    assert set(celery.conf.accept_content) == set(['json', 'msgpack',
+                                                   'pickle'])
+
+
+def test_local_blob_store(tmpdir):
+    store = LocalBlobStore(str(tmpdir.join('blobs')))
+    key = store.put(u'payload')
+    assert store.get(key) == b'payload'
+    store.delete(key)
+    assert tmpdir.join('blobs').listdir() == []
+    store.delete(key)
+
+
+@pytest.fixture
+def claim_check_app(make_app, tmpdir, monkeypatch):
+    app = make_app(dict(
+        CELERY_SETTINGS, CELERY_ALWAYS_EAGER=False,
+        CELERY_CLAIM_CHECK_PATH=str(tmpdir.join('claims')),
+        CELERY_CLAIM_CHECK_THRESHOLD=100))
+    factory.create_celery_app(app)
+    sent = []
+    monkeypatch.setattr(celery, 'send_task',
+                        lambda *pargs, **kargs: sent.append(pargs))
+    app.sent = sent
+    yield app
+    celery.claim_check_store = None
+
+
+def test_claim_check(claim_check_app, tmpdir):
+    tasks.payload_size.delay('x' * 500, suffix='y')
+    (name, args, kwargs), = claim_check_app.sent
+    assert name == tasks.payload_size.name
+    assert args == ()
+    # only the reference goes through the broker, the payload is stored
+    claim = kwargs[CLAIM_CHECK_KWARG]
+    blobs = tmpdir.join('claims').listdir()
+    assert [blob.basename for blob in blobs] == [claim['key']]
+
+    # what the worker does with the message
+    assert tasks.payload_size(**kwargs) == 501
+    assert tmpdir.join('claims').listdir() == []
+
+
+def test_claim_check_threshold(claim_check_app, tmpdir, monkeypatch):
+    # small payloads are only serialized once, when they are published
+    monkeypatch.setattr(celery_ext.serialization, 'dumps', None)
+    tasks.payload_size.delay('x')
+    # small payloads are sent as usual
+    assert claim_check_app.sent == [(tasks.payload_size.name, ('x',), {})]
+    assert tmpdir.join('claims').listdir() == []
+
+
+def test_estimate_size():
+    assert estimate_size(((u'abc', 1), {'key': [b'xy', None]}), 100) == 38
+    # stops counting past the limit
+    assert estimate_size([['x' * 10] * 100], 50) < 100
+
+
+def test_init_app_again(app):
+    factory.create_celery_app(app)
+    assert tasks.payload_size('abc') == 3
+    assert tasks.current_context().app is app
@@ -0,0 +1,168 @@
+# encoding: utf-8
+
+import gzip
+import zlib
+
+import pytest
+
+from werkzeug.test import create_environ, run_wsgi_app
+
+from flaskbald import compress
+from flaskbald.compress import Compress, parse_accept_encoding
+
+BODY = b'{"data": [' + b', '.join([b'"item"'] * 200) + b']}'
+
+
+class Backend(object):
+    '''WSGI app answering with the configured response, counting calls.'''
+    def __init__(self, body=BODY, content_type='application/json',
+                 headers=(), stream=False):
+        self.body = body
+        self.headers = [('Content-Type', content_type)] + list(headers)
+        if not stream:
+            self.headers.append(('Content-Length', str(len(body))))
+        self.calls = 0
+        self.closed = 0
+
+    def __call__(self, environ, start_response):
+        self.calls += 1
+        start_response('200 OK', list(self.headers))
+        return Body(self, [self.body[:100], self.body[100:]])
+
+
+class Body(object):
+    def __init__(self, backend, chunks):
+        self.backend = backend
+        self.chunks = chunks
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.backend.closed += 1
+
+
+def get(app, path='/', encoding='gzip', method='GET', headers=None):
+    headers = dict(headers or {})
+    if encoding is not None:
+        headers['Accept-Encoding'] = encoding
+    app_iter, status, headers = run_wsgi_app(app, create_environ(
+        path, method=method, headers=headers))
+    try:
+        body = b''.join(app_iter)
+    finally:
+        app_iter.close()
+    return status, headers, body
+
+
+def test_parse_accept_encoding():
+    assert parse_accept_encoding('gzip, br;q=0.5, identity;q=0,') == {
+        'gzip': 1.0, 'br': 0.5, 'identity': 0.0}
+    assert parse_accept_encoding('gzip;q=x') == {'gzip': 0.0}
+
+
+@pytest.fixture(autouse=True)
+def no_brotli(monkeypatch):
+    # gzip output can be checked with the standard library alone
+    monkeypatch.setattr(compress, 'brotli', None)
+
+
+def test_gzip():
+    backend = Backend(headers=[('ETag', '"v1"'), ('Vary', 'Cookie')])
+    status, headers, body = get(Compress(backend))
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Content-Length'] == str(len(body))
+    assert headers['Vary'] == 'Cookie, Accept-Encoding'
+    assert headers['ETag'] == 'W/"v1"'
+    assert gzip.decompress(body) == BODY
+    assert backend.closed == 1
+
+
+@pytest.mark.parametrize('encoding', [None, 'identity', 'gzip;q=0', 'br'])
+def test_not_accepted(encoding):
+    status, headers, body = get(Compress(Backend()), encoding=encoding)
+    assert 'Content-Encoding' not in headers
+    assert body == BODY
+
+
+def test_head():
+    status, headers, body = get(Compress(Backend()), method='HEAD')
+    assert 'Content-Encoding' not in headers
+
+
+@pytest.mark.parametrize('backend', [
+    Backend(body=b'{}'),
+    Backend(content_type='image/png'),
+    Backend(headers=[('Content-Encoding', 'br')]),
+    Backend(headers=[('Cache-Control', 'no-transform')]),
+])
+def test_not_compressible(backend):
+    status, headers, body = get(Compress(backend))
+    assert headers.to_wsgi_list() == backend.headers
+    assert body == backend.body
+    assert backend.closed == 1
+
+
+def test_stream():
+    backend = Backend(stream=True)
+    app = Compress(backend)
+    app_iter, status, headers = run_wsgi_app(app, create_environ(
+        '/', headers={'Accept-Encoding': 'gzip'}))
+    assert 'Content-Length' not in headers
+    decompressor = zlib.decompressobj(compress.GZIP_WBITS)
+    chunks = iter(app_iter)
+    # every chunk is flushed, so decodes on its own
+    assert decompressor.decompress(next(chunks)) == BODY[:100]
+    assert decompressor.decompress(b''.join(chunks)) == BODY[100:]
+    # closed once the server closes the response, not before
+    assert backend.closed == 0
+    app_iter.close()
+    assert backend.closed == 1
+
+
+def test_cache():
+    backend = Backend(headers=[('ETag', '"v1"')])
+    app = Compress(backend)
+    first = get(app)
+    second = get(app)
+    assert first == second
+    assert len(app.cache) == 1
+    assert backend.closed == 2
+
+
+def test_cache_same_etag():
+    # same (i.e. version based) ETag for the bodies built for two users
+    app = Compress(Backend(body=BODY.replace(b'item', b'alice'),
+                           headers=[('ETag', '"v1"')]))
+    assert b'alice' in gzip.decompress(get(app, '/me')[2])
+    app.application = Backend(body=BODY.replace(b'item', b'bob'),
+                              headers=[('ETag', '"v1"')])
+    assert b'bob' in gzip.decompress(get(app, '/me')[2])
+    assert len(app.cache) == 2
+
+
+def test_cache_key_body():
+    app = Compress(Backend(headers=[('ETag', '"v1"'),
+                                    ('Vary', 'Accept-Language')]))
+    for path in ('/a', '/b?page=2'):
+        for language in ('en', 'fr'):
+            get(app, path, headers={'Accept-Language': language})
+    # keyed on the body, whatever the URL and Vary headers
+    assert len(app.cache) == 1
+    assert gzip.decompress(app.cache.get(app.cache_key(BODY, 'gzip'))) == BODY
+
+
+def test_compress_error():
+    class Failing(Body):
+        def __iter__(self):
+            raise IOError('backend gone')
+
+    backend = Backend()
+
+    def failing(environ, start_response):
+        backend(environ, start_response)
+        return Failing(backend, [])
+
+    with pytest.raises(IOError):
+        get(Compress(failing))
+    assert backend.closed == 1
@@ -0,0 +1,100 @@
+# encoding: utf-8
+
+import pytest
+
+from flask import Response
+
+from flaskbald.cors import CrossOrigin, MAX_CACHED_ORIGINS
+
+PREFLIGHT = {'Access-Control-Request-Method': 'PUT'}
+
+
+@pytest.fixture
+def make_cors_app(make_app):
+    def make_cors_app(**settings):
+        app = make_app(settings, db_enabled=False)
+        calls = app.calls = []
+
+        @app.route('/things', methods=['GET', 'PUT', 'OPTIONS'])
+        def things():
+            calls.append('things')
+            response = Response('ok')
+            # replaced by the middleware's own headers
+            response.headers['Access-Control-Allow-Origin'] = 'stale'
+            return response
+
+        return app
+    return make_cors_app
+
+
+def cors_headers(response):
+    return dict((name, value) for name, value in response.headers
+                if name.startswith('Access-Control-') or name == 'Vary')
+
+
+def test_no_origin(make_cors_app):
+    app = make_cors_app()
+    response = app.test_client().get('/things')
+    assert cors_headers(response) == {'Access-Control-Allow-Origin': 'stale'}
+
+
+def test_any_origin(make_cors_app):
+    app = make_cors_app()
+    response = app.test_client().get('/things', headers={
+        'Origin': 'http://a.test'})
+    assert response.headers.getlist('Access-Control-Allow-Origin') == ['*']
+    assert response.headers['Access-Control-Expose-Headers'] == 'ETag'
+    assert 'Vary' not in response.headers
+
+
+def test_preflight(make_cors_app):
+    app = make_cors_app(CORS_MAX_AGE=600, CORS_METHODS=['GET', 'PUT'])
+    response = app.test_client().options('/things', headers=dict(
+        PREFLIGHT, Origin='http://a.test'))
+    assert response.status_code == 204
+    assert cors_headers(response) == {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, PUT',
+        'Access-Control-Allow-Headers': 'Origin, X-Requested-With, '
+                                        'Content-Type, Accept, Authorization',
+        'Access-Control-Max-Age': '600'}
+    # answered without running the app
+    assert app.calls == []
+
+    app.test_client().options('/things', headers={'Origin': 'http://a.test'})
+    assert app.calls == ['things']
+
+
+def test_allowed_origins(make_cors_app):
+    app = make_cors_app(CORS_ORIGINS='https://app.test, https://*.cdn.test')
+    client = app.test_client()
+    for origin in ('https://app.test', 'https://eu.cdn.test'):
+        response = client.get('/things', headers={'Origin': origin})
+        assert response.headers['Access-Control-Allow-Origin'] == origin
+        assert response.headers['Vary'] == 'Origin'
+
+    response = client.get('/things', headers={'Origin': 'https://evil.test'})
+    assert response.headers['Access-Control-Allow-Origin'] == 'stale'
+    response = client.options('/things', headers=dict(
+        PREFLIGHT, Origin='https://evil.test'))
+    assert 'Access-Control-Allow-Methods' not in response.headers
+    assert app.calls == ['things'] * 4
+
+
+def test_credentials(make_cors_app):
+    app = make_cors_app(CORS_SUPPORTS_CREDENTIALS=True)
+    response = app.test_client().options('/things', headers=dict(
+        PREFLIGHT, Origin='http://a.test'))
+    # '*' is not allowed with credentials, the origin is reflected
+    assert response.headers['Access-Control-Allow-Origin'] == 'http://a.test'
+    assert response.headers['Access-Control-Allow-Credentials'] == 'true'
+    assert response.headers['Vary'] == 'Origin'
+
+
+def test_origin_cache_bound():
+    cors = CrossOrigin(None, origins='*', supports_credentials=True)
+    for index in range(MAX_CACHED_ORIGINS + 10):
+        origin = 'http://{0}.test'.format(index)
+        assert cors.headers_for(origin)[0][0] == (
+            'Access-Control-Allow-Origin', origin)
+    assert len(cors._headers) == MAX_CACHED_ORIGINS
@@ -0,0 +1,145 @@
+# encoding: utf-8
+
+import json
+
+import pytest
+
+from flaskbald import response as response_module
+from flaskbald.auth import create_jwt, user_required
+from flaskbald.db_ext import db, Model
+from flaskbald.ratelimit import MemoryStore, rate_limit, KEY_IP
+from flaskbald.response import api_action, make_etag
+
+
+class Item(Model):
+    __tablename__ = 'etag_items'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20))
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app({'JWT_CLIENT_SECRET': 'secret'})
+    calls = app.calls = []
+
+    @app.route('/items', methods=['GET', 'POST'])
+    @api_action(cache_control='private, max-age=0')
+    def items():
+        calls.append('items')
+        return [{'id': item.id, 'name': item.name}
+                for item in Item.all()]
+
+    @app.route('/versioned')
+    @api_action(etag_version=lambda: Item.version())
+    def versioned():
+        calls.append('versioned')
+        return len(Item.all())
+
+    @app.route('/guarded')
+    @api_action(etag_version=lambda: Item.version())
+    @user_required
+    @rate_limit(2, per=60, key=KEY_IP, store=MemoryStore())
+    def guarded():
+        calls.append('guarded')
+        return len(Item.all())
+
+    @app.route('/plain')
+    @api_action(etag=False)
+    def plain():
+        return 'plain'
+
+    with app.app_context():
+        Item(id=1, name='a').save()
+        db.session.commit()
+    return app
+
+
+def test_etag(app):
+    response = app.test_client().get('/items')
+    assert response.headers['ETag'] == make_etag(response.data)
+    assert response.headers['Cache-Control'] == 'private, max-age=0'
+    assert json.loads(response.data.decode('utf-8'))['data'] == [
+        {'id': 1, 'name': 'a'}]
+
+
+def test_not_modified(app):
+    client = app.test_client()
+    etag = client.get('/items').headers['ETag']
+    for header in (etag, 'W/' + etag, '"other", ' + etag, '*'):
+        response = client.get('/items', headers={'If-None-Match': header})
+        assert response.status_code == 304
+        assert response.data == b''
+        assert response.headers['ETag'] == etag
+        assert response.headers['Cache-Control'] == 'private, max-age=0'
+
+    response = client.get('/items', headers={'If-None-Match': '"other"'})
+    assert response.status_code == 200
+    response = client.post('/items', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+
+def test_changed(app):
+    client = app.test_client()
+    etag = client.get('/items').headers['ETag']
+    with app.app_context():
+        Item(id=2, name='b').save()
+        db.session.commit()
+    response = client.get('/items', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_version_etag(app):
+    client = app.test_client()
+    response = client.get('/versioned')
+    with app.app_context():
+        assert response.headers['ETag'] == make_etag(Item.version())
+    response = client.get('/versioned',
+                          headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+    # answered from the version key alone
+    assert app.calls == ['versioned']
+
+    with app.app_context():
+        Item(id=2, name='b').save()
+        db.session.commit()
+    response = client.get('/versioned',
+                          headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 200
+    assert app.calls == ['versioned', 'versioned']
+
+
+def test_no_etag(app):
+    response = app.test_client().get('/plain')
+    assert 'ETag' not in response.headers
+
+
+def test_version_etag_guarded(app):
+    client = app.test_client()
+    token = create_jwt('secret', {'sub': 'ann'}).decode('ascii')
+    etag = client.get('/guarded',
+                      headers={'Authorization': token}).headers['ETag']
+    # the 304 doesn't skip authentication
+    response = client.get('/guarded', headers={'If-None-Match': etag})
+    assert response.status_code == 401
+    response = client.get('/guarded', headers={'If-None-Match': etag,
+                                               'Authorization': token})
+    assert response.status_code == 304
+    # nor rate limiting
+    response = client.get('/guarded', headers={'If-None-Match': etag,
+                                               'Authorization': token})
+    assert response.status_code == 429
+    assert app.calls == ['guarded']
+
+
+def test_version_etag_computed_once(app, monkeypatch):
+    etags = []
+
+    def counted(data):
+        etags.append(data)
+        return make_etag(data)
+
+    monkeypatch.setattr(response_module, 'make_etag', counted)
+    response = app.test_client().get('/versioned')
+    assert response.status_code == 200
+    assert len(etags) == 1
@@ -0,0 +1,79 @@
+# encoding: utf-8
+
+import json
+import os
+
+import pytest
+
+from flaskbald.db_ext import db
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'benchmarks')
+
+
+@pytest.fixture
+def harness(monkeypatch, tmpdir):
+    '''The benchmark harness, on a small app and baseline file in tmpdir.'''
+    monkeypatch.syspath_prepend(BENCHMARKS)
+    import bench_app
+    import harness
+    apps = []
+
+    def build_app(rows=1000):
+        app, directory = bench_app.build_app(rows, str(tmpdir))
+        apps.append(app)
+        return app, directory
+
+    monkeypatch.setattr(harness, 'build_app', build_app)
+    monkeypatch.setattr(harness, 'BASELINE_FILE',
+                        str(tmpdir.join('baselines.json')))
+    yield harness
+    for app in apps:
+        with app.app_context():
+            db.session.remove()
+            db.get_engine(app).dispose()
+
+
+def test_percentile(harness):
+    values = [0.5, 0.1, 0.4, 0.2, 0.3]
+    assert harness.percentile(values, 50) == 0.3
+    assert harness.percentile(values, 99) == 0.5
+    assert harness.percentile([0.1], 90) == 0.1
+
+
+def test_run_wsgi(harness):
+    app = harness.build_app(rows=50)[0]
+    for scenario in harness.SCENARIOS:
+        result = harness.run_wsgi(app, scenario, 3)
+        assert result['requests'] == 3
+        assert result['p50_ms'] <= result['p90_ms'] <= result['p99_ms']
+        assert result['kb_per_request'] > 0
+
+
+def test_failing_scenario(harness):
+    app = harness.build_app(rows=50)[0]
+    with pytest.raises(RuntimeError):
+        harness.run_wsgi(app, ('missing', 'GET', '/api/missing', None,
+                               False), 1)
+
+
+def test_compare(harness, capsys):
+    baselines = {'wsgi:a': {'rps': 100.0}, 'wsgi:b': {'rps': 100.0}}
+    results = {'wsgi:a': {'rps': 85.0}, 'wsgi:b': {'rps': 75.0},
+               'wsgi:new': {'rps': 1.0}}
+    assert harness.compare(results, baselines, 0.2) == ['wsgi:b']
+    assert 'REGRESSION wsgi:b' in capsys.readouterr().out
+
+
+def test_baseline(harness):
+    argv = ['--requests', '2', '--rows', '50', '--scenario', 'api_detail']
+    assert harness.main(argv + ['--save-baseline']) == 0
+    with open(harness.BASELINE_FILE) as baseline_file:
+        baselines = json.load(baseline_file)
+    assert list(baselines) == ['wsgi:api_detail']
+
+    assert harness.main(argv + ['--compare', '--tolerance', '1']) == 0
+    baselines['wsgi:api_detail']['rps'] = 1e12
+    with open(harness.BASELINE_FILE, 'w') as baseline_file:
+        json.dump(baselines, baseline_file)
+    assert harness.main(argv + ['--compare']) == 1
@@ -0,0 +1,78 @@
+# encoding: utf-8
+
+import json
+
+import pytest
+
+from flaskbald import factory
+from flaskbald.factory import compile_allowed_hosts, environ_host, host_allowed
+
+
+def allowed(host, setting):
+    return host_allowed(host, compile_allowed_hosts(setting))
+
+
+def test_all_hosts():
+    for setting in (None, '', '*', ['example.com', '*']):
+        assert compile_allowed_hosts(setting) is None
+        assert allowed('anything.test', setting)
+
+
+@pytest.mark.parametrize('host, result', [
+    ('example.com', True),
+    ('EXAMPLE.com', False),
+    ('example.com:8080', True),
+    ('api.example.org', True),
+    ('api.example.org:443', True),
+    ('example.org', False),
+    ('evil.com', False),
+    ('example.com.evil.com', False),
+    ('example.com.', True),
+    ('a.api.example.org', False),
+    # '*' only matches one label, the port is not part of the pattern
+    ('evil.com:1.example.org', False),
+    ('evil.com/x.example.org', False),
+    ('evil.com#.example.org', False),
+    ('example.com@evil.com', False),
+    ('[::1]', True),
+    ('[::1]:5000', True),
+    ('[::1]x', False),
+])
+def test_host_allowed(host, result):
+    setting = 'Example.com, *.example.org [::1]'
+    assert allowed(host, setting) is result
+    assert allowed(host, setting.replace(',', '').split()) is result
+
+
+def test_host_pattern():
+    assert allowed('api.example.org:8080', '*.example.org:8080')
+    assert not allowed('api.example.org:8081', '*.example.org:8080')
+    assert allowed('v2.example.org', 'v?.example.org')
+    assert not allowed('v.2.example.org', 'v?.example.org')
+
+
+def test_environ_host():
+    assert environ_host({'HTTP_HOST': 'Example.com:81'}) == 'example.com:81'
+    assert environ_host({'SERVER_NAME': 'a.test',
+                         'SERVER_PORT': '80'}) == 'a.test'
+    assert environ_host({'SERVER_NAME': 'a.test',
+                         'SERVER_PORT': '8000'}) == 'a.test:8000'
+
+
+@pytest.mark.parametrize('debug', [True, False])
+def test_before_request(make_app, monkeypatch, debug):
+    # leave the root logger alone
+    monkeypatch.setattr(factory, 'default_debug_log', lambda: None)
+    app = make_app({'ALLOWED_HOSTS': 'example.com', 'DEBUG': debug},
+                   db_enabled=False)
+
+    @app.route('/ping')
+    def ping():
+        return 'pong'
+
+    client = app.test_client()
+    assert client.get('/ping', base_url='http://example.com').data == b'pong'
+    response = client.get('/ping', base_url='http://evil.com')
+    assert response.status_code == 404
+    message = json.loads(response.data.decode('utf-8'))['data']['message']
+    assert ('evil.com' in message) is debug
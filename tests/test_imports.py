@@ -0,0 +1,47 @@
+# encoding: utf-8
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import flaskbald
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ['celery', 'jwt', 'phonenumbers', 'readline', 'flask_mail',
+         'flask_errormail', 'flask_sslify', 'flask_cors']
+
+
+def imported(code, modules):
+    '''
+    Which of *modules* are imported after running *code* in a fresh
+    interpreter.
+    '''
+    script = '{0}\nimport sys\nprint(" ".join(name for name in {1!r} '\
+             'if name in sys.modules))'.format(code, modules)
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    output = subprocess.check_output([sys.executable, '-c', script],
+                                     cwd=ROOT, env=env)
+    # create_app may print the routes first
+    return output.decode('utf-8').splitlines()[-1].split()
+
+
+def test_package_import():
+    assert imported('import flaskbald',
+                    HEAVY + ['flaskbald.db_ext', 'sqlalchemy']) == []
+
+
+def test_create_app_imports(tmpdir):
+    config = tmpdir.join('config.py')
+    config.write("DEBUG = True\nSQLALCHEMY_DATABASE_URI = 'sqlite://'\n")
+    code = ('from flaskbald import factory\n'
+            'factory.create_app({0!r}, cors=False)\n'.format(str(config)))
+    assert imported(code, HEAVY) == []
+
+
+def test_submodules():
+    assert flaskbald.text is sys.modules['flaskbald.text']
+    assert 'factory' in dir(flaskbald)
+    with pytest.raises(AttributeError):
+        flaskbald.missing
@@ -0,0 +1,132 @@
+# encoding: utf-8
+
+import pytest
+import sqlalchemy as sa
+
+from flask import g
+
+from flaskbald import loader as loader_module
+from flaskbald.db_ext import db, Model
+from flaskbald.loader import Loader, LoaderProperty, request_loader
+
+
+class Member(Model):
+    __tablename__ = 'loader_members'
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(20), unique=True)
+
+    email_loader = LoaderProperty(db.session, 'email')
+
+
+class Membership(Model):
+    __tablename__ = 'loader_memberships'
+    member_id = db.Column(db.Integer, primary_key=True)
+    group_id = db.Column(db.Integer, primary_key=True)
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    with app.app_context():
+        db.session.add_all([Member(id=id, email='{0}@test'.format(id))
+                            for id in range(1, 6)])
+        db.session.commit()
+        db.session.expunge_all()
+        yield app
+
+
+@pytest.fixture
+def selects(app):
+    selects = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('SELECT'):
+            selects.append(parameters)
+
+    engine = db.get_engine(app)
+    sa.event.listen(engine, 'before_cursor_execute', record)
+    yield selects
+    sa.event.remove(engine, 'before_cursor_execute', record)
+
+
+def test_batched(app, selects):
+    deferred = [Member.loader.load(id) for id in (3, 1, 9, 3)]
+    assert selects == []
+    assert deferred[0].email == '3@test'
+    assert len(selects) == 1
+    assert [item.value.id if item.value else None for item in deferred] == [
+        3, 1, None, 3]
+    # memoized
+    assert Member.loader.load(1).value is deferred[1].value
+    assert Member.loader.load(9).value is None
+    assert len(selects) == 1
+
+
+def test_identity_map(app, selects):
+    member = Member.query().get(2)
+    del selects[:]
+    assert Member.loader.load(2).value is member
+    assert selects == []
+
+
+def test_max_batch(app, selects, monkeypatch):
+    monkeypatch.setattr(loader_module, 'MAX_BATCH', 2)
+    assert [member.id for member in Member.get_many([1, 2, 3, 4, 5])] == [
+        1, 2, 3, 4, 5]
+    assert len(selects) == 3
+
+
+def test_other_attribute(app, selects):
+    members = Member.email_loader.load_many(['2@test', 'x@test'])
+    assert members[0].value.id == 2
+    assert members[1].value is None
+    assert Member.email_loader is not Member.loader
+    assert len(selects) == 1
+
+
+def test_composite_key(app):
+    with pytest.raises(ValueError):
+        Membership.loader
+    assert Loader(Membership, db.session, 'group_id').attribute == 'group_id'
+
+
+def test_get_many(app):
+    members = Member.get_many([5, 7, 1])
+    assert [member and member.email for member in members] == [
+        '5@test', None, '1@test']
+
+
+def test_request_scope(make_app):
+    app = make_app()
+    with app.test_request_context():
+        loader = Member.loader
+        assert Member.loader is loader
+        assert request_loader(Member, db.session) is loader
+        loader.load(1)
+    with app.test_request_context():
+        assert Member.loader is not loader
+        assert Member.loader.results == {}
+
+
+def test_reset_on_teardown(make_app):
+    app = make_app()
+    with app.app_context():
+        Member.loader
+        context_g = g._get_current_object()
+        assert context_g._flaskbald_loaders
+    assert not hasattr(context_g, '_flaskbald_loaders')
+
+
+def test_clear_on_save(app):
+    assert Member.get_many([6]) == [None]
+    Member(id=6, email='6@test').save(flush=True)
+    assert Member.get_many([6])[0].email == '6@test'
+    member = Member.loader.load(6).value
+    member.delete(flush=True)
+    assert 6 not in Member.loader.results
+
+    Member.loader.load(1)
+    Member.loader.clear()
+    assert Member.loader.pending == []
+    Member.loader.prime(1, None)
+    assert Member.loader.load(1).value is None
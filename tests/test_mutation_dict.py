@@ -0,0 +1,149 @@
+# encoding: utf-8
+
+import pickle
+
+import pytest
+
+from flaskbald.db_ext import db, Model, MutationDict, NestedMutationDict
+
+
+class Counted(MutationDict):
+    '''MutationDict counting its change events.'''
+    events = 0
+
+    def changed(self):
+        self.events += 1
+        super(Counted, self).changed()
+
+
+class Setting(Model):
+    __tablename__ = 'mutation_settings'
+    id = db.Column(db.Integer, primary_key=True)
+    data = db.Column(MutationDict.as_mutable(db.JSON))
+    nested = db.Column(NestedMutationDict.as_mutable(db.JSON))
+
+
+def test_single_events():
+    data = Counted(a=1)
+    data.update({'b': 2, 'c': 3}, d=4)
+    assert data.events == 1
+    assert data.setdefault('a', 9) == 1
+    assert data.events == 1
+    assert data.setdefault('e') is None
+    assert data.events == 2
+    data.clear()
+    assert data == {}
+    assert data.events == 3
+
+
+def test_item_events():
+    data = Counted(a=1, b=2, c=3)
+    data['d'] = 4
+    del data['a']
+    assert data.pop('b') == 2
+    data.popitem()
+    assert data.events == 4
+    assert data.pop('missing', None) is None
+    with pytest.raises(KeyError):
+        data.pop('missing')
+    with pytest.raises(KeyError):
+        del data['missing']
+    assert data.events == 5
+
+
+def test_pickle():
+    data = Counted(a={'b': [1]})
+    restored = pickle.loads(pickle.dumps(data))
+    assert type(restored) is Counted
+    assert restored == data
+    assert restored.events == 0
+
+
+def test_coerce():
+    assert type(Counted.coerce('data', {'a': 1})) is Counted
+    data = Counted()
+    assert Counted.coerce('data', data) is data
+    with pytest.raises(ValueError):
+        Counted.coerce('data', [1])
+
+
+def test_nested_tracking():
+    data = Counted(settings={'theme': 'light'}, tags=['a'])
+    assert data['settings'] is data['settings']
+    data['settings']['theme'] = 'dark'
+    data['tags'].append('b')
+    data.get('settings').update(size=1)
+    assert data.events == 0
+    nested = NestedMutationDict(data)
+    nested['settings']['deep'] = {'list': [{'x': 1}]}
+    assert nested['settings']['deep']['list'][0] == {'x': 1}
+    tags = nested.setdefault('tags', [])
+    assert tags is nested['tags']
+    nested.setdefault('prefs', {}).setdefault('colors', []).append('red')
+    assert nested['prefs'] is nested.setdefault('prefs')
+    assert nested['prefs'] == {'colors': ['red']}
+    # nested containers pickle back as plain ones
+    restored = pickle.loads(pickle.dumps(nested))
+    assert type(restored) is NestedMutationDict
+    assert type(dict.__getitem__(restored, 'settings')) is dict
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    with app.app_context():
+        db.session.add(Setting(id=1, data={'a': 1}, nested={
+            'settings': {'theme': 'light', 'tags': ['a']}}))
+        db.session.commit()
+        yield app
+
+
+def stored():
+    db.session.expunge_all()
+    return Setting.get(id=1)
+
+
+def test_model_update(app):
+    setting = Setting.get(id=1)
+    setting.data.update(b=2)
+    assert setting.is_modified()
+    db.session.commit()
+    assert stored().data == {'a': 1, 'b': 2}
+
+
+def test_model_nested(app):
+    setting = Setting.get(id=1)
+    setting.nested['settings']['theme'] = 'dark'
+    setting.nested['settings']['tags'].append('b')
+    assert setting.is_modified()
+    db.session.commit()
+    assert stored().nested == {'settings': {'theme': 'dark',
+                                            'tags': ['a', 'b']}}
+
+
+def test_model_nested_setdefault(app):
+    setting = Setting.get(id=1)
+    setting.nested.setdefault('settings', {}).setdefault('tags').append('b')
+    assert setting.is_modified()
+    db.session.commit()
+    setting = stored()
+    setting.nested.setdefault('extra', {})
+    db.session.commit()
+    setting = stored()
+    setting.nested.setdefault('extra', {})['size'] = 1
+    assert setting.is_modified()
+    db.session.commit()
+    assert stored().nested == {'settings': {'theme': 'light',
+                                            'tags': ['a', 'b']},
+                               'extra': {'size': 1}}
+
+
+def test_model_read_only(app):
+    setting = Setting.get(id=1)
+    setting.nested['settings']['tags'][0]
+    setting.data.setdefault('a', 2)
+    assert not setting.is_modified()
+    # restoring a pickled instance isn't a change
+    restored = pickle.loads(pickle.dumps(setting))
+    db.session.expunge_all()
+    assert not db.session.merge(restored, load=False).is_modified()
@@ -0,0 +1,244 @@
+# encoding: utf-8
+'''
+PackedJSON columns paired with MutationDict: values stay encoded when a row
+is loaded and are decoded on first access. This relies on SQLAlchemy
+internals (InstanceState.callables, the order of the 'load' listeners), so
+these tests pin the behaviour down.
+'''
+import pickle
+
+import pytest
+import sqlalchemy as sa
+
+from flask import Flask
+
+from flaskbald.db_ext import (db, Model, MutationDict, Packed, PackedJSON,
+                              LazyUnpack, convert_json_column, pack, unpack)
+
+
+class Document(Model):
+    __tablename__ = 'packed_documents'
+    id = db.Column(db.Integer, primary_key=True)
+    data = db.Column(MutationDict.as_mutable(PackedJSON(
+        compress_threshold=100)))
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def saved(data):
+    '''Id of a new Document, with the session emptied.'''
+    id = Document(data=data).save(flush=True).id
+    db.session.commit()
+    db.session.expunge_all()
+    return id
+
+
+def stored(id):
+    '''Bytes stored for the Document *id*.'''
+    return bytes(db.session.execute(
+        sa.select([Document.__table__.c.data]).where(
+            Document.__table__.c.id == id)).scalar().data)
+
+
+def test_stored_packed(app):
+    small = saved({'a': 1})
+    large = saved({'text': 'x' * 500})
+    assert stored(small)[:1] == b'M'
+    assert stored(large)[:1] == b'Z'
+    assert len(stored(large)) < 500
+    assert unpack(stored(large)) == {'text': 'x' * 500}
+
+
+def test_instance_callables(app):
+    '''
+    The SQLAlchemy behaviour LazyUnpack relies on: a loader in
+    InstanceState.callables is called with (state, passive) on first
+    access, its result is stored in the instance dict, and the loader is
+    dropped.
+    '''
+    id = saved(None)
+    document = Document.get(id=id)
+    state = sa.inspect(document)
+    calls = []
+
+    def loader(state, passive):
+        calls.append(state)
+        return {'loaded': True}
+
+    del document.__dict__['data']
+    state.callables = {'data': loader}
+    assert document.data == {'loaded': True}
+    assert document.data == {'loaded': True}
+    assert calls == [state]
+    assert document.__dict__['data'] == {'loaded': True}
+    assert 'data' not in state.callables
+
+
+def test_lazy_decode(app):
+    id = saved({'a': {'b': [1, 2]}})
+    document = Document.get(id=id)
+    state = sa.inspect(document)
+
+    assert 'data' not in document.__dict__
+    assert 'data' in state.unloaded
+    assert isinstance(state.callables['data'], LazyUnpack)
+
+    data = document.data
+    assert isinstance(data, MutationDict)
+    assert data == {'a': {'b': [1, 2]}}
+    assert document.__dict__['data'] is data
+    assert 'data' not in state.callables
+    assert document.data is data
+    assert not state.modified
+
+
+def test_none_not_lazy(app):
+    id = saved(None)
+    document = Document.get(id=id)
+    assert document.__dict__['data'] is None
+    assert 'data' not in sa.inspect(document).callables
+
+
+def test_dirty_after_decode(app):
+    id = saved({'a': 1})
+    document = Document.get(id=id)
+    document.data['b'] = 2
+    assert document in db.session.dirty
+    assert db.session.is_modified(document)
+    db.session.commit()
+    db.session.expunge_all()
+    assert Document.get(id=id).data == {'a': 1, 'b': 2}
+
+
+def test_replace_before_decode(app):
+    id = saved({'a': 1})
+    document = Document.get(id=id)
+    document.data = {'c': 3}
+    assert isinstance(document.data, MutationDict)
+    db.session.commit()
+    db.session.expunge_all()
+    assert Document.get(id=id).data == {'c': 3}
+
+
+def test_unread_not_written(app):
+    id = saved({'a': 1})
+    before = stored(id)
+    document = Document.get(id=id)
+    document.data
+    assert not db.session.is_modified(document)
+    db.session.commit()
+    assert stored(id) == before
+
+
+def test_expire_refresh(app):
+    id = saved({'a': 1})
+    document = Document.get(id=id)
+    document.data['a'] = 2
+    db.session.commit()
+    # refreshed on access after the commit expired everything: decoded
+    # right away, and still tracked
+    assert document.data == {'a': 2}
+    assert 'data' in document.__dict__
+    document.data['a'] = 3
+    assert db.session.is_modified(document)
+    db.session.commit()
+
+    db.session.expire(document, ['data'])
+    assert document.data == {'a': 3}
+    db.session.refresh(document)
+    assert isinstance(document.__dict__['data'], MutationDict)
+    document.data['b'] = 1
+    db.session.commit()
+    db.session.expunge_all()
+    assert Document.get(id=id).data == {'a': 3, 'b': 1}
+
+
+def test_expire_before_decode(app):
+    id = saved({'a': 1})
+    document = Document.get(id=id)
+    db.session.expire(document)
+    assert document.data == {'a': 1}
+
+
+def test_pickle_lazy(app):
+    id = saved({'a': {'b': [1, 2]}})
+    document = Document.get(id=id)
+    assert isinstance(sa.inspect(document).callables['data'], LazyUnpack)
+
+    copy = pickle.loads(pickle.dumps(document))
+    assert copy.data == {'a': {'b': [1, 2]}}
+    assert isinstance(copy.data, MutationDict)
+
+    copy = db.session.merge(pickle.loads(pickle.dumps(document)))
+    copy.data['c'] = 3
+    assert db.session.is_modified(copy)
+    db.session.commit()
+    db.session.expunge_all()
+    assert Document.get(id=id).data == {'a': {'b': [1, 2]}, 'c': 3}
+
+
+def test_pickle_decoded(app):
+    id = saved({'a': 1})
+    document = Document.get(id=id)
+    document.data
+    copy = pickle.loads(pickle.dumps(document))
+    assert copy.data == {'a': 1}
+    assert isinstance(copy.data, MutationDict)
+
+
+def test_core_queries_packed(app):
+    id = saved({'a': 1})
+    value = db.session.execute(
+        sa.select([Document.__table__]).where(
+            Document.__table__.c.id == id)).first()['data']
+    assert isinstance(value, Packed)
+    assert value.unpack() == {'a': 1}
+
+
+def test_serialize_rows(app):
+    id = saved({'a': 1})
+    rows = Document.select('id', 'data')
+    assert Document.serialize(rows, 'id', 'data') == [
+        {'id': id, 'data': {'a': 1}}]
+    assert Document.get(id=id).to_dict('data') == {'data': {'a': 1}}
+
+
+def test_unpack_invalid():
+    with pytest.raises(ValueError):
+        unpack(b'{"a": 1}')
+
+
+def test_convert_json_column(app):
+    table = sa.Table('packed_legacy', sa.MetaData(),
+                     sa.Column('id', sa.Integer, primary_key=True),
+                     sa.Column('data', sa.LargeBinary))
+    table.create(db.engine)
+    rows = [{'id': 1, 'data': b'{"a": 1}'}, {'id': 2, 'data': None},
+            {'id': 3, 'data': pack({'done': True})},
+            {'id': 4, 'data': b'{"b": [1, 2]}'},
+            {'id': 5, 'data': b'{"c": "%s"}' % (b'x' * 100)}]
+    db.engine.execute(table.insert(), rows)
+
+    assert convert_json_column(db.engine, table, 'data', batch_size=2,
+                               compress_threshold=50) == 3
+    values = dict((row.id, row.data) for row in db.engine.execute(
+        table.select()))
+    assert values[2] is None
+    assert values[5][:1] == b'Z'
+    assert dict((id, unpack(value)) for id, value in values.items()
+                if value is not None) == {
+        1: {'a': 1}, 3: {'done': True}, 4: {'b': [1, 2]},
+        5: {'c': 'x' * 100}}
+    # already packed rows are skipped
+    assert convert_json_column(db.engine, table, 'data') == 0
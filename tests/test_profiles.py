@@ -0,0 +1,108 @@
+# encoding: utf-8
+
+import pytest
+import sqlalchemy as sa
+
+from flaskbald.db_ext import db, Model
+from flaskbald.model import loader_option
+
+
+class Person(Model):
+    __tablename__ = 'profile_people'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20))
+
+
+class Story(Model):
+    __tablename__ = 'profile_stories'
+    profiles = {'list': ['author'],
+                'detail': ['author', 'replies.author'],
+                'bare': [sa.orm.noload('replies')]}
+    id = db.Column(db.Integer, primary_key=True)
+    # a column may be called 'profile'
+    profile = db.Column(db.String(20))
+    author_id = db.Column(db.Integer, db.ForeignKey(Person.id))
+    author = db.relationship(Person)
+
+
+class Reply(Model):
+    __tablename__ = 'profile_replies'
+    profiles = {'default': ['author']}
+    id = db.Column(db.Integer, primary_key=True)
+    story_id = db.Column(db.Integer, db.ForeignKey(Story.id))
+    author_id = db.Column(db.Integer, db.ForeignKey(Person.id))
+    story = db.relationship(Story, backref='replies')
+    author = db.relationship(Person)
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    with app.app_context():
+        ann, bob = Person(id=1, name='ann'), Person(id=2, name='bob')
+        story = Story(id=1, profile='long', author=ann)
+        db.session.add_all([story, Story(id=2, profile='short', author=bob),
+                            Reply(id=1, story=story, author=bob),
+                            Reply(id=2, story=story, author=ann)])
+        db.session.commit()
+        db.session.expunge_all()
+        yield app
+
+
+@pytest.fixture
+def selects(app):
+    selects = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        selects.append(statement)
+
+    engine = db.get_engine(app)
+    sa.event.listen(engine, 'before_cursor_execute', record)
+    yield selects
+    sa.event.remove(engine, 'before_cursor_execute', record)
+
+
+def test_detail(app, selects):
+    story = Story.get('detail', id=1)
+    queries = len(selects)
+    assert story.author.name == 'ann'
+    assert sorted(reply.author.name for reply in story.replies) == [
+        'ann', 'bob']
+    assert len(selects) == queries
+
+
+def test_list(app, selects):
+    stories = Story.all(_profile='list')
+    assert len(selects) == 1
+    assert sorted(story.author.name for story in stories) == ['ann', 'bob']
+    assert len(selects) == 1
+
+
+def test_load(app, selects):
+    story = Story.load('list', profile='short').one()
+    assert story.author.name == 'bob'
+    assert len(selects) == 1
+    # relationship filters aren't baked, profiles still apply
+    assert Story.get('list', author=story.author) is story
+
+
+def test_loader_options(app, selects):
+    story = Story.get('bare', id=1)
+    assert story.replies == []
+    assert len(selects) == 1
+
+
+def test_default(app, selects):
+    reply = Reply.get(id=1)
+    assert reply.author.name == 'bob'
+    assert len(selects) == 1
+    # lazy loading without a default profile
+    Story.get(id=1).author
+    assert len(selects) == 3
+
+
+def test_unknown_profile(app):
+    with pytest.raises(KeyError):
+        Story.get('missing', id=1)
+    with pytest.raises(ValueError):
+        loader_option(Story, 'replies.story_id')
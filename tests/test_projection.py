@@ -0,0 +1,80 @@
+# encoding: utf-8
+
+import pytest
+
+from flaskbald.db_ext import db, Model
+
+
+class BodyMixin(object):
+    body = db.Column(db.Text)
+
+
+class Page(BodyMixin, Model):
+    __tablename__ = 'projection_pages'
+    __deferred__ = ('body', 'notes')
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(20))
+    section = db.Column(db.String(20))
+    notes = db.Column(db.Text)
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    with app.app_context():
+        db.session.add_all([
+            Page(id=1, title='one', section='a', body='x' * 100, notes='n'),
+            Page(id=2, title='two', section='a'),
+            Page(id=3, title='three', section='b')])
+        db.session.commit()
+        yield app
+
+
+def test_select(app):
+    rows = Page.select('id', 'title', section='a')
+    assert [(row.id, row.title) for row in sorted(rows)] == [
+        (1, 'one'), (2, 'two')]
+    assert type(rows[0]).__name__ == 'PageRow'
+    assert not hasattr(rows[0], '__dict__')
+    # rows aren't tracked by the session
+    assert len(db.session.identity_map) == 0
+
+
+def test_select_defaults(app):
+    row = Page.select(id=1)[0]
+    assert 'body' not in row._fields
+    assert 'notes' not in row._fields
+    assert row.title == 'one'
+    assert Page.select('body', id=1)[0].body == 'x' * 100
+
+
+def test_values(app):
+    assert sorted(Page.values('id', section='a')) == [1, 2]
+    assert sorted(Page.values('id', 'section')) == [
+        (1, 'a'), (2, 'a'), (3, 'b')]
+    count = db.func.count(Page.id).label('count')
+    assert Page.values(count) == [3]
+
+
+def test_autoflush(app):
+    Page(id=4, title='four', section='b').save()
+    assert sorted(Page.values('id', section='b')) == [3, 4]
+
+
+def test_deferred(app):
+    page = Page.get(id=1)
+    assert 'body' not in page.__dict__
+    assert 'body' not in page.to_dict()
+    assert 'notes' not in page.to_dict()
+    # still not loaded
+    assert 'body' not in page.__dict__
+    assert page.to_dict('body') == {'body': 'x' * 100}
+    assert page.notes == 'n'
+
+
+def test_deferred_not_a_column():
+    with pytest.raises(AttributeError):
+        class Broken(Model):
+            __tablename__ = 'projection_broken'
+            __deferred__ = ('missing',)
+            id = db.Column(db.Integer, primary_key=True)
@@ -0,0 +1,127 @@
+# encoding: utf-8
+
+import json
+
+import pytest
+
+from flaskbald import ratelimit
+from flaskbald.auth import create_jwt
+from flaskbald.ratelimit import MemoryStore, rate_limit, KEY_IP
+from flaskbald.response import api_action
+
+SECRET = 'secret'
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, 'time', clock)
+    return clock
+
+
+def test_bucket(clock):
+    store = MemoryStore()
+    # 1 token per second, bursts of 3
+    assert [store.consume('a', 1.0, 3)[0] for i in range(4)] == [
+        True, True, True, False]
+    assert store.consume('a', 1.0, 3) == (False, 0, 1.0)
+    assert store.consume('b', 1.0, 3)[0]
+    clock.now += 1.5
+    assert store.consume('a', 1.0, 3) == (True, 0.5, 0.0)
+    assert store.consume('a', 1.0, 3, cost=2) == (False, 0.5, 1.5)
+    clock.now += 100
+    assert store.consume('a', 1.0, 3) == (True, 2, 0.0)
+
+
+def test_evict(clock):
+    store = MemoryStore(evict_interval=10)
+    store.consume('a', 1.0, 5)
+    store.consume('b', 0.01, 5)
+    clock.now += 11
+    store.consume('c', 1.0, 5)
+    # 'a' is full again and dropped, 'b' still refilling
+    assert sorted(store._buckets) == ['b', 'c']
+    assert len(store) == 2
+
+
+def test_evict_max_buckets(clock):
+    store = MemoryStore(evict_interval=3600, max_buckets=2)
+    store.consume('a', 1.0, 5)
+    store.consume('b', 1.0, 5)
+    clock.now += 2
+    store.consume('a', 1.0, 5)
+    store.consume('c', 1.0, 5)
+    # over max_buckets: the idle 'b' is dropped, 'a' was used since
+    assert list(store._buckets) == ['a', 'c']
+    store.consume('d', 1.0, 5)
+    # the sweep stops at the first bucket still refilling
+    assert list(store._buckets) == ['a', 'c', 'd']
+
+
+@pytest.fixture
+def app(make_app, clock):
+    app = make_app({'JWT_CLIENT_SECRET': SECRET}, db_enabled=False)
+    store = MemoryStore()
+
+    @app.route('/ip')
+    @api_action
+    @rate_limit(2, per=60, key=KEY_IP, store=store)
+    def by_ip():
+        return 'ok'
+
+    @app.route('/user')
+    @api_action
+    @rate_limit(1, per=60, store=store)
+    def by_user():
+        return 'ok'
+
+    @app.route('/async')
+    @api_action
+    @rate_limit(1, per=60, key=lambda: 'everyone', store=store)
+    async def by_custom_key():
+        return 'ok'
+
+    return app
+
+
+def get(app, path, address='10.0.0.1', **headers):
+    return app.test_client().get(path, headers=headers, environ_base={
+        'REMOTE_ADDR': address})
+
+
+def test_rate_limit(app, clock):
+    assert [get(app, '/ip').status_code for i in range(3)] == [200, 200, 429]
+    response = get(app, '/ip')
+    assert response.headers['Retry-After'] == '30'
+    assert json.loads(response.data.decode('utf-8'))['data'][
+        'retry_after'] == 30
+    assert get(app, '/ip', address='10.0.0.2').status_code == 200
+    clock.now += 30
+    assert get(app, '/ip').status_code == 200
+
+
+def test_auth_key(app):
+    def token(sub):
+        return create_jwt(SECRET, {'sub': sub}).decode('ascii')
+
+    assert get(app, '/user', Authorization=token('a')).status_code == 200
+    # same client, other user
+    assert get(app, '/user', Authorization=token('b')).status_code == 200
+    assert get(app, '/user', Authorization=token('a'),
+               address='10.0.0.9').status_code == 429
+    # anonymous requests fall back to the client address
+    assert get(app, '/user').status_code == 200
+    assert get(app, '/user').status_code == 429
+
+
+def test_async_custom_key(app):
+    assert get(app, '/async').status_code == 200
+    assert get(app, '/async', address='10.0.0.2').status_code == 429
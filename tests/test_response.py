@@ -0,0 +1,110 @@
+# encoding: utf-8
+
+import json
+
+import pytest
+
+from flask import Response
+
+from flaskbald.response import (api_action, json_response, request_data,
+                                JSONResponse, APIBadRequest,
+                                APITooManyRequests)
+
+
+def data(response):
+    return json.loads(response.data.decode('utf-8'))
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app(db_enabled=False)
+
+    @app.route('/ok')
+    @api_action(set_jwt_cookie=True)
+    def ok():
+        return {'name': u'Zoë', 'token': 'abc'}
+
+    @app.route('/bad')
+    @api_action
+    def bad():
+        raise APIBadRequest('Missing name', payload={'field': 'name'})
+
+    @app.route('/slow-down')
+    @api_action
+    def slow_down():
+        raise APITooManyRequests('Too many', payload={'retry_after': 1.2})
+
+    @app.route('/flask')
+    @api_action
+    def flask_response():
+        return Response('raw', status=201, mimetype='text/plain')
+
+    @app.route('/echo', methods=['POST'])
+    @api_action
+    def echo():
+        return request_data()
+
+    return app
+
+
+def test_json_response(app):
+    with app.test_request_context():
+        response = json_response([1], status='200 OK', etag=False)
+    assert isinstance(response, JSONResponse)
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == \
+        'application/json; charset=utf-8'
+    assert data(response) == {'status': 'success', 'data': [1]}
+
+
+def test_json_response_text():
+    response = JSONResponse(u'{"a": "é"}', status=201)
+    assert response.status_code == 201
+    assert response.data == u'{"a": "é"}'.encode('utf-8')
+
+
+def test_api_action(app):
+    response = app.test_client().get('/ok')
+    assert data(response)['data'] == {'name': u'Zoë', 'token': 'abc'}
+    cookie = response.headers['Set-Cookie']
+    assert cookie.startswith('jwt=abc;')
+    assert 'HttpOnly' in cookie
+
+
+def test_api_error(app):
+    response = app.test_client().get('/bad')
+    assert response.status_code == 400
+    assert response.mimetype == 'application/json'
+    assert data(response) == {'status': 'error', 'data': {
+        'message': 'Missing name', 'field': 'name'}}
+
+
+def test_retry_after(app):
+    response = app.test_client().get('/slow-down')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '2'
+
+
+def test_wsgi_response(app):
+    response = app.test_client().get('/flask')
+    assert response.status_code == 201
+    assert response.data == b'raw'
+
+
+def test_webob_response(app):
+    webob = pytest.importorskip('webob')
+
+    @app.route('/webob')
+    @api_action
+    def webob_response():
+        return webob.Response(json_body={'legacy': True})
+
+    response = app.test_client().get('/webob')
+    assert data(response) == {'legacy': True}
+
+
+def test_request_data(app):
+    client = app.test_client()
+    response = client.post('/echo', data=json.dumps({'a': 1}))
+    assert data(response)['data'] == {'a': 1}
+    assert data(client.post('/echo', data='not json'))['data'] == {}
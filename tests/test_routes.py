@@ -0,0 +1,94 @@
+# encoding: utf-8
+
+import pytest
+
+from flask import Blueprint, url_for
+
+from flaskbald.routes import RouteIndex, compile_rule
+from flaskbald.template import route_url
+
+pages = Blueprint('pages', __name__)
+
+
+@pages.route('/users/<int:id>', methods=['GET', 'POST'])
+def user(id):
+    return ''
+
+
+@pages.route('/list/', defaults={'page': 1})
+@pages.route('/list/<int:page>')
+def listing(page):
+    return ''
+
+
+@pages.route('/files/<path:name>')
+def download(name):
+    return ''
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(blueprints=[pages], db_enabled=False)
+
+
+def test_compile_rule():
+    assert compile_rule('/a/<int:id>/<name>') == '/a/{id}/{name}'
+    assert compile_rule('/{x}/<y>') == '/{{x}}/{y}'
+
+
+def test_routes_config(app):
+    routes = app.config['routes']
+    assert routes == RouteIndex(app.url_map).to_dict()
+    assert routes['pages.user']['args'] == ['id']
+
+
+@pytest.mark.parametrize('endpoint, values', [
+    ('pages.user', {'id': 3}),
+    ('pages.user', {'id': 3, 'q': 'a b'}),
+    ('pages.listing', {}),
+    ('pages.listing', {'page': 1}),
+    ('pages.listing', {'page': 4}),
+    ('pages.download', {'name': 'a dir/file é.txt'}),
+])
+def test_route_url(app, endpoint, values):
+    with app.test_request_context():
+        assert route_url(endpoint, **values) == url_for(endpoint, **values)
+
+
+@pytest.mark.parametrize('endpoint, values', [
+    ('pages.user', {'id': 3}),
+    ('pages.listing', {}),
+])
+def test_route_url_script_root(app, endpoint, values):
+    with app.test_request_context(base_url='http://localhost/app/'):
+        assert route_url(endpoint, **values).startswith('/app/')
+        assert route_url(endpoint, **values) == url_for(endpoint, **values)
+
+
+def test_route_url_query(app):
+    with app.test_request_context():
+        assert route_url('pages.user', id=3, tab='all', q='a b',
+                         empty=None) == '/users/3?q=a+b&tab=all'
+
+
+def test_route_url_missing_args(app):
+    with app.test_request_context():
+        with pytest.raises(KeyError):
+            route_url('pages.user')
+
+
+def test_route_index_dict(app):
+    index = RouteIndex(app.url_map).to_dict()
+    assert index['pages.user'] == {'url': '/users/<int:id>',
+                                   'methods': ['GET', 'HEAD', 'OPTIONS',
+                                               'POST'],
+                                   'args': ['id']}
+
+
+def test_print_routes(make_app, capsys):
+    make_app(blueprints=[pages], db_enabled=False)
+    assert capsys.readouterr().out == ''
+    make_app(blueprints=[pages], db_enabled=False, print_routes=True)
+    assert '/users/<int:id>' in capsys.readouterr().out
+    make_app({'PRINT_ROUTES': True}, blueprints=[pages], db_enabled=False)
+    assert 'pages.download' in capsys.readouterr().out
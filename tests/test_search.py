@@ -0,0 +1,110 @@
+# encoding: utf-8
+
+import pytest
+import sqlalchemy as sa
+
+from flaskbald.db_ext import db, Model
+from flaskbald import search
+from flaskbald.search import Searchable, normalize, search_terms
+
+
+class Venue(Searchable, Model):
+    __tablename__ = 'search_venues'
+    __searchable__ = ('name', 'address')
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80))
+    address = db.Column(db.String(80))
+    city = db.Column(db.String(20))
+
+
+def test_normalize():
+    assert normalize(u'Crème Brûlée') == 'creme brulee'
+    assert normalize(u'Søren Straße Łódź') == 'soren strasse lodz'
+    assert normalize(None) == ''
+    assert normalize(42) == '42'
+    assert search_terms(u'  Zoë, São-Paulo! ') == ['zoe', 'sao', 'paulo']
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    with app.app_context():
+        db.session.add_all([
+            Venue(id=1, name=u'Café Zoë', address=u'Rue de la Paix',
+                  city='paris'),
+            Venue(id=2, name=u'Müller Bäckerei', address=u'Königstraße 3',
+                  city='zurich'),
+            Venue(id=3, name=u'Zoo Café', address=u'Café Street',
+                  city='paris'),
+            Venue(id=4, name=u'Søren Bar', address=u'Strøget 1',
+                  city='copenhagen')])
+        db.session.commit()
+        yield app
+
+
+def ids(venues):
+    return [venue.id for venue in venues]
+
+
+def test_search(app):
+    assert ids(Venue.search(u'muller')) == [2]
+    assert ids(Venue.search(u'MÜLLER königs')) == [2]
+    assert ids(Venue.search('soren stroget')) == [4]
+    # every word must match, as a prefix
+    assert sorted(ids(Venue.search('zo'))) == [1, 3]
+    assert ids(Venue.search('zoe paix')) == [1]
+    assert Venue.search('zoe muller') == []
+    assert Venue.search(' ,. ') == []
+
+
+def test_rank(app):
+    # 'cafe' in both columns ranks first
+    assert ids(Venue.search('cafe')) == [3, 1]
+    assert ids(Venue.search('cafe', limit=1)) == [3]
+    assert ids(Venue.search('cafe', city='paris', id=1)) == [1]
+
+
+def test_update_delete(app):
+    venue = Venue.get(id=2)
+    venue.name = u'Schmidt Bäckerei'
+    venue.city = 'bern'
+    db.session.commit()
+    assert Venue.search('muller') == []
+    assert ids(Venue.search('schmidt')) == [2]
+    Venue.get(id=1).delete()
+    db.session.commit()
+    assert ids(Venue.search('cafe')) == [3]
+
+
+def test_rebuild(app):
+    db.session.execute(Venue.__table__.insert().values(
+        id=5, name=u'Ångström Hall', address='', city='uppsala'))
+    assert Venue.search('angstrom') == []
+    Venue.rebuild_search_index(batch_size=2)
+    assert ids(Venue.search('angstrom')) == [5]
+    assert ids(Venue.search('muller')) == [2]
+
+
+def test_drop(app):
+    def index_tables():
+        return db.session.execute(
+            "SELECT name FROM sqlite_master WHERE name = 'search_venues_fts'"
+        ).fetchall()
+    assert index_tables()
+    db.session.commit()
+    Venue.__table__.drop(db.engine)
+    assert not index_tables()
+    Venue.__table__.create(db.engine)
+    assert index_tables()
+
+
+def test_unsupported_dialect():
+    engine = sa.create_engine('mysql://', strategy='mock',
+                              executor=lambda *pargs, **kargs: None)
+    with pytest.raises(NotImplementedError) as error:
+        Venue.__table__.create(engine)
+    assert str(error.value) == (
+        'Full text search of Venue is not supported on mysql')
+    # index updates fail the same way instead of skipping the index
+    with pytest.raises(NotImplementedError):
+        search._execute(engine, Venue, 'insert', [{}])
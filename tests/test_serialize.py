@@ -0,0 +1,138 @@
+# encoding: utf-8
+
+import datetime
+import decimal
+import uuid
+
+import pytest
+
+from flaskbald.db_ext import db, Model
+from flaskbald.serialize import compile_serializer, date_formatter
+
+CREATED = datetime.datetime(2020, 1, 2, 3, 4, 5)
+
+
+class Writer(Model):
+    __tablename__ = 'serialize_writers'
+    __serialize_exclude__ = ('password',)
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20))
+    password = db.Column(db.String(20))
+
+    @property
+    def initial(self):
+        return self.name[0]
+
+
+class Article(Model):
+    __tablename__ = 'serialize_articles'
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(20))
+    price = db.Column(db.Numeric(10, 2))
+    writer_id = db.Column(db.Integer, db.ForeignKey(Writer.id))
+    writer = db.relationship(Writer, backref='articles')
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    with app.app_context():
+        writer = Writer(name='ann', password='secret', date_created=CREATED,
+                        date_modified=CREATED)
+        db.session.add_all([
+            Article(id=1, title='one', price=decimal.Decimal('1.50'),
+                    writer=writer, date_created=CREATED,
+                    date_modified=CREATED),
+            Article(id=2, title='two', date_created=CREATED,
+                    date_modified=CREATED)])
+        db.session.commit()
+        yield app
+
+
+def test_default_fields(app):
+    writer = Writer.get(name='ann')
+    assert writer.to_dict() == {
+        'id': writer.id, 'name': 'ann',
+        'date_created': '2020-01-02T03:04:05',
+        'date_modified': '2020-01-02T03:04:05'}
+    # excluded columns can still be asked for by name
+    assert writer.to_dict('name', 'password') == {
+        'name': 'ann', 'password': 'secret'}
+
+
+def test_compiled_once(app):
+    assert Article.serializer('id') is Article.serializer('id')
+    assert Article.serializer('id') is not Article.serializer('title')
+    serializer = Article.serializer(exclude=['date_modified'])
+    assert sorted(serializer.fields) == ['date_created', 'id', 'price',
+                                         'title', 'writer_id']
+    assert 'def serialize(obj)' in serializer.source
+
+
+def test_values(app):
+    articles = Article.load().order_by(Article.id).all()
+    assert Article.serialize(articles, 'id', 'price', 'date_created',
+                             datetime_format='%Y-%m-%d') == [
+        {'id': 1, 'price': 1.5, 'date_created': '2020-01-02'},
+        {'id': 2, 'price': None, 'date_created': '2020-01-02'}]
+    assert isinstance(articles[0].to_dict('price')['price'], float)
+
+
+def test_expired(app):
+    article = Article.get(id=1)
+    article.title = 'changed'
+    db.session.commit()
+    # expired by the commit: read through the attribute
+    assert 'title' not in article.__dict__
+    assert article.to_dict('title') == {'title': 'changed'}
+
+
+def test_nested(app):
+    article = Article.get(id=1)
+    assert article.to_dict('title', 'writer',
+                           nested={'writer': ('name', 'initial')}) == {
+        'title': 'one', 'writer': {'name': 'ann', 'initial': 'a'}}
+    assert Article.get(id=2).to_dict('writer', nested={
+        'writer': ['name']}) == {'writer': None}
+
+    writer = article.writer
+    titles = Writer.serializer('name', 'articles', nested={
+        'articles': Article.serializer('title')})
+    assert titles(writer) == {'name': 'ann', 'articles': [{'title': 'one'}]}
+    options = Writer.serializer('articles', nested={'articles': {
+        'fields': ['date_created'], 'datetime_format': '%Y'}})
+    assert options(writer) == {'articles': [{'date_created': '2020'}]}
+
+
+def test_not_a_relationship(app):
+    with pytest.raises(ValueError):
+        Article.serializer('title', nested={'title': ['id']})
+
+
+def test_rows(app):
+    rows = db.session.query(Article.id, Article.title, Article.price).filter(
+        Article.id == 1)
+    assert Article.serialize(rows, 'id', 'title', 'price') == [
+        {'id': 1, 'title': 'one', 'price': 1.5}]
+
+
+def test_plain_rows():
+    with pytest.raises(ValueError):
+        compile_serializer(None)
+    row = {'when': datetime.date(2020, 1, 2), 'amount': decimal.Decimal('2'),
+           'key': uuid.UUID(int=1), 'name': 'x'}
+
+    class Row(object):
+        def __getattr__(self, name):
+            return row[name]
+
+    serializer = compile_serializer(None, ['when', 'amount', 'key', 'name'])
+    assert serializer(Row()) == {
+        'when': '2020-01-02', 'amount': 2.0,
+        'key': '00000000-0000-0000-0000-000000000001', 'name': 'x'}
+
+
+def test_date_formatter():
+    assert date_formatter()(None) is None
+    assert date_formatter('%d/%m')(CREATED) == '02/01'
+    assert date_formatter(lambda value: value.year)(CREATED) == 2020
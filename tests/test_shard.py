@@ -0,0 +1,151 @@
+# encoding: utf-8
+
+import pytest
+
+from flask import g
+
+from flaskbald.db_ext import db, Model
+from flaskbald.shard import (HashResolver, RangeResolver, Sharded,
+                             commit_shards, shard_engine, shard_session)
+
+SHARDS = ['shard0', 'shard1', 'shard2']
+
+
+class Purchase(Sharded, Model):
+    __tablename__ = 'shard_purchases'
+    __shard_key__ = 'customer_id'
+    __shard_resolver__ = HashResolver(SHARDS)
+    id = db.Column(db.Integer, primary_key=True)
+    customer_id = db.Column(db.Integer)
+    total = db.Column(db.Integer)
+
+
+def test_hash_resolver():
+    resolver = HashResolver(SHARDS)
+    assert resolver(42) == resolver('42')
+    assert set(resolver(key) for key in range(100)) == set(SHARDS)
+
+
+def test_range_resolver():
+    resolver = RangeResolver([(100, 'b'), (0, 'a')])
+    assert (resolver(0), resolver(99), resolver(100), resolver(10 ** 6)) == (
+        'a', 'a', 'b', 'b')
+    with pytest.raises(ValueError):
+        resolver(-1)
+
+
+@pytest.fixture
+def app(make_app, tmpdir):
+    app = make_app({'SQLALCHEMY_BINDS': dict(
+        (shard, 'sqlite:///{0}'.format(tmpdir.join(shard + '.db')))
+        for shard in SHARDS)})
+
+    @app.route('/purchases/<int:id>', methods=['POST'])
+    def update(id):
+        purchase = Purchase.get(id=id)
+        purchase.total += 1
+        return str(purchase.total)
+
+    with app.app_context():
+        Purchase.create_tables()
+        for index in range(20):
+            Purchase(id=index + 1, customer_id=index % 7,
+                     total=index * 37 % 100).save()
+        commit_shards()
+    yield app
+    with app.app_context():
+        for shard in SHARDS:
+            shard_engine(shard).dispose()
+
+
+def shard_ids(shard):
+    return sorted(row[0] for row in shard_engine(shard).execute(
+        'SELECT id FROM shard_purchases'))
+
+
+def test_save(app):
+    with app.app_context():
+        stored = dict((shard, shard_ids(shard)) for shard in SHARDS)
+        assert sorted(sum(stored.values(), [])) == list(range(1, 21))
+        assert len([ids for ids in stored.values() if ids]) > 1
+        for shard, ids in stored.items():
+            assert all(Purchase.shard_for((id - 1) % 7) == shard
+                       for id in ids)
+        # nothing on the default database
+        assert db.session.query(Purchase).count() == 0
+
+
+def test_get(app):
+    with app.app_context():
+        assert Purchase.get(customer_id=3, id=4).total == 11
+        purchase = Purchase.get(id=5)
+        assert purchase.customer_id == 4
+        assert purchase in shard_session(purchase.shard())
+        with pytest.raises(Purchase.NotFound):
+            Purchase.get(id=99)
+        with pytest.raises(Purchase.MultipleFound):
+            Purchase.get()
+        with pytest.raises(Purchase.MultipleFound):
+            Purchase.get(customer_id=3)
+
+
+def test_all(app):
+    with app.app_context():
+        assert sorted(purchase.id for purchase in Purchase.all(
+            customer_id=3)) == [4, 11, 18]
+        totals = sorted((index * 37 % 100 for index in range(20)),
+                        reverse=True)
+        assert [purchase.total for purchase in Purchase.all(
+            _order_by='-total', _limit=5)] == totals[:5]
+        assert [purchase.id for purchase in Purchase.all(
+            _order_by='id')] == list(range(1, 21))
+        assert [purchase.id for purchase in Purchase.all(
+            customer_id=3, _order_by='-id', _limit=2)] == [18, 11]
+
+
+def test_get_many(app):
+    with app.app_context():
+        purchases = Purchase.get_many([7, 99, 1])
+        assert [purchase and purchase.id for purchase in purchases] == [
+            7, None, 1]
+
+
+def test_projections(app):
+    with app.app_context():
+        assert sorted(Purchase.values('id', customer_id=3)) == [4, 11, 18]
+        assert len(Purchase.select('id', 'total')) == 20
+        assert Purchase.version().endswith('-20')
+        assert Purchase.version(customer_id=3).endswith('-3')
+
+
+def test_not_shard_aware(app):
+    with app.app_context():
+        with pytest.raises(ValueError):
+            Purchase.load(id=1)
+        with pytest.raises(ValueError):
+            Purchase.query()
+        with pytest.raises(AttributeError) as error:
+            Purchase.loader
+        assert 'not shard aware' in str(error.value)
+        assert not hasattr(Purchase, 'loader')
+        with pytest.raises(ValueError):
+            Purchase(id=50).save()
+
+
+def test_request_commit(app):
+    client = app.test_client()
+    assert client.post('/purchases/2').data == b'38'
+    assert client.post('/purchases/2').data == b'39'
+    with app.app_context():
+        assert Purchase.get(id=2).total == 39
+
+
+def test_teardown_rollback(app):
+    with app.app_context():
+        Purchase.get(id=3).total = 0
+        Purchase(id=30, customer_id=1, total=1).save(flush=True)
+        sessions = g._flaskbald_shard_sessions
+    assert sessions == {}
+    with app.app_context():
+        assert Purchase.get(id=3).total == 74
+        assert Purchase.get_many([30]) == [None]
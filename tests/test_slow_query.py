@@ -0,0 +1,206 @@
+# encoding: utf-8
+
+import json
+import time
+
+from collections import deque
+
+import pytest
+import sqlalchemy as sa
+
+from flask import request
+
+from flaskbald.db_ext import db, Model
+from flaskbald.log import (SlowQueryLog, PLAN_PENDING, redact_parameters,
+                           slow_query_log)
+
+
+class Entry(Model):
+    __tablename__ = 'slow_entries'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20))
+
+
+@pytest.fixture
+def engine(tmpdir):
+    engine = sa.create_engine('sqlite:///{0}'.format(tmpdir.join('db')))
+    engine.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)')
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def recorder(engine):
+    recorder = SlowQueryLog(threshold=0)
+    recorder.enable(engine)
+    yield recorder
+    recorder.disable(engine)
+
+
+def wait_for_plan(entry):
+    deadline = time.time() + 5
+    while entry['plan'] == PLAN_PENDING and time.time() < deadline:
+        time.sleep(0.01)
+    return entry['plan']
+
+
+def test_record(engine, recorder):
+    engine.execute('SELECT * FROM items WHERE id = ?', 1)
+    entry = recorder.snapshot()[-1]
+    assert entry['statement'] == 'SELECT * FROM items WHERE id = ?'
+    assert entry['parameters'] == [1]
+    assert entry['source'] is None
+    assert 'items' in ' '.join(wait_for_plan(entry))
+
+    # the plan is cached per statement
+    engine.execute('SELECT * FROM items WHERE id = ?', 2)
+    assert recorder.snapshot()[-1]['plan'] is entry['plan']
+
+
+def test_threshold(engine, recorder):
+    recorder.threshold = 10
+    engine.execute('SELECT 1')
+    assert recorder.snapshot() == []
+    recorder.disable(engine)
+    recorder.threshold = 0
+    engine.execute('SELECT 1')
+    assert recorder.snapshot() == []
+
+
+def test_not_explained(engine, recorder):
+    engine.execute('INSERT INTO items (name) VALUES (?)', 'a')
+    assert recorder.snapshot()[-1]['plan'] is None
+    recorder.explain = False
+    engine.execute('SELECT * FROM items')
+    assert recorder.snapshot()[-1]['plan'] is None
+
+
+def test_explain_failed(engine, recorder):
+    assert recorder.plan(engine, 'SELECT * FROM missing', ()).startswith(
+        'EXPLAIN failed')
+
+
+def test_explain_engine_failed(engine, recorder, monkeypatch):
+    def explain_engine(url):
+        raise RuntimeError('no connection')
+
+    monkeypatch.setattr(recorder, 'explain_engine', explain_engine)
+    engine.execute('SELECT * FROM items')
+    entry = recorder.snapshot()[-1]
+    assert wait_for_plan(entry) == 'EXPLAIN failed: no connection'
+    assert recorder._pending == 0
+
+
+def test_plan_per_database(engine, recorder, tmpdir):
+    other = sa.create_engine('sqlite:///{0}'.format(tmpdir.join('other')))
+    other.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)')
+    other.execute('CREATE INDEX items_name ON items (name)')
+    statement = 'SELECT * FROM items WHERE name = ?'
+    recorder.enable(other)
+    try:
+        engine.execute(statement, 'a')
+        other.execute(statement, 'a')
+        plans = [wait_for_plan(entry) for entry in recorder.snapshot()]
+    finally:
+        recorder.disable(other)
+        other.dispose()
+    assert 'items_name' not in ' '.join(plans[0])
+    assert 'items_name' in ' '.join(plans[1])
+
+
+def test_failed_statement(engine, recorder):
+    with engine.connect() as conn:
+        for index in range(3):
+            with pytest.raises(sa.exc.OperationalError):
+                conn.execute('SELECT * FROM missing')
+        assert conn.info['slow_query_start'] == {}
+        conn.execute('SELECT 1')
+        assert conn.info['slow_query_start'] == {}
+    assert [entry['statement'] for entry in recorder.snapshot()] == [
+        'SELECT 1']
+
+
+def test_max_pending(engine, recorder):
+    recorder.max_pending = 0
+    engine.execute('SELECT * FROM items')
+    assert recorder.snapshot()[-1]['plan'] is None
+
+
+def test_redact(engine, recorder):
+    recorder.redact = True
+    engine.execute('SELECT * FROM items WHERE name = ?', 'secret')
+    assert recorder.snapshot()[-1]['parameters'] == ['?']
+    recorder.redact = lambda parameters: 'hidden'
+    engine.execute('SELECT * FROM items WHERE name = ?', 'secret')
+    assert recorder.snapshot()[-1]['parameters'] == 'hidden'
+    assert redact_parameters({'a': 1, 'b': [2, 3]}) == {'a': '?', 'b': '?'}
+    assert redact_parameters([(1, 2), 3]) == [['?', '?'], '?']
+
+
+def test_maxlen_dump(engine, recorder, tmpdir):
+    recorder.entries = deque(maxlen=2)
+    for index in range(3):
+        engine.execute('SELECT {0}'.format(index))
+    assert [entry['statement'] for entry in recorder.snapshot()] == [
+        'SELECT 1', 'SELECT 2']
+    path = str(tmpdir.join('slow.jsonl'))
+    assert recorder.dump(path) == 2
+    with open(path) as dump:
+        assert [json.loads(line)['statement'] for line in dump] == [
+            'SELECT 1', 'SELECT 2']
+    recorder.clear()
+    assert recorder.snapshot() == []
+
+
+@pytest.fixture
+def make_log_app(make_app, monkeypatch):
+    '''Apps recording every statement with the shared slow_query_log.'''
+    for name in ('threshold', 'explain', 'redact', 'authorize'):
+        monkeypatch.setattr(slow_query_log, name,
+                            getattr(slow_query_log, name))
+    monkeypatch.setattr(slow_query_log, 'entries', deque(maxlen=200))
+
+    def make_log_app(**settings):
+        app = make_app(dict({'SLOW_QUERY_THRESHOLD': 0}, **settings))
+
+        @app.route('/entries')
+        def entries():
+            return str(len(Entry.all()))
+
+        return app
+
+    yield make_log_app
+    slow_query_log.disable()
+
+
+def test_app_source(make_log_app):
+    app = make_log_app(SLOW_QUERY_REDACT=True, SLOW_QUERY_MAXLEN=10)
+    app.test_client().get('/entries')
+    entry = slow_query_log.snapshot()[-1]
+    assert entry['source'] == 'GET /entries (entries)'
+    assert 'slow_entries' in entry['statement']
+    assert slow_query_log.entries.maxlen == 10
+    assert slow_query_log.redact is True
+
+
+def test_app_url(make_log_app, monkeypatch):
+    with pytest.raises(ValueError):
+        make_log_app(SLOW_QUERY_URL='/_slow')
+
+    monkeypatch.setattr(slow_query_log, 'authorize',
+                        lambda: request.headers.get('X-Admin') == 'yes')
+    app = make_log_app(SLOW_QUERY_URL='/_slow')
+    client = app.test_client()
+    client.get('/entries')
+    assert client.get('/_slow').status_code == 403
+    response = client.get('/_slow', headers={'X-Admin': 'yes'})
+    data = json.loads(response.data.decode('utf-8'))['data']
+    assert any(entry['source'] == 'GET /entries (entries)'
+               for entry in data)
+
+
+def test_memory_database_not_explained(make_log_app):
+    app = make_log_app()
+    with app.app_context():
+        Entry.all()
+    assert slow_query_log.snapshot()[-1]['plan'] is None